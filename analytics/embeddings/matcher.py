@@ -0,0 +1,189 @@
+import re
+from typing import Dict, List, Optional, Pattern, Set, Tuple
+
+try:
+    from re import _parser as _sre_parse, _constants as _sre_const
+    from re._casefix import _EXTRA_CASES
+    _EQUIVALENCES = [(lo, *extra) for lo, extra in _EXTRA_CASES.items()]
+except ImportError:  # Python < 3.11
+    import sre_parse as _sre_parse
+    import sre_constants as _sre_const
+    from sre_compile import _equivalences as _EQUIVALENCES
+
+from analytics.embeddings.patterns import PATTERNS
+
+_REPEATS = {getattr(_sre_const, op) for op in ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT") if hasattr(_sre_const, op)}
+
+# символы, которые re.IGNORECASE считает равными, сводятся к одному (ſ -> s, ı -> i и т.п.),
+# чтобы префильтр по lower() не отсеял то, что нашёл бы сам шаблон
+_FOLD = {cp: min(group) for group in _EQUIVALENCES for cp in group if cp != min(group)}
+
+
+def fold(text: str) -> str:
+    return text.lower().translate(_FOLD)
+
+
+def required_literal(pattern: Pattern) -> Optional[str]:
+    """
+    Самая длинная цепочка символов, без которой шаблон не может совпасть
+    (например, "python" для \\bpython\\b), в свёрнутом регистре. None — такой нет,
+    и шаблон проверяется на каждом тексте.
+    """
+    try:
+        parsed = _sre_parse.parse(pattern.pattern, pattern.flags)
+    except re.error:
+        return None
+    best, run = "", []
+    for op, av in parsed:
+        if op is _sre_const.LITERAL:
+            run.append(chr(av))
+            continue
+        if op is _sre_const.AT:
+            # \b, ^, $ не занимают символов — цепочка не прерывается
+            continue
+        if op in _REPEATS and av[0] >= 1 and len(av[2]) == 1 and av[2][0][0] is _sre_const.LITERAL:
+            # c+ (и c++ в Python 3.11+): один символ обязателен, дальше цепочка рвётся
+            run.append(chr(av[2][0][1]))
+        if len(run) > len(best):
+            best = "".join(run)
+        run = []
+    if len(run) > len(best):
+        best = "".join(run)
+    return fold(best) or None
+
+
+def trie_regex(words: List[str]) -> str:
+    """
+    Альтернатива слов, свёрнутая в префиксное дерево: (?:py(?:thon|torch)|rust)...
+    re проверяет на каждой позиции одну ветку на символ вместо всех слов подряд
+    и находит самое длинное слово, начинающееся в этой позиции.
+    """
+    trie: dict = {}
+    for w in words:
+        node = trie
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def build(node: dict) -> str:
+        alts = [re.escape(ch) + build(sub) for ch, sub in sorted(node.items()) if ch]
+        if not alts:
+            return ""
+        body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        return "(?:" + body + ")?" if "" in node else body
+
+    return build(trie)
+
+
+class TechMatcher:
+    """
+    Поиск всех технологий из PATTERNS в тексте за один проход.
+
+    Из каждого шаблона извлекается обязательный литерал, все литералы собираются
+    в одно регулярное выражение-префиксное дерево. Один проход finditer по тексту
+    находит все литералы (в том числе перекрывающиеся), и сами шаблоны запускаются
+    только там, где их литерал есть. Результат совпадает с проверкой каждого
+    шаблона по отдельности: литерал — необходимое условие совпадения.
+
+    Объект дешево передаётся в другие процессы: при pickle сохраняются только
+    исходные шаблоны, индекс строится заново.
+    """
+
+    def __init__(self, patterns: Dict[str, List[Pattern]] = PATTERNS):
+        self.patterns = patterns
+        self.techs_order = list(patterns)
+        self._build()
+
+    def _build(self) -> None:
+        rank = {tech: i for i, tech in enumerate(self.techs_order)}
+        # литерал -> [(ранг технологии, шаблон)]
+        self._by_literal: Dict[str, List[Tuple[int, Pattern]]] = {}
+        self._always: List[Tuple[int, Pattern]] = []
+        for tech, pats in self.patterns.items():
+            for pat in pats:
+                lit = required_literal(pat)
+                if lit is None:
+                    self._always.append((rank[tech], pat))
+                else:
+                    self._by_literal.setdefault(lit, []).append((rank[tech], pat))
+
+        # в каждой позиции дерево находит самый длинный литерал; более короткие,
+        # начинающиеся там же, — его префиксы, они тоже есть в тексте
+        lits = list(self._by_literal)
+        self._prefixes: Dict[str, List[str]] = {
+            lit: [other for other in lits if lit.startswith(other)] for lit in lits
+        }
+        self._prefilter = re.compile("(?=(" + trie_regex(lits) + "))") if lits else None
+
+    def __getstate__(self):
+        return {tech: [(p.pattern, p.flags) for p in pats] for tech, pats in self.patterns.items()}
+
+    def __setstate__(self, state):
+        self.patterns = {tech: [re.compile(p, f) for p, f in pats] for tech, pats in state.items()}
+        self.techs_order = list(self.patterns)
+        self._build()
+
+    def _candidates(self, text: str) -> List[Tuple[int, Pattern]]:
+        cands = list(self._always)
+        if self._prefilter is None:
+            return cands
+        found = {m.group(1) for m in self._prefilter.finditer(fold(text))}
+        for lit in {p for lit in found for p in self._prefixes[lit]}:
+            cands.extend(self._by_literal[lit])
+        return cands
+
+    def matches(self, text: str) -> List[Tuple[str, int]]:
+        """
+        [(технология, позиция первого совпадения)] по возрастанию позиции;
+        при равных позициях — в порядке PATTERNS.
+        """
+        if not text:
+            return []
+        first: Dict[int, int] = {}
+        for rank, pat in self._candidates(text):
+            m = pat.search(text)
+            if m and (rank not in first or m.start() < first[rank]):
+                first[rank] = m.start()
+        return [(self.techs_order[r], pos) for r, pos in sorted(first.items(), key=lambda x: (x[1], x[0]))]
+
+    def techs(self, text: str) -> Set[str]:
+        """Множество найденных технологий; после первого совпадения остальные шаблоны технологии не проверяются."""
+        if not text:
+            return set()
+        found: Set[int] = set()
+        for rank, pat in self._candidates(text):
+            if rank not in found and pat.search(text):
+                found.add(rank)
+        return {self.techs_order[r] for r in found}
+
+    def counts(self, text: str) -> Dict[str, int]:
+        """
+        {технология: число упоминаний}. Совпадения разных шаблонов одной технологии,
+        перекрывающиеся в тексте (postgres и postgresql), считаются одним упоминанием.
+        """
+        if not text:
+            return {}
+        spans: Dict[int, List[Tuple[int, int]]] = {}
+        for rank, pat in self._candidates(text):
+            for m in pat.finditer(text):
+                spans.setdefault(rank, []).append(m.span())
+        out: Dict[str, int] = {}
+        for rank, found in spans.items():
+            n, end = 0, -1
+            for start, stop in sorted(found):
+                if start >= end:
+                    n += 1
+                end = max(end, stop)
+            out[self.techs_order[rank]] = n
+        return out
+
+
+_MATCHERS: Dict[int, TechMatcher] = {}
+
+
+def get_matcher(patterns: Dict[str, List[Pattern]] = PATTERNS) -> TechMatcher:
+    """Общий на процесс TechMatcher для словаря шаблонов (строится один раз)."""
+    m = _MATCHERS.get(id(patterns))
+    if m is None or m.patterns is not patterns:
+        m = _MATCHERS[id(patterns)] = TechMatcher(patterns)
+    return m
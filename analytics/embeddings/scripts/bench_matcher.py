@@ -0,0 +1,136 @@
+import argparse
+import re
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from pathlib import Path
+from time import perf_counter
+from typing import Dict, List, Set
+
+from analytics.embeddings.matcher import TechMatcher, get_matcher
+from analytics.embeddings.patterns import PATTERNS
+
+_WORKER_MATCHER: TechMatcher | None = None
+
+
+def naive_techs(title: str) -> Set[str]:
+    """Прежний classify_tech.match_techs: все шаблоны всех технологий по очереди."""
+    text = title.lower()
+    hits = set()
+    for tech, pats in PATTERNS.items():
+        for pat in pats:
+            if pat.search(text):
+                hits.add(tech)
+                break
+    return hits
+
+
+_ALTERNATIONS: Dict[str, re.Pattern] = {
+    canon: re.compile("|".join(p.pattern for p in plist), re.IGNORECASE)
+    for canon, plist in PATTERNS.items()
+}
+
+
+def alternation_matches(title: str) -> List[str]:
+    """Прежний calculate_irr.extract_tech_regex без среза [:3]: одна альтернатива на технологию."""
+    hits = []
+    for canon, pat in _ALTERNATIONS.items():
+        m = pat.search(title)
+        if m:
+            hits.append((canon, m.start()))
+    return [canon for canon, _ in sorted(hits, key=lambda x: x[1])]
+
+
+def load_titles(args) -> List[str]:
+    if args.input:
+        with Path(args.input).open("r", encoding="utf-8") as f:
+            return [line.rstrip("\n") for line in islice(f, args.n) if line.strip()]
+    from db import session_scope
+    from db.queries import iter_story_titles
+    with session_scope(args.db) as session:
+        return [title for _, title in iter_story_titles(session, limit=args.n)]
+
+
+def _init_worker(matcher: TechMatcher) -> None:
+    global _WORKER_MATCHER
+    _WORKER_MATCHER = matcher
+
+
+def _count_hits(titles: List[str]) -> int:
+    return sum(len(_WORKER_MATCHER.techs(t)) for t in titles)
+
+
+def timed(fn, titles: List[str]):
+    t0 = perf_counter()
+    out = [fn(t) for t in titles]
+    return out, perf_counter() - t0
+
+
+def parse_args():
+    p = argparse.ArgumentParser(
+        prog="bench_matcher",
+        description="Сравнение скорости TechMatcher с прежним поиском технологий по PATTERNS"
+    )
+    src = p.add_mutually_exclusive_group(required=True)
+    src.add_argument("-i", "--input", help="Файл с заголовками, по одному в строке")
+    src.add_argument("-d", "--db", help="DB URL (например, sqlite:///hn.db) — заголовки берутся из story")
+    p.add_argument("-n", type=int, default=1_000_000,
+                   help="Сколько заголовков прогнать; если в источнике меньше, они повторяются (по умолчанию 1000000)")
+    p.add_argument("--baseline", type=int, default=20_000,
+                   help="На скольких заголовках замерять прежние способы и сверять результаты (по умолчанию 20000)")
+    p.add_argument("-j", "--jobs", type=int, default=1,
+                   help="Дополнительно прогнать TechMatcher в N процессах (матчер передаётся через pickle)")
+    return p.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    try:
+        source = load_titles(args)
+        if not source:
+            raise ValueError("нет заголовков")
+        titles = [source[i % len(source)] for i in range(args.n)]
+        sample = titles[:args.baseline]
+        print(f"Заголовков: {len(titles)} (уникальных в источнике: {len(source)}), "
+              f"шаблонов: {sum(len(p) for p in PATTERNS.values())} у {len(PATTERNS)} технологий")
+
+        t0 = perf_counter()
+        matcher = get_matcher()
+        print(f"Сборка TechMatcher: {(perf_counter() - t0) * 1000:.0f} ms")
+
+        naive, t_naive = timed(naive_techs, sample)
+        alt, t_alt = timed(alternation_matches, sample)
+        fast_sets, _ = timed(lambda t: matcher.techs(t.lower()), sample)
+        fast_lists, _ = timed(lambda t: [c for c, _ in matcher.matches(t)], sample)
+        if fast_sets != naive or fast_lists != alt:
+            bad = sum(a != b for a, b in zip(fast_sets, naive)) + sum(a != b for a, b in zip(fast_lists, alt))
+            raise RuntimeError(f"результаты TechMatcher расходятся с прежними на {bad} заголовках")
+        print(f"Сверка на {len(sample)} заголовках: результаты совпадают")
+
+        _, t_techs = timed(matcher.techs, titles)
+        _, t_matches = timed(matcher.matches, titles)
+
+        n = len(titles)
+        rows = [
+            ("по шаблонам (match_techs)", t_naive / len(sample)),
+            ("альтернативы (extract_tech_regex)", t_alt / len(sample)),
+            ("TechMatcher.techs", t_techs / n),
+            ("TechMatcher.matches", t_matches / n),
+        ]
+        for name, per_title in rows:
+            print(f"{name:36s} {per_title * 1e6:8.1f} us/заголовок  ~{per_title * n:8.1f}s на {n}")
+
+        if args.jobs > 1:
+            chunk = 10_000
+            t0 = perf_counter()
+            with ProcessPoolExecutor(max_workers=args.jobs, initializer=_init_worker, initargs=(matcher,)) as ex:
+                hits = sum(ex.map(_count_hits, (titles[i:i + chunk] for i in range(0, n, chunk))))
+            elapsed = perf_counter() - t0
+            print(f"TechMatcher.techs, {args.jobs} процессов: {elapsed:.1f}s, найдено {hits} упоминаний")
+        return 0
+    except Exception as e:
+        print(f"Ошибка: {e}")
+        return 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,4 +1,3 @@
-import re
 import argparse
 import pandas as pd
 import numpy as np
@@ -11,16 +10,12 @@ import warnings
 warnings.filterwarnings('ignore')
 from db.queries import iter_tech_names
 from db.session import session_scope
-from analytics.embeddings.patterns import PATTERNS
+from db.columnar import ds, read_columns, read_snapshot, require_pyarrow
+from db.incremental import parse_time
+from analytics.embeddings.matcher import get_matcher
 from utils.groups import categories as RAW_CATEGORIES  # <-- прямой импорт категорий
 
 
-COMPILED: dict[str, re.Pattern] = {
-    canon: re.compile("|".join(p.pattern for p in plist), re.IGNORECASE)
-    for canon, plist in PATTERNS.items()
-}
-
-
 def normalize_token(name: str) -> str:
     return name.strip().lower().replace(" ", "_")
 
@@ -73,13 +68,8 @@ def build_group_maps(w2v: Word2Vec, raw_categories: dict):
 def extract_tech_regex(text: str) -> list[str]:
     if not isinstance(text, str) or not text:
         return []
-    hits = []
-    for canon, pat in COMPILED.items():
-        m = pat.search(text)
-        if m:
-            hits.append((canon, m.start()))
-    hits_sorted = [canon for canon, _ in sorted(hits, key=lambda x: x[1])]
-    return list(dict.fromkeys(hits_sorted))[:3]
+    # технологии по позиции первого упоминания, при равенстве — в порядке PATTERNS
+    return [canon for canon, _ in get_matcher().matches(text)[:3]]
 
 
 def cos(a, b):
@@ -148,7 +138,11 @@ def parse_args():
         description="Calculate IRR coefficients"
     )
     p.add_argument("-m", "--model", required=True, help="Path to model")
-    p.add_argument("-i", "--input", required=True, help="Path to input file")
+    p.add_argument("-i", "--input", default=None, help="Path to input file (csv, parquet or arrow from export_stories_meta)")
+    p.add_argument("--snapshot", default=None,
+                   help="Read stories directly from a db.scripts.snapshot directory instead of --input")
+    p.add_argument("--since", default=None, help="With --snapshot: only stories with time >= this date (ISO or unix)")
+    p.add_argument("--until", default=None, help="With --snapshot: only stories with time < this date (ISO or unix)")
     p.add_argument("-o", "--output", required=True, help="Path to output file")
     p.add_argument("--db", help="Database connection string", default=None)
     p.add_argument("--limit", type=int, help="Limit for tech names", default=None)
@@ -165,7 +159,20 @@ def main() -> int:
     args = parse_args()
     try:
         print("Loading data...")
-        df = pd.read_csv(args.input, usecols=['title', 'descendants'])
+        if args.snapshot:
+            # только две колонки и только подходящие месяцы/группы строк — фильтры уходят в сканер
+            require_pyarrow()
+            df = read_snapshot(
+                args.snapshot, "story", columns=['title', 'descendants'],
+                filter=ds.field('descendants') >= 0,
+                since=parse_time(args.since) if args.since else None,
+                until=parse_time(args.until) if args.until else None,
+            )
+        elif args.input:
+            # csv, parquet или arrow (по расширению); arrow читается через memory map
+            df = read_columns(args.input, ['title', 'descendants'])
+        else:
+            raise ValueError("Specify --input or --snapshot")
 
         print(f"Original data: {len(df)} rows")
         print(f"Descendants range: min={df['descendants'].min()}, max={df['descendants'].max()}")
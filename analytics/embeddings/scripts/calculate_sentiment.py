@@ -9,6 +9,7 @@ from gensim.models import Word2Vec
 from collections import defaultdict
 from sklearn.linear_model import LogisticRegression
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+from db.columnar import snapshot_tech_comments
 
 def tokenize(text):
     return re.findall(r"[a-z]+", text.lower())
@@ -233,6 +234,11 @@ def read_comments_from_file(path):
 def process_single_file(file_path, model_titles, model_comments, polarity_lex, vader, mode, keyword, 
                         auto_thr, auto_percent, threshold, p, neg_window, top_percent):
     comments = read_comments_from_file(file_path)
+    return process_comments(comments, file_path, model_titles, model_comments, polarity_lex, vader, mode, keyword,
+                            auto_thr, auto_percent, threshold, p, neg_window, top_percent)
+
+def process_comments(comments, file_path, model_titles, model_comments, polarity_lex, vader, mode, keyword,
+                     auto_thr, auto_percent, threshold, p, neg_window, top_percent):
     rows = []
     thr_used = threshold
 
@@ -315,6 +321,9 @@ def parse_args():
     )
     p.add_argument("-i", "--input", type=str, help="Путь к одному файлу (по одному комментарию в строке).")
     p.add_argument("-d", "--dir", type=str, help="Папка с файлами для пакетной обработки.")
+    p.add_argument("--snapshot", type=str, default=None,
+                   help="Папка снимка db.scripts.snapshot: комментарии технологий читаются из него без txt-файлов.")
+    p.add_argument("--techs", nargs="+", default=None, help="С --snapshot: только эти технологии (по умолчанию все).")
     p.add_argument("--pattern", type=str, default="*.txt", help="Глоб‑шаблон для выбора файлов в папке (например, *.txt).")
     p.add_argument("--recursive", action="store_true", help="Рекурсивный проход по подпапкам.")
     p.add_argument("--titles-kv", type=str, default="w2v_titles.kv", help="Путь к модели w2v (заголовки).")
@@ -363,7 +372,15 @@ def main():
         w2v_pol = expand_lexicon(seed_pos, seed_neg, model_comments, topn=100, sim_thr=0.62)
         polarity_lex = merge_lexicons(w2v_pol, vader_lex) if vader_lex else w2v_pol
 
-        if args.input:
+        sources = {}
+        if args.snapshot:
+            # вместо путей к файлам — имена технологий, комментарии уже в памяти
+            sources = {name: texts for name, texts in snapshot_tech_comments(args.snapshot, args.techs).items() if texts}
+            files = list(sources)
+            if not files:
+                print("В снимке нет комментариев выбранных технологий.", file=sys.stderr)
+                sys.exit(1)
+        elif args.input:
             files = [args.input]
         elif args.dir:
             files = list_files_in_dir(args.dir, pattern=args.pattern, recursive=args.recursive)
@@ -377,11 +394,18 @@ def main():
         summaries = []
         for fp in files:
             print(f"Processing: {fp}", file=sys.stderr)
-            rows, summary = process_single_file(
-                fp, model_titles, model_comments, polarity_lex, vader, args.mode, args.keyword,
-                args.auto_thr, args.auto_percent, args.threshold,
-                args.p, args.neg_window, args.top_percent
-            )
+            if fp in sources:
+                rows, summary = process_comments(
+                    sources[fp], fp, model_titles, model_comments, polarity_lex, vader, args.mode, args.keyword,
+                    args.auto_thr, args.auto_percent, args.threshold,
+                    args.p, args.neg_window, args.top_percent
+                )
+            else:
+                rows, summary = process_single_file(
+                    fp, model_titles, model_comments, polarity_lex, vader, args.mode, args.keyword,
+                    args.auto_thr, args.auto_percent, args.threshold,
+                    args.p, args.neg_window, args.top_percent
+                )
             summaries.append(summary)
 
             if args.save_rows_dir:
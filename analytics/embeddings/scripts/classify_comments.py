@@ -0,0 +1,225 @@
+import re
+import argparse
+from time import perf_counter
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.orm import Session
+
+from db import session_scope
+from db.migrate import ensure_columns, ensure_indexes
+from db.models import Base, Comment, Story, Tech, comment_tech, story_tech_mentions
+from analytics.embeddings.patterns import PATTERNS
+from analytics.embeddings.matcher import TechMatcher, get_matcher
+from analytics.embeddings.scripts.classify_tech import (
+    TrackedBatches, ensure_techs, insert_ignore, iter_text_batches, map_batches, mark_classified, patterns_fingerprint,
+)
+from utils.clean_text import clean_text
+
+_WORKER: Optional[Tuple[TechMatcher, Dict[str, int]]] = None
+
+
+def _init_worker(matcher: TechMatcher, tech_ids: Dict[str, int]) -> None:
+    global _WORKER
+    _WORKER = (matcher, tech_ids)
+
+
+def _tag_batch(batch: List[Tuple[int, str]]) -> List[dict]:
+    """Строки comment_tech для пакета комментариев (выполняется в процессе пула)."""
+    matcher, tech_ids = _WORKER
+    return [
+        {"comment_id": comment_id, "tech_id": tech_ids[name], "count": n}
+        for comment_id, text in batch
+        for name, n in matcher.counts(clean_text(text).lower()).items()
+    ]
+
+
+def upsert_counts(session: Session):
+    """
+    INSERT ... ON CONFLICT DO UPDATE для comment_tech: при повторной разметке
+    (--start-id, изменившиеся PATTERNS) count уже записанной пары обновляется.
+    """
+    dialect = session.bind.dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        stmt = sqlite_insert(comment_tech)
+        return stmt.on_conflict_do_update(index_elements=[comment_tech.c.comment_id, comment_tech.c.tech_id],
+                                          set_={"count": stmt.excluded["count"]})
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+        stmt = pg_insert(comment_tech)
+        return stmt.on_conflict_do_update(index_elements=[comment_tech.c.comment_id, comment_tech.c.tech_id],
+                                          set_={"count": stmt.excluded["count"]})
+    if dialect in ("mysql", "mariadb"):
+        from sqlalchemy.dialects.mysql import insert as my_insert
+        stmt = my_insert(comment_tech)
+        return stmt.on_duplicate_key_update(count=stmt.inserted["count"])
+    return insert_ignore(session, comment_tech)
+
+
+def _tag_pass(session: Session,
+              stmt,
+              patterns: Dict[str, List[re.Pattern]],
+              tech_ids: Dict[str, int],
+              batch_size: int,
+              jobs: int,
+              id_range: Optional[Tuple[int, int]],
+              unclassified: bool,
+              mark: bool,
+              totals: dict,
+              progress=None) -> None:
+    """Один проход по комментариям с матчером из patterns; каждый пакет — отдельная транзакция."""
+    where = [Comment.techs_classified.is_(None)] if unclassified else []
+    batches = TrackedBatches(iter_text_batches(session, Comment.id, Comment.text, batch_size=batch_size,
+                                               id_range=id_range, where=where))
+    for rows in map_batches(_tag_batch, batches, jobs=jobs, initializer=_init_worker,
+                            initargs=(get_matcher(patterns), tech_ids)):
+        # пул читает на пакет вперёд: берём границы именно записанного пакета
+        n, first_id, last_id = batches.read.popleft()
+        if rows:
+            session.execute(stmt, rows)
+        if mark:
+            mark_classified(session, Comment.id, Comment.techs_classified, first_id, last_id)
+        session.commit()
+        totals["comments"] += n
+        totals["rows"] += len(rows)
+        totals["last_id"] = last_id
+        if progress:
+            progress(last_id, totals["comments"], totals["rows"])
+
+
+def tag_comments(session: Session,
+                 patterns: Dict[str, List[re.Pattern]] = PATTERNS,
+                 batch_size: int = 20000,
+                 jobs: int = 1,
+                 start_id: Optional[int] = None,
+                 full: bool = False,
+                 incremental: bool = False,
+                 progress=None) -> dict:
+    """
+    Размечает comment.text технологиями PATTERNS и пишет comment_tech с числом упоминаний.
+
+    Комментарии читаются как (id, text) пакетами по возрастанию id; очистка HTML
+    (clean_text) и поиск TechMatcher идут в пуле из jobs процессов. Каждый пакет
+    пишется upsert-ом (count уже записанных пар обновляется) и коммитится отдельно
+    вместе с отметкой comment.techs_classified, так что журнал не растёт с размером
+    таблицы, а прерванный запуск продолжается с того же места.
+
+    full=True сначала очищает comment_tech. incremental=True читает только
+    неразмеченные комментарии (techs_classified IS NULL) — в том числе с меньшими id,
+    загруженные позже, — а технологии с изменившимися шаблонами (или новые)
+    размечает заново по всем комментариям, как classify_tech. start_id — только
+    комментарии с id >= start_id. Возвращает comments/rows/last_id/stale.
+    """
+    bind = session.get_bind()
+    Base.metadata.create_all(bind, tables=[comment_tech, story_tech_mentions])
+    ensure_columns(bind, [Tech.__table__, Comment.__table__])
+    ensure_indexes(bind, [Comment.__table__])
+    tech_by_name = ensure_techs(session, patterns.keys())
+    tech_ids = {name: tech_by_name[name].id for name in patterns}
+    stmt = upsert_counts(session)
+    totals = {"comments": 0, "rows": 0, "last_id": None, "stale": []}
+
+    if full:
+        session.execute(delete(comment_tech))
+        session.commit()
+
+    if incremental:
+        stale = [name for name in patterns
+                 if tech_by_name[name].comments_hash != patterns_fingerprint(patterns[name])]
+        fresh = [name for name in patterns if name not in stale]
+        totals["stale"] = stale
+        if fresh:
+            _tag_pass(session, stmt, {name: patterns[name] for name in fresh}, tech_ids, batch_size, jobs,
+                      None, unclassified=True, mark=True, totals=totals, progress=progress)
+        if stale:
+            session.execute(delete(comment_tech).where(comment_tech.c.tech_id.in_([tech_ids[n] for n in stale])))
+            session.commit()
+            # если переразмечаются все технологии, этот проход сам отмечает комментарии размеченными
+            _tag_pass(session, stmt, {name: patterns[name] for name in stale}, tech_ids, batch_size, jobs,
+                      None, unclassified=False, mark=not fresh, totals=totals, progress=progress)
+    else:
+        id_range = (start_id, session.execute(select(func.max(Comment.id))).scalar() or 0) if start_id else None
+        _tag_pass(session, stmt, patterns, tech_ids, batch_size, jobs, id_range,
+                  unclassified=False, mark=True, totals=totals, progress=progress)
+
+    if start_id is None:
+        # все комментарии проверены текущими шаблонами каждой технологии
+        for name in patterns:
+            tech_by_name[name].comments_hash = patterns_fingerprint(patterns[name])
+        session.commit()
+    return totals
+
+
+def rebuild_story_mentions(session: Session) -> int:
+    """
+    Пересобирает story_tech_mentions одним INSERT ... SELECT ... GROUP BY в СУБД:
+    на каждую пару (история ветки, технология) — число комментариев с упоминанием
+    и сумма упоминаний. Комментарии без root_story_id или без истории в БД не учитываются.
+    """
+    agg = (
+        select(Comment.root_story_id, comment_tech.c.tech_id,
+               func.count(), func.sum(comment_tech.c.count))
+        .select_from(comment_tech)
+        .join(Comment, Comment.id == comment_tech.c.comment_id)
+        .join(Story, Story.id == Comment.root_story_id)
+        .group_by(Comment.root_story_id, comment_tech.c.tech_id)
+    )
+    session.execute(delete(story_tech_mentions))
+    session.execute(insert(story_tech_mentions).from_select(["story_id", "tech_id", "comments", "mentions"], agg))
+    session.commit()
+    return session.execute(select(func.count()).select_from(story_tech_mentions)).scalar_one()
+
+
+def parse_args():
+    p = argparse.ArgumentParser(
+        prog="classify_comments",
+        description="Разметка технологий в тексте комментариев (comment_tech) и агрегат по историям (story_tech_mentions)"
+    )
+    p.add_argument("-d", "--db", required=True, help="DB URL (например, sqlite:///hn.db)")
+    p.add_argument("-j", "--jobs", type=int, default=1, help="Процессов для очистки и сопоставления текста (по умолчанию 1)")
+    p.add_argument("-b", "--batch-size", type=int, default=20000,
+                   help="Комментариев в одном пакете чтения/вставки (по умолчанию 20000)")
+    mode = p.add_mutually_exclusive_group()
+    mode.add_argument("--full", action="store_true", help="Очистить comment_tech и разметить все комментарии заново")
+    mode.add_argument("--start-id", type=int, default=None,
+                      help="Размечать комментарии с id >= START_ID (продолжение прерванного запуска или новые комментарии)")
+    mode.add_argument("--incremental", action="store_true",
+                      help="Размечать только неразмеченные комментарии (comment.techs_classified IS NULL) "
+                           "и заново — технологии с изменившимися шаблонами")
+    p.add_argument("-p", "--progress-every", type=int, default=10, help="Печатать прогресс каждые N пакетов (по умолчанию 10)")
+    p.add_argument("--no-aggregate", action="store_true", help="Не пересобирать story_tech_mentions")
+    return p.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    try:
+        t0 = perf_counter()
+        chunks = 0
+
+        def progress(last_id, comments, rows):
+            nonlocal chunks
+            chunks += 1
+            if chunks % args.progress_every == 0:
+                print(f"[id<={last_id}] комментариев={comments} строк comment_tech={rows} {perf_counter() - t0:.1f}s")
+
+        with session_scope(args.db) as session:
+            stats = tag_comments(session, batch_size=args.batch_size, jobs=args.jobs, start_id=args.start_id,
+                                 full=args.full, incremental=args.incremental, progress=progress)
+            if stats["stale"]:
+                print(f"Размечены заново по всем комментариям ({len(stats['stale'])}): {', '.join(stats['stale'])}")
+            print(f"Размечено комментариев: {stats['comments']}, строк comment_tech: {stats['rows']} "
+                  f"за {perf_counter() - t0:.1f}s")
+            if not args.no_aggregate:
+                t1 = perf_counter()
+                pairs = rebuild_story_mentions(session)
+                print(f"story_tech_mentions: {pairs} пар (история, технология) за {perf_counter() - t1:.1f}s")
+        return 0
+    except Exception as e:
+        print(f"Ошибка: {e}")
+        return 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,16 +1,24 @@
+import hashlib
+import json
 import re
-from typing import Dict, List, Iterable, Set
+from multiprocessing import Pool
+from time import perf_counter
+from collections import deque
+from typing import Callable, Dict, List, Iterable, Iterator, Optional, Sequence, Set, Tuple
 import argparse
-from sqlalchemy import select
-from sqlalchemy.orm import Session, selectinload
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.orm import Session, lazyload
 
 from db import session_scope
-from db.models import Story, Tech
+from db.migrate import ensure_columns, ensure_indexes
+from db.models import Story, Tech, story_tech
 from analytics.embeddings.patterns import PATTERNS
+from analytics.embeddings.matcher import TechMatcher, get_matcher
 
 def ensure_techs(session: Session, tech_names: Iterable[str]) -> Dict[str, Tech]:
+    # Tech.stories загружается selectin-ом по умолчанию — здесь истории не нужны
     existing: Dict[str, Tech] = {
-        t.name: t for t in session.execute(select(Tech)).scalars().all()
+        t.name: t for t in session.execute(select(Tech).options(lazyload(Tech.stories))).scalars().all()
     }
     to_create = [Tech(name=name) for name in tech_names if name not in existing]
     if to_create:
@@ -24,66 +32,311 @@ def ensure_techs(session: Session, tech_names: Iterable[str]) -> Dict[str, Tech]
 def match_techs(title: str, patterns: Dict[str, List[re.Pattern]]) -> Set[str]:
     if not title:
         return set()
-    text = title.lower()
-    hits: Set[str] = set()
-    for tech, pats in patterns.items():
-        for pat in pats:
-            if pat.search(text):
-                hits.add(tech)
+    return get_matcher(patterns).techs(title.lower())
+
+
+def insert_ignore(session: Session, table):
+    """
+    INSERT ... ON CONFLICT DO NOTHING для executemany списка словарей:
+    уже существующие связи пропускаются самой СУБД, без чтения перед вставкой.
+    """
+    dialect = session.bind.dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        return sqlite_insert(table).on_conflict_do_nothing()
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+        return pg_insert(table).on_conflict_do_nothing()
+    if dialect in ("mysql", "mariadb"):
+        return table.insert().prefix_with("IGNORE")
+    return table.insert()
+
+
+def iter_text_batches(session: Session,
+                      id_column,
+                      text_column,
+                      batch_size: int = 5000,
+                      id_range: Optional[Tuple[int, int]] = None,
+                      where: Sequence = ()) -> Iterator[List[Tuple[int, str]]]:
+    """
+    Пакеты (id, текст) по возрастанию id, пустые тексты пропускаются; where —
+    дополнительные условия отбора. Читается keyset-пагинацией (id > последний
+    прочитанный), поэтому между пакетами можно писать в ту же БД без открытого курсора.
+    """
+    last_id = id_range[0] - 1 if id_range else None
+    while True:
+        stmt = select(id_column, text_column).where(text_column.isnot(None), text_column != "", *where)
+        if last_id is not None:
+            stmt = stmt.where(id_column > last_id)
+        if id_range:
+            stmt = stmt.where(id_column <= id_range[1])
+        batch = session.execute(stmt.order_by(id_column).limit(batch_size)).all()
+        if not batch:
+            return
+        yield [tuple(row) for row in batch]
+        last_id = batch[-1][0]
+
+
+def iter_title_batches(session: Session,
+                       batch_size: int = 5000,
+                       id_range: Optional[Tuple[int, int]] = None,
+                       where: Sequence = ()) -> Iterator[List[Tuple[int, str]]]:
+    """Пакеты (story_id, title) по возрастанию id."""
+    return iter_text_batches(session, Story.id, Story.title, batch_size=batch_size, id_range=id_range, where=where)
+
+
+class TrackedBatches:
+    """
+    Итератор пакетов, запоминающий (размер, первый id, последний id) каждого прочитанного
+    пакета: map_batches читает на пакет вперёд, и вызывающий код берёт из read
+    границы именно того пакета, результат которого сейчас записывает.
+    """
+
+    def __init__(self, batches):
+        self.batches = batches
+        self.read = deque()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        batch = next(self.batches)
+        self.read.append((len(batch), batch[0][0], batch[-1][0]))
+        return batch
+
+
+def mark_classified(session: Session, id_column, marker_column, first_id: int, last_id: int) -> None:
+    """Отмечает строки отрезка [first_id, last_id] размеченными (marker_column = true)."""
+    session.execute(
+        update(id_column.class_)
+        .where(id_column.between(first_id, last_id), marker_column.is_(None))
+        .values({marker_column.key: True})
+        .execution_options(synchronize_session=False)
+    )
+
+
+def map_batches(fn: Callable[[list], list],
+                batches: Iterator[list],
+                jobs: int = 1,
+                initializer: Optional[Callable] = None,
+                initargs: tuple = ()) -> Iterator[list]:
+    """
+    fn по каждому пакету; с jobs > 1 — в пуле процессов, каждый пакет делится
+    между ними поровну. Пока пул разбирает один пакет, вызывающий код читает
+    из БД и пишет в БД следующий.
+    """
+    if jobs <= 1:
+        if initializer:
+            initializer(*initargs)
+        for batch in batches:
+            yield fn(batch)
+        return
+
+    with Pool(jobs, initializer=initializer, initargs=initargs) as pool:
+        pending = None
+        while True:
+            batch = next(batches, None)
+            nxt = pool.map_async(fn, [batch[i::jobs] for i in range(jobs)]) if batch else None
+            if pending is not None:
+                yield [row for part in pending.get() for row in part]
+            if nxt is None:
                 break
-    return hits
+            pending = nxt
+
+
+_WORKER: Optional[Tuple[TechMatcher, Dict[str, int]]] = None
+
+
+def _init_worker(matcher: TechMatcher, tech_ids: Dict[str, int]) -> None:
+    global _WORKER
+    _WORKER = (matcher, tech_ids)
+
+
+def _match_batch(batch: List[Tuple[int, str]]) -> List[dict]:
+    """Строки story_tech для пакета заголовков (выполняется в процессе пула)."""
+    matcher, tech_ids = _WORKER
+    return [
+        {"story_id": story_id, "tech_id": tech_ids[name]}
+        for story_id, title in batch
+        for name in matcher.techs(title.lower())
+    ]
+
+
+def iter_story_tech_rows(batches: Iterator[List[Tuple[int, str]]],
+                         matcher: TechMatcher,
+                         tech_ids: Dict[str, int],
+                         jobs: int = 1) -> Iterator[List[dict]]:
+    """
+    Строки story_tech по пакетам заголовков; с jobs > 1 сопоставление идёт
+    в пуле процессов (матчер передаётся в них через pickle).
+    """
+    return map_batches(_match_batch, batches, jobs=jobs, initializer=_init_worker, initargs=(matcher, tech_ids))
+
+
+def patterns_fingerprint(pats: List[re.Pattern]) -> str:
+    """sha256 исходников и флагов шаблонов технологии: меняется при любой правке её списка в PATTERNS."""
+    spec = json.dumps([(p.pattern, int(p.flags)) for p in pats], ensure_ascii=False)
+    return hashlib.sha256(spec.encode("utf-8")).hexdigest()
+
+
+def _link_stories(session: Session,
+                  matcher: TechMatcher,
+                  tech_ids: Dict[str, int],
+                  id_range: Tuple[int, int],
+                  batch_size: int,
+                  jobs: int,
+                  dry_run: bool,
+                  progress=None,
+                  unclassified: bool = False,
+                  mark: bool = False) -> Tuple[int, int, int]:
+    """
+    Размечает истории из id_range и вставляет связи. unclassified=True — только истории
+    с techs_classified IS NULL; mark=True — прочитанные пакеты отмечаются размеченными.
+    Возвращает (прочитано историй, историй с технологиями, связей).
+    """
+    stmt = insert_ignore(session, story_tech)
+    scanned = stories = links = 0
+    where = [Story.techs_classified.is_(None)] if unclassified else []
+    batches = TrackedBatches(iter_title_batches(session, batch_size=batch_size, id_range=id_range, where=where))
+    for rows in iter_story_tech_rows(batches, matcher, tech_ids, jobs=jobs):
+        n, first_id, last_id = batches.read.popleft()
+        scanned += n
+        if rows:
+            stories += len({r["story_id"] for r in rows})
+            links += len(rows)
+            if not dry_run:
+                session.execute(stmt, rows)
+        if mark and not dry_run:
+            mark_classified(session, Story.id, Story.techs_classified, first_id, last_id)
+        if progress:
+            progress(stories, links)
+    return scanned, stories, links
+
+
+def _prepare(session: Session, patterns: Dict[str, List[re.Pattern]]) -> Tuple[Dict[str, Tech], int]:
+    """Досоздаёт колонки состояния и технологии; возвращает их и верхнюю границу id историй."""
+    ensure_columns(session.get_bind(), [Tech.__table__, Story.__table__])
+    ensure_indexes(session.get_bind(), [Story.__table__])
+    tech_by_name = ensure_techs(session, patterns.keys())
+    upto = session.execute(select(func.max(Story.id))).scalar() or 0
+    return tech_by_name, upto
+
+
+def _save_state(techs: Iterable[Tech], patterns: Dict[str, List[re.Pattern]], upto: int) -> None:
+    for tech in techs:
+        tech.patterns_hash = patterns_fingerprint(patterns[tech.name])
+        tech.classified_upto = upto
 
 
 def classify_stories(session: Session,
                      patterns: Dict[str, List[re.Pattern]] = PATTERNS,
-                     batch_size: int = 1000,
-                     dry_run: bool = False) -> int:
-    tech_by_name = ensure_techs(session, patterns.keys())
+                     batch_size: int = 5000,
+                     dry_run: bool = False,
+                     jobs: int = 1,
+                     progress=None) -> dict:
+    """
+    Полная пересборка story_tech по заголовкам историй.
 
-    updated = 0
-    stmt = select(Story).options(selectinload(Story.techs)).execution_options(yield_per=batch_size)
+    Из БД читаются только (id, title), технологии ищутся TechMatcher (в пуле из jobs
+    процессов), связи пишутся пакетной вставкой INSERT ... ON CONFLICT DO NOTHING.
+    Старые связи удаляются в той же транзакции, поэтому читатели до коммита видят
+    прежнюю разметку, а после — новую целиком. dry_run только считает.
+    Возвращает stories (историй с технологиями) и links (связей).
+    """
+    tech_by_name, upto = _prepare(session, patterns)
+    tech_ids = {name: tech_by_name[name].id for name in patterns}
 
-    for story in session.execute(stmt).scalars():
-        found = match_techs(story.title or "", patterns)
-        if not found:
-            continue
+    if not dry_run:
+        session.execute(delete(story_tech))
+    _, stories, links = _link_stories(session, get_matcher(patterns), tech_ids, (0, upto),
+                                      batch_size, jobs, dry_run, progress, mark=True)
+    if not dry_run:
+        _save_state((tech_by_name[name] for name in patterns), patterns, upto)
+        session.commit()
+    return {"stories": stories, "links": links}
 
-        existing_names = {t.name for t in story.techs}
-        to_add = [name for name in found if name not in existing_names]
-        if not to_add:
-            continue
 
-        if dry_run:
-            print(f"Story {story.id}: +{to_add}")
-            updated += 1
-            continue
+def classify_new_stories(session: Session,
+                         patterns: Dict[str, List[re.Pattern]] = PATTERNS,
+                         batch_size: int = 5000,
+                         dry_run: bool = False,
+                         jobs: int = 1,
+                         progress=None) -> dict:
+    """
+    Инкрементальная разметка по состоянию в таблице tech.
 
-        for name in to_add:
-            story.techs.append(tech_by_name[name])
+    Неразмеченными считаются истории с story.techs_classified IS NULL — а не только
+    новее прошлой верхней границы, поэтому истории с меньшими id, загруженные позже
+    (догрузка старых диапазонов, загрузка по убыванию id или по шардам), тоже
+    попадают в разметку. Их проверяют технологии с неизменными шаблонами, после
+    чего пакет отмечается размеченным. Технологии, чей отпечаток шаблонов не
+    совпадает с сохранённым (шаблоны изменились, технология новая или ещё не
+    размечалась), размечаются заново по всей истории: их старые связи удаляются,
+    и по всем заголовкам проходит матчер только из этих технологий. Заголовки уже
+    размеченных историй повторно не читаются, так что изменённый при повторном
+    ingest заголовок учтёт только полная пересборка.
+    Возвращает stories (историй с технологиями), links, new (прочитано неразмеченных
+    историй), upto и stale (переразмеченные технологии).
+    """
+    tech_by_name, upto = _prepare(session, patterns)
+    tech_ids = {name: tech_by_name[name].id for name in patterns}
 
-        updated += 1
-        if updated % batch_size == 0:
-            session.commit()
+    stale = [name for name in patterns
+             if tech_by_name[name].classified_upto is None
+             or tech_by_name[name].patterns_hash != patterns_fingerprint(patterns[name])]
+    fresh = [name for name in patterns if name not in stale]
+
+    new = stories = links = 0
+    if fresh:
+        # сначала неразмеченные истории: технологии из stale проверят их ниже вместе со всеми
+        matcher = TechMatcher({name: patterns[name] for name in fresh})
+        new, stories, links = _link_stories(session, matcher, tech_ids, (0, upto), batch_size, jobs, dry_run,
+                                            progress, unclassified=True, mark=True)
+    if stale:
+        if not dry_run:
+            session.execute(delete(story_tech).where(story_tech.c.tech_id.in_([tech_ids[n] for n in stale])))
+        matcher = TechMatcher({name: patterns[name] for name in stale})
+        # если переразмечаются все технологии, этот проход сам отмечает истории размеченными
+        _, s, l = _link_stories(session, matcher, tech_ids, (0, upto), batch_size, jobs, dry_run, progress,
+                                mark=not fresh)
+        stories, links = stories + s, links + l
 
     if not dry_run:
+        _save_state((tech_by_name[name] for name in patterns), patterns, upto)
         session.commit()
-
-    return updated
+    return {"stories": stories, "links": links, "new": new, "upto": upto, "stale": stale}
 
 def parse_args():
     p = argparse.ArgumentParser(
-        prog="export_titles",
-        description="Выгрузка заголовков Story из БД в файл (txt/csv/jsonl)"
+        prog="classify_tech",
+        description="Пересборка связей Story–Tech (story_tech) по заголовкам историй и PATTERNS"
     )
     p.add_argument("-d", "--db", required=True, help="DB URL (например, sqlite:///hn.db)")
+    p.add_argument("-j", "--jobs", type=int, default=1, help="Процессов для сопоставления заголовков (по умолчанию 1)")
+    p.add_argument("-b", "--batch-size", type=int, default=5000, help="Историй в одном пакете чтения/вставки (по умолчанию 5000)")
+    p.add_argument("--full", action="store_true",
+                   help="Полная пересборка story_tech по всем историям (по умолчанию — только неразмеченные истории "
+                        "и технологии с изменившимися шаблонами)")
+    p.add_argument("--dry-run", action="store_true", help="Только посчитать истории и связи, ничего не записывать")
     return p.parse_args()
 
 def main() -> int:
     args = parse_args()
     try:
+        t0 = perf_counter()
+        suffix = " (dry-run, ничего не записано)" if args.dry_run else ""
         with session_scope(args.db) as session:
-            changed = classify_stories(session, dry_run=False)
-            print("Обновлено историй:", changed)
+            if args.full:
+                stats = classify_stories(session, batch_size=args.batch_size, dry_run=args.dry_run, jobs=args.jobs)
+                print(f"Историй с технологиями: {stats['stories']}, связей: {stats['links']} "
+                      f"за {perf_counter() - t0:.1f}s{suffix}")
+            else:
+                stats = classify_new_stories(session, batch_size=args.batch_size, dry_run=args.dry_run, jobs=args.jobs)
+                if stats["stale"]:
+                    print(f"Размечены заново по всей истории ({len(stats['stale'])}): {', '.join(stats['stale'])}")
+                print(f"Неразмеченных историй: {stats['new']}" if stats["new"] else "Неразмеченных историй нет")
+                print(f"Историй с технологиями: {stats['stories']}, связей добавлено: {stats['links']} "
+                      f"за {perf_counter() - t0:.1f}s{suffix}")
         return 0
     except Exception as e:
         print(f"Ошибка: {e}")
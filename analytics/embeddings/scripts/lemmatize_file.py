@@ -1,6 +1,7 @@
 import argparse
 from pathlib import Path
-from utils.lemmatize import load_preserve_words, iter_tokenized_lines
+from utils.lemmatize import configure_lemma_cache, format_lemma_cache_stats, load_preserve_words, iter_tokenized_lines
+from utils.delta import open_delta, save_delta
 
 def parse_args():
     p = argparse.ArgumentParser(description="Лемматизация заголовков из TXT → TXT (по строкам).")
@@ -20,6 +21,15 @@ def parse_args():
                     help="Файл со словами, которые не нужно лемматизировать (по одному на строку)")
     p.add_argument("--add-preserve", nargs="+", default=[],
                     help="Дополнительные слова для сохранения (не лемматизировать)")
+    p.add_argument("--lemma-cache", type=Path, default=None,
+                    help="SQLite-файл кэша лемм token -> lemma, общий для запусков и файлов")
+    p.add_argument("--cache-size", type=int, default=1_000_000,
+                    help="Сколько токенов держать в LRU-кэше лемм в памяти (по умолчанию 1000000)")
+    p.add_argument("--line-batch", type=int, default=10_000,
+                    help="Строк в одном пакете лемматизации: новые токены пакета идут в spaCy одним вызовом (по умолчанию 10000)")
+    p.add_argument("--incremental", action="store_true",
+                    help="Обработать только строки, дописанные во входной файл после прошлого запуска, "
+                         "и дописать их в выход (состояние в <output>.delta.json)")
     return p.parse_args()
 
 def main():
@@ -36,7 +46,12 @@ def main():
     if args.preserve_words or args.add_preserve:
         print(f"Examples: {sorted(list(preserve_words))[:10]}")
 
-    with args.output.open("w", encoding="utf-8") as out:
+    configure_lemma_cache(maxsize=args.cache_size, path=args.lemma_cache)
+    offset, append = open_delta(args.input, args.output, args.incremental)
+    if append:
+        print(f"Incremental: continuing {args.input} from byte {offset}")
+
+    with args.output.open("a" if append else "w", encoding="utf-8") as out:
         for tokens in iter_tokenized_lines(
             path=args.input,
             keep_punct=args.keep_punct,
@@ -44,10 +59,15 @@ def main():
             lower=(not args.no_lower),
             lemmatize_en=(not args.no_lemmatize),
             preserve_words=preserve_words,
+            offset=offset,
+            line_batch=args.line_batch,
         ):
             out.write((" ".join(tokens) if tokens else "") + "\n")
+    save_delta(args.input, args.output, args.input.stat().st_size)
 
     print(f"Processed {args.input} -> {args.output}")
+    if not args.no_lemmatize:
+        print(format_lemma_cache_stats())
 
 
 if __name__ == "__main__":
@@ -1,6 +1,8 @@
 import argparse
 from pathlib import Path
 from ..title_embedder import TitleEmbedder
+from utils.delta import open_delta, save_delta
+from utils.lemmatize import configure_lemma_cache
 
 def parse_args():
     ap = argparse.ArgumentParser(
@@ -17,6 +19,16 @@ def parse_args():
         required=True,
         help="Путь к выходному файлу"
     )
+    ap.add_argument(
+        "--lemma-cache",
+        default=None,
+        help="SQLite-файл кэша лемм token -> lemma, общий для запусков и файлов"
+    )
+    ap.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Обработать только строки, дописанные во входной файл после прошлого запуска (состояние в <output>.delta.json)"
+    )
     return ap.parse_args()
 
 def main() -> int:
@@ -27,8 +39,12 @@ def main() -> int:
         if not in_path.exists():
             raise FileNotFoundError(f"Файл не найден: {in_path}")
 
+        offset, append = open_delta(in_path, out_path, args.incremental)
+        if args.lemma_cache:
+            configure_lemma_cache(path=args.lemma_cache)
         e = TitleEmbedder()
-        e.sentences_to_vectors(in_path.as_posix(), out_path)
+        e.sentences_to_vectors(in_path.as_posix(), out_path, offset=offset, append=append)
+        save_delta(in_path, out_path, in_path.stat().st_size)
 
         print(f"Готово: токены сгенерированы из {in_path}")
         return 0
@@ -29,19 +29,22 @@ def load_patterns():
         return None
 
 def aggregate_synonyms(model: Word2Vec, patterns_dict: Dict[str, List[Pattern]]) -> pd.DataFrame:
+    from analytics.embeddings.matcher import get_matcher
+
     vocab = set(model.wv.index_to_key)
     aggregated_vectors = []
     canonical_names = []
     stats = []
-    
-    for canonical_name, patterns in patterns_dict.items():
-        matching_words = []
-        for word in vocab:
-            for pattern in patterns:
-                if pattern.search(word):
-                    matching_words.append(word)
-                    break
-        
+
+    # один проход по словарю: каждое слово сразу раскладывается по всем технологиям
+    matcher = get_matcher(patterns_dict)
+    words_by_tech: Dict[str, List[str]] = {name: [] for name in patterns_dict}
+    for word in vocab:
+        for canonical_name in matcher.techs(word):
+            words_by_tech[canonical_name].append(word)
+
+    for canonical_name in patterns_dict:
+        matching_words = words_by_tech[canonical_name]
         if matching_words:
             word_counts = [model.wv.get_vecattr(word, "count") for word in matching_words]
             
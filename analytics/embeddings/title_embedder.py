@@ -2,7 +2,7 @@ import json
 import gzip
 from pathlib import Path
 
-from utils.lemmatize import iter_tokenized_lines
+from utils.lemmatize import format_lemma_cache_stats, iter_tokenized_lines
 
 def save_token_matrix_jsonl_gz(
     src_path: str | Path,
@@ -12,27 +12,34 @@ def save_token_matrix_jsonl_gz(
     num_token: str | None = "<NUM>",
     lower: bool = True,
     lemmatize_en: bool = True,
+    offset: int = 0,
+    append: bool = False,
 ) -> None:
     out = Path(out_path)
     out.parent.mkdir(parents=True, exist_ok=True)
     count = 0
-    with gzip.open(out, "wt", encoding="utf-8") as gzf:
+    # дозапись добавляет в файл новый gzip-член; gzip.open читает такие файлы целиком
+    with gzip.open(out, "at" if append else "wt", encoding="utf-8") as gzf:
         for tokens in iter_tokenized_lines(
             src_path,
             keep_punct=keep_punct,
             num_token=num_token,
             lower=lower,
             lemmatize_en=lemmatize_en,
+            offset=offset,
         ):
             gzf.write(json.dumps(tokens, ensure_ascii=False) + "\n")
             count += 1
     print(f"Сохранено {count} строк в {out}")
+    if lemmatize_en:
+        print(format_lemma_cache_stats())
 
 class TitleEmbedder:
     def __init__(self) -> None:
         pass
 
-    def sentences_to_vectors(self, path: str | Path, out: str | Path) -> None:
+    def sentences_to_vectors(self, path: str | Path, out: str | Path,
+                             offset: int = 0, append: bool = False) -> None:
         save_token_matrix_jsonl_gz(
             path,
             #out_path="artifacts/embeddings/words/titles.tokens5.jsonl.gz",
@@ -41,4 +48,6 @@ class TitleEmbedder:
             num_token="<NUM>",
             lower=True,
             lemmatize_en=True,
+            offset=offset,
+            append=append,
         )
\ No newline at end of file
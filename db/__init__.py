@@ -1,2 +1,3 @@
-from .session import get_engine, session_scope
+from .session import get_engine, session_scope, dispose_engines, sqlite_bulk_load
 from .models import Base, Story, Comment
+from .migrate import ensure_indexes
@@ -0,0 +1,43 @@
+from sqlalchemy import literal
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+from sqlalchemy.types import String
+
+
+class string_agg(FunctionElement):
+    """
+    Склейка строк группы через разделитель на любой СУБД:
+    string_agg в PostgreSQL, group_concat в SQLite и GROUP_CONCAT … SEPARATOR в MySQL.
+
+        select(Story.id, string_agg(Comment.text, " ")).group_by(Story.id)
+
+    Порядок строк внутри группы не гарантируется. В MySQL результат обрезается
+    по group_concat_max_len — для больших веток используйте потоковую склейку на клиенте.
+    """
+
+    type = String()
+    inherit_cache = True
+    name = "string_agg"
+
+    def __init__(self, expr, separator: str = ","):
+        super().__init__(expr, literal(separator, String))
+
+
+@compiles(string_agg)
+def _string_agg_default(element, compiler, **kw):
+    expr, sep = list(element.clauses)
+    return f"string_agg({compiler.process(expr, **kw)}, {compiler.process(sep, **kw)})"
+
+
+@compiles(string_agg, "sqlite")
+def _string_agg_sqlite(element, compiler, **kw):
+    expr, sep = list(element.clauses)
+    return f"group_concat({compiler.process(expr, **kw)}, {compiler.process(sep, **kw)})"
+
+
+@compiles(string_agg, "mysql")
+@compiles(string_agg, "mariadb")
+def _string_agg_mysql(element, compiler, **kw):
+    expr, sep = list(element.clauses)
+    # SEPARATOR принимает только строковый литерал, не параметр
+    return f"GROUP_CONCAT({compiler.process(expr, **kw)} SEPARATOR {compiler.process(sep, literal_binds=True)})"
@@ -0,0 +1,249 @@
+import json
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pc = None
+    ds = None
+    pq = None
+
+FORMATS = ("csv", "parquet", "arrow")
+
+
+def infer_format(path: str | Path, default: str = "csv") -> str:
+    suffix = Path(path).suffix.lower()
+    if suffix == ".parquet":
+        return "parquet"
+    if suffix in (".arrow", ".feather", ".ipc"):
+        return "arrow"
+    return default
+
+
+def require_pyarrow() -> None:
+    if pa is None:
+        raise RuntimeError("Для форматов parquet/arrow нужен пакет pyarrow (pip install pyarrow)")
+
+
+class ColumnarWriter:
+    """
+    Потоковая запись пакетов строк в Parquet или Arrow IPC (Feather v2).
+
+    Каждый пакет (список кортежей в порядке schema) превращается в RecordBatch
+    и сразу уходит на диск, поэтому в памяти живёт только текущий пакет.
+    Arrow IPC-файл потом читается через memory map без разбора (см. read_columns).
+    """
+
+    def __init__(self, path: str | Path, schema, fmt: str = "parquet"):
+        require_pyarrow()
+        self.path = Path(path)
+        self.schema = schema
+        self.fmt = fmt
+        if fmt == "parquet":
+            self._writer = pq.ParquetWriter(str(self.path), schema, compression="zstd")
+        elif fmt == "arrow":
+            self._sink = pa.OSFile(str(self.path), "wb")
+            self._writer = pa.ipc.new_file(self._sink, schema)
+        else:
+            raise ValueError(f"Неизвестный колоночный формат: {fmt}")
+        self.rows = 0
+
+    def write_rows(self, rows: Sequence[tuple]) -> None:
+        if not rows:
+            return
+        columns = list(zip(*rows))
+        arrays = [pa.array(col, type=field.type) for col, field in zip(columns, self.schema)]
+        self._writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+        self.rows += len(rows)
+
+    def close(self) -> None:
+        self._writer.close()
+        if self.fmt == "arrow":
+            self._sink.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def read_columns(path: str | Path, columns: Optional[List[str]] = None):
+    """
+    Читает parquet/arrow/csv в pandas.DataFrame, только нужные колонки.
+    Arrow IPC открывается через memory map: данные не копируются и не разбираются.
+    """
+    import pandas as pd
+
+    fmt = infer_format(path)
+    if fmt == "csv":
+        return pd.read_csv(path, usecols=columns)
+    require_pyarrow()
+    if fmt == "parquet":
+        table = pq.read_table(str(path), columns=columns, memory_map=True)
+    else:
+        with pa.memory_map(str(path), "r") as source:
+            table = pa.ipc.open_file(source).read_all()
+        if columns:
+            table = table.select(columns)
+    return table.to_pandas()
+
+
+def read_batches(path: str | Path, fmt: Optional[str] = None):
+    """Потоково отдаёт RecordBatch из parquet (по группам строк) или arrow (через memory map)."""
+    require_pyarrow()
+    fmt = fmt or infer_format(path)
+    if fmt == "parquet":
+        yield from pq.ParquetFile(str(path)).iter_batches()
+        return
+    with pa.memory_map(str(path), "r") as source:
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            yield reader.get_batch(i)
+
+
+def stories_meta_schema():
+    require_pyarrow()
+    return pa.schema([
+        ("id", pa.int64()),
+        ("title", pa.string()),
+        ("score", pa.int64()),
+        ("time", pa.timestamp("us")),
+        ("descendants", pa.int64()),
+        ("techs_count", pa.int32()),
+        ("tech_names", pa.list_(pa.string())),
+    ])
+
+
+# Снимок БД (db.scripts.snapshot): <dir>/<table>/month=YYYY-MM/part-N.parquet и _snapshot.json
+SNAPSHOT_MANIFEST = "_snapshot.json"
+PARTITIONED_TABLES = ("story", "comment")
+
+
+def _dict_string():
+    return pa.dictionary(pa.int32(), pa.string())
+
+
+def snapshot_schemas() -> Dict[str, "pa.Schema"]:
+    """
+    Схемы таблиц снимка. Повторяющиеся строки (author, tech.name) хранятся
+    как dictionary — в памяти и в файле это коды плюс один словарь значений.
+    month — ключ партиции (YYYY-MM по time), в файлах его нет, он в пути.
+    """
+    require_pyarrow()
+    return {
+        "story": pa.schema([
+            ("id", pa.int64()),
+            ("author", _dict_string()),
+            ("descendants", pa.int64()),
+            ("score", pa.int64()),
+            ("time", pa.timestamp("us")),
+            ("title", pa.string()),
+            ("url", pa.string()),
+            ("month", pa.string()),
+        ]),
+        "comment": pa.schema([
+            ("id", pa.int64()),
+            ("author", _dict_string()),
+            ("parent", pa.int64()),
+            ("time", pa.timestamp("us")),
+            ("text", pa.string()),
+            ("root_story_id", pa.int64()),
+            ("depth", pa.int32()),
+            ("month", pa.string()),
+        ]),
+        "tech": pa.schema([
+            ("id", pa.int64()),
+            ("name", _dict_string()),
+        ]),
+        "story_tech": pa.schema([
+            ("story_id", pa.int64()),
+            ("tech_id", pa.int64()),
+        ]),
+    }
+
+
+def month_partitioning():
+    return ds.partitioning(pa.schema([("month", pa.string())]), flavor="hive")
+
+
+def snapshot_dataset(path: str | Path, table: str):
+    """pyarrow.dataset.Dataset одной таблицы снимка; фильтры по month отсекают целые папки."""
+    require_pyarrow()
+    root = Path(path)
+    fmt = "parquet"
+    manifest = root / SNAPSHOT_MANIFEST
+    if manifest.exists():
+        with manifest.open("r", encoding="utf-8") as f:
+            fmt = json.load(f).get("format", fmt)
+    partitioning = month_partitioning() if table in PARTITIONED_TABLES else None
+    return ds.dataset(str(root / table), format="ipc" if fmt == "arrow" else "parquet", partitioning=partitioning)
+
+
+def time_filter(since: Optional[datetime] = None, until: Optional[datetime] = None):
+    """
+    Фильтр по time для story/comment. Условие дублируется на month, чтобы
+    ненужные партиции не открывались вовсе, а внутри партиций работают
+    min/max статистики групп строк parquet.
+    """
+    expr = None
+    if since is not None:
+        expr = (ds.field("month") >= since.strftime("%Y-%m")) & (ds.field("time") >= pa.scalar(since, pa.timestamp("us")))
+    if until is not None:
+        cond = (ds.field("month") <= until.strftime("%Y-%m")) & (ds.field("time") < pa.scalar(until, pa.timestamp("us")))
+        expr = cond if expr is None else expr & cond
+    return expr
+
+
+def read_snapshot(path: str | Path, table: str, columns: Optional[List[str]] = None, filter=None,
+                  since: Optional[datetime] = None, until: Optional[datetime] = None, to_pandas: bool = True):
+    """
+    Читает таблицу снимка: только нужные колонки (column pruning) и только строки,
+    подходящие под filter (pyarrow.dataset expression) и [since, until) по time —
+    фильтр проталкивается в сканер (partition pruning + статистики parquet).
+    """
+    dataset = snapshot_dataset(path, table)
+    expr = time_filter(since, until) if (since or until) else None
+    if filter is not None:
+        expr = filter if expr is None else expr & filter
+    result = dataset.to_table(columns=columns, filter=expr)
+    return result.to_pandas() if to_pandas else result
+
+
+def snapshot_tech_comments(path: str | Path, tech_names: Optional[List[str]] = None,
+                           since: Optional[datetime] = None) -> Dict[str, List[str]]:
+    """
+    {tech.name: [тексты комментариев всей ветки]} из снимка — аналог
+    db.scripts.export_comments_for_techs без промежуточных txt.
+    """
+    techs = read_snapshot(path, "tech", to_pandas=False)
+    if tech_names:
+        techs = techs.filter(pc.is_in(techs["name"].cast(pa.string()), value_set=pa.array(tech_names)))
+    names = dict(zip(techs["id"].to_pylist(), techs["name"].cast(pa.string()).to_pylist()))
+    if not names:
+        return {}
+
+    links = read_snapshot(path, "story_tech", filter=ds.field("tech_id").isin(list(names)), to_pandas=False)
+    by_story: Dict[int, List[int]] = {}
+    for story_id, tech_id in zip(links["story_id"].to_pylist(), links["tech_id"].to_pylist()):
+        by_story.setdefault(story_id, []).append(tech_id)
+
+    comments = read_snapshot(
+        path, "comment", columns=["root_story_id", "text"],
+        filter=ds.field("root_story_id").isin(list(by_story)) & ds.field("text").is_valid(),
+        since=since, to_pandas=False,
+    )
+    out: Dict[str, List[str]] = {name: [] for name in names.values()}
+    for root, text in zip(comments["root_story_id"].to_pylist(), comments["text"].to_pylist()):
+        text = text.strip()
+        if not text or text == "[dead]":
+            continue
+        for tech_id in by_story.get(root, ()):
+            out[names[tech_id]].append(text)
+    return out
@@ -0,0 +1,166 @@
+import csv
+import io
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func, select
+
+from .session import session_scope
+
+# На каждый процесс нарезаем несколько диапазонов: ID распределены неравномерно
+# (старые истории реже имеют комментарии), и мелкие куски выравнивают нагрузку
+RANGES_PER_JOB = 4
+
+
+def split_range(lo: int, hi: int, parts: int) -> List[Tuple[int, int]]:
+    """[lo, hi] -> до parts смежных отрезков почти равной длины."""
+    total = hi - lo + 1
+    parts = max(1, min(parts, total))
+    base, extra = divmod(total, parts)
+    ranges = []
+    cur = lo
+    for i in range(parts):
+        size = base + (1 if i < extra else 0)
+        ranges.append((cur, cur + size - 1))
+        cur += size
+    return ranges
+
+
+def key_ranges(db_url: str, column, jobs: int, limit: Optional[int] = None,
+               id_range: Optional[Tuple[int, int]] = None) -> List[Tuple[int, int]]:
+    """
+    Делит пространство ключа column на jobs * RANGES_PER_JOB диапазонов.
+    limit ограничивает диапазон первыми limit ключами по возрастанию,
+    id_range — отрезком [lo, hi] (инкрементальная выгрузка).
+    """
+    with session_scope(db_url) as session:
+        bounds = select(func.min(column), func.max(column))
+        if id_range:
+            bounds = bounds.where(column.between(*id_range))
+        lo, hi = session.execute(bounds).one()
+        if lo is None:
+            # пустая таблица: один пустой диапазон, чтобы всё равно получить файл с заголовком/схемой
+            return [(0, 0)]
+        if limit:
+            cut = session.execute(select(column).where(column >= lo).order_by(column).offset(limit - 1).limit(1)).scalar()
+            if cut is not None:
+                hi = cut
+    return split_range(lo, hi, jobs * RANGES_PER_JOB)
+
+
+def part_paths(out_path: str | Path, count: int) -> List[Path]:
+    p = Path(out_path)
+    return [p.with_name(f"{p.name}.part-{i:04d}") for i in range(count)]
+
+
+def run_parts(fn: Callable, db_url: str, ranges: List[Tuple[int, int]], parts: List[Path],
+              jobs: int, **kwargs) -> List[int]:
+    """
+    Выполняет fn(db_url, lo, hi, part_path, **kwargs) -> число строк для каждого диапазона
+    в пуле из jobs процессов; у каждого процесса своё соединение с БД.
+    """
+    with ProcessPoolExecutor(max_workers=jobs) as ex:
+        futures = [ex.submit(fn, db_url, lo, hi, str(part), **kwargs) for (lo, hi), part in zip(ranges, parts)]
+        return [f.result() for f in futures]
+
+
+def concat_parts(parts: Iterable[Path], out_path: str | Path, header: Optional[List[str]] = None,
+                 append: bool = False) -> None:
+    """
+    Склеивает текстовые части (txt/csv/jsonl) по порядку; header — строка заголовка CSV.
+    append=True дописывает части в конец существующего файла без заголовка.
+    """
+    with open(out_path, "ab" if append else "wb") as out:
+        if header and not append:
+            buf = io.StringIO()
+            csv.writer(buf).writerow(header)
+            out.write(buf.getvalue().encode("utf-8"))
+        for part in parts:
+            with open(part, "rb") as f:
+                shutil.copyfileobj(f, out, 1 << 20)
+
+
+def merge_columnar(parts: Iterable[Path], out_path: str | Path, fmt: str) -> None:
+    """
+    Склеивает parquet/arrow части по порядку.
+    Arrow-части читаются через memory map, и пакеты пишутся без декодирования;
+    у parquet по одной переносятся группы строк.
+    """
+    from .columnar import pa, pq, require_pyarrow
+
+    require_pyarrow()
+    parts = list(parts)
+    if fmt == "arrow":
+        schema = None
+        writer = sink = None
+        try:
+            for part in parts:
+                with pa.memory_map(str(part), "r") as source:
+                    reader = pa.ipc.open_file(source)
+                    if writer is None:
+                        schema = reader.schema
+                        sink = pa.OSFile(str(out_path), "wb")
+                        writer = pa.ipc.new_file(sink, schema)
+                    for i in range(reader.num_record_batches):
+                        writer.write_batch(reader.get_batch(i))
+        finally:
+            if writer is not None:
+                writer.close()
+                sink.close()
+        return
+
+    writer = None
+    try:
+        for part in parts:
+            pf = pq.ParquetFile(str(part))
+            if writer is None:
+                writer = pq.ParquetWriter(str(out_path), pf.schema_arrow, compression="zstd")
+            for i in range(pf.num_row_groups):
+                writer.write_table(pf.read_row_group(i))
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def remove_parts(parts: Iterable[Path]) -> None:
+    for part in parts:
+        try:
+            os.remove(part)
+        except FileNotFoundError:
+            pass
+
+
+def parallel_export(fn: Callable, db_url: str, out_path: str | Path, column, jobs: int,
+                    fmt: str = "txt", limit: Optional[int] = None, header: Optional[List[str]] = None,
+                    merge: Optional[Callable[[List[Path], Path], None]] = None,
+                    id_range: Optional[Tuple[int, int]] = None, append: bool = False, **kwargs) -> int:
+    """
+    Параллельная выгрузка по диапазонам ключа column.
+
+    Каждый диапазон пишется в свою часть <out>.part-NNNN вызовом
+    fn(db_url, lo, hi, part_path, fmt=fmt, **kwargs) (без заголовка),
+    затем части объединяются по порядку диапазонов: текстовые — склейкой байтов,
+    parquet/arrow — переносом групп строк/пакетов; merge позволяет задать своё
+    объединение (например, слияние отсортированных частей). id_range и append —
+    для инкрементальной выгрузки: только ключи из [lo, hi], текстовые части
+    дописываются в конец out_path. Возвращает число строк.
+    """
+    out_path = Path(out_path)
+    if append and (merge is not None or fmt in ("parquet", "arrow")):
+        raise ValueError(f"дозапись не поддерживается для формата {fmt}")
+    ranges = key_ranges(db_url, column, jobs, limit=limit, id_range=id_range)
+    parts = part_paths(out_path, len(ranges))
+    try:
+        counts = run_parts(fn, db_url, ranges, parts, jobs, fmt=fmt, **kwargs)
+        if merge is not None:
+            merge(parts, out_path)
+        elif fmt in ("parquet", "arrow"):
+            merge_columnar(parts, out_path, fmt)
+        else:
+            concat_parts(parts, out_path, header=header, append=append)
+    finally:
+        remove_parts(parts)
+    return sum(counts)
@@ -0,0 +1,164 @@
+import json
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+
+def manifest_path(out_path: str | Path) -> Path:
+    """samples/titles.txt -> samples/titles.txt.manifest.json; для папки — рядом с ней."""
+    p = Path(out_path)
+    return p.with_name(p.name + ".manifest.json")
+
+
+def parse_time(value: str) -> datetime:
+    """--since-time: unix-время в секундах или ISO-дата/время (2024-05-01, 2024-05-01T12:00)."""
+    if value.isdigit():
+        return datetime.fromtimestamp(int(value), tz=timezone.utc).replace(tzinfo=None)
+    return datetime.fromisoformat(value)
+
+
+def high_water(session: Session, id_column, time_column) -> Tuple[Optional[int], Optional[datetime]]:
+    """Текущая верхняя граница (max id, max time) — её запоминаем до начала выгрузки."""
+    return session.execute(select(func.max(id_column), func.max(time_column))).one()
+
+
+def open_manifest(out_path: str | Path, exporter: str, fmt: str,
+                  since_id: Optional[int] = None, since_time: Optional[str] = None,
+                  incremental: bool = False) -> Tuple["ExportManifest", Optional[int], Optional[datetime]]:
+    """
+    Манифест выгрузки и нижняя граница новых строк (since_id, since_time).
+
+    Явные --since-id/--since-time важнее; --incremental берёт since_id из манифеста,
+    а без манифеста выгрузка полная. Если граница есть (режим дозаписи), формат
+    должен совпадать с прошлой выгрузкой, а хвосты упавшего запуска обрезаются;
+    при полной выгрузке манифест начинается заново.
+    """
+    manifest = ExportManifest.load(out_path, exporter, fmt)
+    if since_id is None and incremental:
+        since_id = manifest.since_id
+    since = parse_time(since_time) if since_time else None
+    if since_id is None and since is None:
+        return ExportManifest(out_path, exporter, fmt), None, None
+    if manifest.exists:
+        if manifest.format != fmt:
+            raise ValueError(f"{manifest.path}: прошлая выгрузка в формате {manifest.format}, а не {fmt}")
+        manifest.truncate_files()
+    return manifest, since_id, since
+
+
+def new_id_range(since_id: Optional[int], upto_id: Optional[int]) -> Optional[Tuple[int, int]]:
+    """(since_id, upto_id] как отрезок для id_range; None — таблица пуста."""
+    if upto_id is None:
+        return None
+    return (since_id or 0) + 1, upto_id
+
+
+class ExportManifest:
+    """
+    Sidecar-манифест инкрементальной выгрузки (<out>.manifest.json).
+
+    Хранит формат, верхнюю границу ключа (high_water: id и time), на которой
+    закончилась последняя выгрузка, и размеры выходных файлов после неё.
+    Каждый запуск дописывает запись в runs с байтовыми смещениями добавленного
+    куска, чтобы следующие шаги могли обработать только дельту. Файл
+    перезаписывается атомарно и только после успешной записи данных; если запуск
+    упал посреди дозаписи, хвост длиннее записанного размера обрезается (truncate_files).
+    """
+
+    def __init__(self, out_path: str | Path, exporter: str, fmt: str):
+        self.out_path = Path(out_path)
+        self.path = manifest_path(out_path)
+        self.exporter = exporter
+        self.format = fmt
+        self.high_water: Dict[str, Optional[str | int]] = {"id": None, "time": None}
+        self.files: Dict[str, int] = {}
+        self.rows = 0
+        self.runs: List[dict] = []
+        self._before: Dict[str, int] = {}
+
+    @classmethod
+    def load(cls, out_path: str | Path, exporter: str, fmt: str) -> "ExportManifest":
+        m = cls(out_path, exporter, fmt)
+        if m.path.exists():
+            with m.path.open("r", encoding="utf-8") as f:
+                state = json.load(f)
+            m.format = state.get("format", fmt)
+            m.high_water = state.get("high_water", m.high_water)
+            m.files = state.get("files", {})
+            m.rows = state.get("rows", 0)
+            m.runs = state.get("runs", [])
+        return m
+
+    @property
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    @property
+    def since_id(self) -> Optional[int]:
+        return self.high_water.get("id")
+
+    def truncate_files(self) -> None:
+        """Отрезает недописанные хвосты после упавшего запуска."""
+        for name, size in self.files.items():
+            p = self._file(name)
+            if p.exists() and p.stat().st_size > size:
+                os.truncate(p, size)
+
+    def file_sizes(self, paths) -> Dict[str, int]:
+        return {self._name(p): Path(p).stat().st_size for p in paths if Path(p).exists()}
+
+    def start(self, paths, append: bool) -> None:
+        """Запоминает размеры файлов до записи — начало добавляемого куска."""
+        self._before = self.file_sizes(paths) if append else {}
+
+    def record_run(self, since_id, since_time, upto: Tuple[Optional[int], Optional[datetime]],
+                   rows: int, paths, append: bool) -> None:
+        before = self._before
+        sizes = self.file_sizes(paths)
+        upto_id, upto_time = upto
+        self.runs.append({
+            "at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "since_id": since_id,
+            "since_time": since_time.isoformat() if since_time else None,
+            "upto_id": upto_id,
+            "rows": rows,
+            # [offset, size) каждого файла — добавленный этим запуском кусок
+            "files": {name: [before.get(name, 0), size] for name, size in sizes.items()},
+        })
+        if not append:
+            self.rows = 0
+            self.runs = self.runs[-1:]
+        self.rows += rows
+        self.files = {**self.files, **sizes} if append else sizes
+        if upto_id is not None:
+            self.high_water = {
+                "id": upto_id,
+                "time": upto_time.isoformat() if upto_time else self.high_water.get("time"),
+            }
+
+    def save(self) -> None:
+        state = {
+            "exporter": self.exporter,
+            "format": self.format,
+            "high_water": self.high_water,
+            "rows": self.rows,
+            "files": self.files,
+            "runs": self.runs,
+        }
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def _name(self, p) -> str:
+        p = Path(p)
+        return p.name if p == self.out_path else str(p.relative_to(self.out_path))
+
+    def _file(self, name: str) -> Path:
+        return self.out_path if name == self.out_path.name else self.out_path / name
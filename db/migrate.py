@@ -0,0 +1,78 @@
+from typing import List
+
+from sqlalchemy import inspect
+
+from .models import Base
+
+
+def model_indexes(tables=None) -> list:
+    """Все вторичные индексы, объявленные в моделях (index=True / Index(...))."""
+    tables = tables if tables is not None else Base.metadata.sorted_tables
+    return [idx for tbl in tables for idx in tbl.indexes]
+
+
+def missing_indexes(engine, tables=None) -> list:
+    insp = inspect(engine)
+    existing = {}
+    missing = []
+    for idx in model_indexes(tables):
+        name = idx.table.name
+        if name not in existing:
+            if not insp.has_table(name):
+                continue
+            existing[name] = {i["name"] for i in insp.get_indexes(name)}
+        if idx.name not in existing[name]:
+            missing.append(idx)
+    return missing
+
+
+def ensure_columns(engine, tables=None) -> List[str]:
+    """
+    Досоздаёт в существующих таблицах nullable-колонки, появившиеся в моделях.
+
+    ADD COLUMN без значения по умолчанию не переписывает таблицу ни в SQLite,
+    ни в PostgreSQL, поэтому вызывается прямо при создании схемы.
+    Возвращает список добавленных колонок в виде table.column.
+    """
+    tables = tables if tables is not None else Base.metadata.sorted_tables
+    insp = inspect(engine)
+    quote = engine.dialect.identifier_preparer.quote
+    added = []
+    for tbl in tables:
+        if not insp.has_table(tbl.name):
+            continue
+        have = {c["name"] for c in insp.get_columns(tbl.name)}
+        for col in tbl.columns:
+            if col.name in have or col.primary_key or not col.nullable:
+                continue
+            coltype = col.type.compile(dialect=engine.dialect)
+            with engine.begin() as conn:
+                conn.exec_driver_sql(f"ALTER TABLE {quote(tbl.name)} ADD COLUMN {quote(col.name)} {coltype}")
+            added.append(f"{tbl.name}.{col.name}")
+    return added
+
+
+def ensure_indexes(engine, tables=None) -> List[str]:
+    """
+    Досоздаёт индексы из моделей в уже существующей БД.
+
+    create_all не трогает существующие таблицы, поэтому базы, созданные до
+    появления индекса, нужно догонять отдельно. Возвращает имена созданных индексов.
+    """
+    created = []
+    for idx in missing_indexes(engine, tables):
+        with engine.begin() as conn:
+            idx.create(conn)
+        created.append(idx.name)
+    return created
+
+
+def drop_indexes(engine, tables=None) -> List[str]:
+    """Удаляет индексы из моделей, если они есть (для замеров «до» и массовой загрузки)."""
+    dropped = []
+    with engine.begin() as conn:
+        for idx in model_indexes(tables):
+            if inspect(conn).has_index(idx.table.name, idx.name):
+                idx.drop(conn)
+                dropped.append(idx.name)
+    return dropped
@@ -1,7 +1,7 @@
 from datetime import datetime
 from typing import List, Optional
 
-from sqlalchemy import Column, DateTime, ForeignKey, Integer, String, Table
+from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Integer, String, Table
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 from sqlalchemy.types import JSON
 
@@ -14,7 +14,29 @@ story_tech = Table(
     "story_tech",
     Base.metadata,
     Column("story_id", ForeignKey("story.id"), primary_key=True),
-    Column("tech_id", ForeignKey("tech.id"), primary_key=True),
+    # PK (story_id, tech_id) не помогает выборкам «все истории технологии»
+    Column("tech_id", ForeignKey("tech.id"), primary_key=True, index=True),
+)
+
+# упоминания технологий в комментариях (analytics.embeddings.scripts.classify_comments):
+# count — сколько раз технология встретилась в тексте комментария
+comment_tech = Table(
+    "comment_tech",
+    Base.metadata,
+    Column("comment_id", ForeignKey("comment.id"), primary_key=True),
+    Column("tech_id", ForeignKey("tech.id"), primary_key=True, index=True),
+    Column("count", Integer, nullable=False),
+)
+
+# comment_tech, сгруппированная по истории ветки: comments — комментариев с упоминанием,
+# mentions — сумма count. Пересобирается целиком после разметки комментариев
+story_tech_mentions = Table(
+    "story_tech_mentions",
+    Base.metadata,
+    Column("story_id", ForeignKey("story.id"), primary_key=True),
+    Column("tech_id", ForeignKey("tech.id"), primary_key=True, index=True),
+    Column("comments", Integer, nullable=False),
+    Column("mentions", Integer, nullable=False),
 )
 
 
@@ -25,10 +47,13 @@ class Story(Base):
     author: Mapped[Optional[str]] = mapped_column(String(50))
     descendants: Mapped[Optional[int]] = mapped_column(Integer)
     score: Mapped[Optional[int]] = mapped_column(Integer)
-    time: Mapped[Optional[datetime]] = mapped_column(DateTime)
+    time: Mapped[Optional[datetime]] = mapped_column(DateTime, index=True)
     title: Mapped[Optional[str]] = mapped_column(String)
     url: Mapped[Optional[str]] = mapped_column(String)
     kids: Mapped[list[int]] = mapped_column(JSON, default=list)
+    # состояние classify_tech: заголовок уже проверен всеми технологиями PATTERNS;
+    # NULL — история ещё не размечалась (в том числе загруженная позже историй с большими id)
+    techs_classified: Mapped[Optional[bool]] = mapped_column(Boolean, index=True)
 
     techs: Mapped[List["Tech"]] = relationship(
         secondary=story_tech,
@@ -45,9 +70,15 @@ class Comment(Base):
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     author: Mapped[Optional[str]] = mapped_column(String(50))
-    parent: Mapped[Optional[int]] = mapped_column(Integer)
+    parent: Mapped[Optional[int]] = mapped_column(Integer, index=True)
     time: Mapped[Optional[datetime]] = mapped_column(DateTime)
     text: Mapped[Optional[str]] = mapped_column(String)
+    # история, к ветке которой относится комментарий, и глубина (1 — прямой ответ на историю);
+    # NULL, пока цепочка родителей не дошла до истории в БД (см. db.threads)
+    root_story_id: Mapped[Optional[int]] = mapped_column(Integer, index=True)
+    depth: Mapped[Optional[int]] = mapped_column(Integer)
+    # состояние classify_comments: текст уже проверен технологиями PATTERNS; NULL — ещё нет
+    techs_classified: Mapped[Optional[bool]] = mapped_column(Boolean, index=True)
 
     def __repr__(self) -> str:
         return f"Comment(id={self.id!r}, author={self.author!r}, time={self.time!r})"
@@ -58,6 +89,13 @@ class Tech(Base):
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     name: Mapped[str] = mapped_column(String(50), unique=True, nullable=False)
+    # состояние classify_tech: отпечаток шаблонов технологии при последней разметке
+    # и max(story.id) на тот момент; NULL — технология ещё не размечалась
+    patterns_hash: Mapped[Optional[str]] = mapped_column(String(64))
+    classified_upto: Mapped[Optional[int]] = mapped_column(Integer)
+    # состояние classify_comments: отпечаток шаблонов при последней разметке комментариев;
+    # NULL — комментарии этой технологией ещё не размечались
+    comments_hash: Mapped[Optional[str]] = mapped_column(String(64))
 
     stories: Mapped[List[Story]] = relationship(
         secondary=story_tech,
@@ -1,14 +1,26 @@
-from sqlalchemy import or_
+import os
+from datetime import datetime
+from itertools import groupby, islice
+from multiprocessing import Pool
+
+from sqlalchemy import or_, select
 from sqlalchemy.orm import Session
 from .models import Story, Tech, Comment
+from .aggregates import string_agg
 from typing import Tuple, Iterator
 from utils.clean_text import clean_text
 
 def iter_story_titles(session: Session,
                       keep_deleted: bool = False,
-                      limit: int | None = None) -> Iterator[Tuple[int, str]]:
+                      limit: int | None = None,
+                      id_range: Tuple[int, int] | None = None,
+                      since_time: datetime | None = None) -> Iterator[Tuple[int, str]]:
     q = session.query(Story.id, Story.title)
     q = q.filter(Story.title.isnot(None)).filter(Story.title != "")
+    if id_range:
+        q = q.filter(Story.id.between(*id_range)).order_by(Story.id)
+    if since_time is not None:
+        q = q.filter(Story.time > since_time)
 
     if not keep_deleted:
         if hasattr(Story, "deleted"):
@@ -23,9 +35,12 @@ def iter_story_titles(session: Session,
         yield row.id, row.title
 
 def iter_tech_names(session: Session,
-                      limit: int | None = None) -> Iterator[Tuple[int, str]]:
+                      limit: int | None = None,
+                      id_range: Tuple[int, int] | None = None) -> Iterator[Tuple[int, str]]:
     q = session.query(Tech.id, Tech.name)
     q = q.filter(Tech.name.isnot(None)).filter(Tech.name != "")
+    if id_range:
+        q = q.filter(Tech.id.between(*id_range)).order_by(Tech.id)
 
     if limit:
         q = q.limit(limit)
@@ -33,21 +48,112 @@ def iter_tech_names(session: Session,
     for row in q.yield_per(1000):
         yield row.id, row.name
 
+def _clean_context(group: Tuple[int, str, list]) -> Tuple[int, str, str]:
+    story_id, title, texts = group
+    parts = (clean_text(t) for t in texts)
+    return story_id, title, " ".join(p for p in parts if p).strip()
+
+def iter_story_comment_groups(session: Session,
+                              limit: int | None = None,
+                              batch_size: int = 1000) -> Iterator[Tuple[int, str, list]]:
+    """
+    (story_id, title, [тексты комментариев первого уровня]) одним упорядоченным join
+    вместо отдельного запроса на каждую историю. Строки приходят отсортированными
+    по (story.id, comment.id) и группируются на клиенте.
+    """
+    stories = select(Story.id, Story.title).where(Story.title.isnot(None), Story.title != "")
+    if limit:
+        stories = stories.order_by(Story.id).limit(limit)
+    stories = stories.subquery()
+
+    stmt = (
+        select(stories.c.id, stories.c.title, Comment.text)
+        .join(Comment, Comment.parent == stories.c.id)
+        .where(Comment.text.isnot(None), Comment.text != "")
+        .order_by(stories.c.id, Comment.id)
+        .execution_options(yield_per=batch_size)
+    )
+    rows = session.execute(stmt)
+    for (story_id, title), grp in groupby(rows, key=lambda r: (r[0], r[1])):
+        yield story_id, title, [r[2] for r in grp]
+
 def iter_story_titles_comments(session: Session,
                                keep_deleted: bool = False,
-                               limit: int | None = None) -> Iterator[Tuple[int, str]]:
-    q = session.query(Story.id, Story.title)
-    q = q.filter(Story.title.isnot(None)).filter(Story.title != "")
+                               limit: int | None = None,
+                               workers: int | None = None,
+                               batch_size: int = 1000) -> Iterator[Tuple[int, str, str]]:
+    """
+    (story_id, title, очищенный текст комментариев) для историй с непустым контекстом.
 
+    clean_text выполняется в пуле из workers процессов (по умолчанию по числу ядер)
+    пакетами по batch_size историй: пока пул чистит один пакет, из БД читается следующий.
+    """
+    groups = iter_story_comment_groups(session, limit=limit, batch_size=batch_size)
+    workers = workers or os.cpu_count() or 1
+
+    if workers <= 1:
+        for story_id, title, context in map(_clean_context, groups):
+            if context:
+                yield story_id, title, context
+        return
+
+    with Pool(workers) as pool:
+        pending = None
+        while True:
+            batch = list(islice(groups, batch_size))
+            nxt = pool.map_async(_clean_context, batch, chunksize=max(1, len(batch) // (workers * 4))) if batch else None
+            if pending is not None:
+                for story_id, title, context in pending.get():
+                    if context:
+                        yield story_id, title, context
+            if nxt is None:
+                break
+            pending = nxt
+
+def iter_story_contexts(session: Session,
+                        method: str = "auto",
+                        limit: int | None = None,
+                        batch_size: int = 10_000,
+                        id_range: Tuple[int, int] | None = None,
+                        since_time: datetime | None = None) -> Iterator[Tuple[int, str, str]]:
+    """
+    (story_id, title, сырые тексты всей ветки через пробел) по возрастанию story.id,
+    включая истории без комментариев (пустой контекст).
+
+    method="db" склеивает тексты агрегатом в СУБД (string_agg/group_concat),
+    method="stream" — на клиенте из упорядоченного join, держа в памяти только
+    одну ветку; "auto" выбирает stream для MySQL, где GROUP_CONCAT обрезает результат.
+    """
+    if method == "auto":
+        method = "stream" if session.bind.dialect.name in ("mysql", "mariadb") else "db"
+
+    stories = select(Story.id, Story.title)
+    if id_range:
+        stories = stories.where(Story.id.between(*id_range))
+    if since_time is not None:
+        stories = stories.where(Story.time > since_time)
     if limit:
-        q = q.limit(limit)
+        stories = stories.order_by(Story.id).limit(limit)
+    stories = stories.subquery()
+
+    if method == "db":
+        stmt = (
+            select(stories.c.id, stories.c.title, string_agg(Comment.text, " "))
+            .outerjoin(Comment, Comment.root_story_id == stories.c.id)
+            .group_by(stories.c.id, stories.c.title)
+            .order_by(stories.c.id)
+            .execution_options(yield_per=batch_size)
+        )
+        for story_id, title, context in session.execute(stmt):
+            yield story_id, title, context or ""
+        return
 
-    for story in q.yield_per(1000):
-        parts = []
-        cq = session.query(Comment).filter(Comment.parent == story.id)
-        for comment in cq.yield_per(1000):
-            if comment.text:
-                parts.append(clean_text(comment.text))
-        context = " ".join(p for p in parts if p).strip()
-        if context:
-            yield story.id, story.title, context
+    stmt = (
+        select(stories.c.id, stories.c.title, Comment.text)
+        .outerjoin(Comment, Comment.root_story_id == stories.c.id)
+        .order_by(stories.c.id, Comment.id)
+        .execution_options(yield_per=batch_size)
+    )
+    rows = session.execute(stmt)
+    for (story_id, title), grp in groupby(rows, key=lambda r: (r[0], r[1])):
+        yield story_id, title, " ".join(r[2] for r in grp if r[2])
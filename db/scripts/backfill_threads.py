@@ -0,0 +1,50 @@
+import argparse
+from time import perf_counter
+
+from sqlalchemy.orm import Session
+
+from db import get_engine
+from db.migrate import ensure_columns, ensure_indexes
+from db.threads import backfill_roots
+
+def parse_args():
+    p = argparse.ArgumentParser(
+        prog="backfill_threads",
+        description="Заполнение comment.root_story_id и comment.depth в существующей БД"
+    )
+    p.add_argument("-d", "--db", required=True, help="DB URL (например, sqlite:///hn.db)")
+    p.add_argument("-b", "--batch-size", type=int, default=10000, help="Комментариев за одну транзакцию (по умолчанию 10000)")
+    p.add_argument("-p", "--progress-every", type=int, default=100, help="Печатать прогресс каждые N пакетов (по умолчанию 100)")
+    return p.parse_args()
+
+def main() -> int:
+    args = parse_args()
+    try:
+        engine = get_engine(args.db)
+        added = ensure_columns(engine)
+        if added:
+            print(f"Добавлены колонки: {', '.join(added)}")
+        created = ensure_indexes(engine)
+        if created:
+            print(f"Созданы индексы: {', '.join(created)}")
+
+        t0 = perf_counter()
+        batches = 0
+
+        def progress(last_id, scanned, resolved):
+            nonlocal batches
+            batches += 1
+            if batches % args.progress_every == 0:
+                print(f"[id<={last_id}] просмотрено={scanned} разрешено={resolved} {perf_counter() - t0:.1f}s")
+
+        with Session(engine) as session:
+            stats = backfill_roots(session, batch_size=args.batch_size, progress=progress)
+        print(f"Готово: просмотрено={stats['scanned']} разрешено={stats['resolved']} "
+              f"без истории в БД={stats['scanned'] - stats['resolved']} за {perf_counter() - t0:.1f}s")
+        return 0
+    except Exception as e:
+        print(f"Ошибка: {e}")
+        return 1
+
+if __name__ == "__main__":
+    raise SystemExit(main())
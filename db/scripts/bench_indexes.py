@@ -0,0 +1,108 @@
+import argparse
+from datetime import timedelta
+from time import perf_counter
+
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+
+from db import get_engine
+from db.migrate import drop_indexes, ensure_indexes
+from db.models import Comment, Story, story_tech
+from db.queries import iter_story_titles_comments
+from db.scripts.export_comments_for_techs import all_thread_comments_for_tech
+
+def bench_titles_comments(session: Session, n: int) -> int:
+    # как export_titles/embeddings: комментарии по parent для каждой истории
+    return sum(1 for _ in iter_story_titles_comments(session, limit=n))
+
+def bench_context_join(session: Session, n: int) -> int:
+    # форма запроса export_context: join story -> comment по parent с агрегатом
+    ids = select(Story.id).order_by(Story.id.desc()).limit(n).scalar_subquery()
+    stmt = (
+        select(Story.id, func.count(Comment.id))
+        .outerjoin(Comment, Comment.parent == Story.id)
+        .where(Story.id.in_(ids))
+        .group_by(Story.id)
+    )
+    return len(session.execute(stmt).all())
+
+def bench_thread_cte(session: Session, n: int) -> int:
+    # export_comments_for_techs: рекурсивный CTE по parent для самой «маленькой» из топ-n технологий
+    stmt = (
+        select(story_tech.c.tech_id)
+        .group_by(story_tech.c.tech_id)
+        .order_by(func.count().desc())
+        .limit(n)
+    )
+    tech_ids = session.execute(stmt).scalars().all()
+    return sum(len(all_thread_comments_for_tech(session, tech_id)) for tech_id in tech_ids[-1:])
+
+def bench_recent_stories(session: Session, n: int) -> int:
+    # фильтр по Story.time (--since в экспортерах)
+    last = session.execute(select(func.max(Story.time))).scalar()
+    if last is None:
+        return 0
+    stmt = select(func.count(Story.id)).where(Story.time >= last - timedelta(days=1))
+    return session.execute(stmt).scalar_one()
+
+BENCHES = {
+    "iter_story_titles_comments": bench_titles_comments,
+    "export_context join": bench_context_join,
+    "export_comments_for_techs CTE": bench_thread_cte,
+    "story.time >= since": bench_recent_stories,
+}
+
+def run_benches(engine, n: int, repeat: int) -> dict:
+    res = {}
+    with Session(engine) as session:
+        for name, fn in BENCHES.items():
+            best = None
+            for _ in range(repeat):
+                t0 = perf_counter()
+                rows = fn(session, n)
+                dt = perf_counter() - t0
+                best = dt if best is None else min(best, dt)
+            res[name] = (best, rows)
+    return res
+
+def parse_args():
+    p = argparse.ArgumentParser(
+        prog="bench_indexes",
+        description="Замер экспортных запросов без индексов и с индексами из моделей"
+    )
+    p.add_argument("-d", "--db", required=True, help="DB URL (например, sqlite:///hn.db)")
+    p.add_argument("-n", "--stories", type=int, default=200, help="Сколько историй/технологий брать в каждом запросе (по умолчанию 200)")
+    p.add_argument("-r", "--repeat", type=int, default=3, help="Повторов каждого запроса, берётся лучшее время (по умолчанию 3)")
+    p.add_argument("--keep", action="store_true", help="Не удалять индексы перед первым замером (замер только «после»)")
+    return p.parse_args()
+
+def main() -> int:
+    args = parse_args()
+    try:
+        engine = get_engine(args.db)
+        before = None
+        if not args.keep:
+            dropped = drop_indexes(engine)
+            print(f"Удалены индексы для замера «до»: {', '.join(dropped) or '(не было)'}")
+            before = run_benches(engine, args.stories, args.repeat)
+
+        t0 = perf_counter()
+        created = ensure_indexes(engine)
+        print(f"Созданы индексы: {', '.join(created) or '(уже были)'} за {perf_counter() - t0:.1f} с")
+        after = run_benches(engine, args.stories, args.repeat)
+
+        print(f"{'запрос':<32} {'до, с':>10} {'после, с':>10} {'ускорение':>10}  строк")
+        for name, (t_after, rows) in after.items():
+            if before:
+                t_before = before[name][0]
+                speedup = f"{t_before / t_after:.1f}x" if t_after > 0 else "-"
+                print(f"{name:<32} {t_before:>10.3f} {t_after:>10.3f} {speedup:>10}  {rows}")
+            else:
+                print(f"{name:<32} {'-':>10} {t_after:>10.3f} {'-':>10}  {rows}")
+        return 0
+    except Exception as e:
+        print(f"Ошибка: {e}")
+        return 1
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,40 @@
+import argparse
+from time import perf_counter
+
+from db import get_engine
+from db.migrate import ensure_indexes, missing_indexes
+
+def parse_args():
+    p = argparse.ArgumentParser(
+        prog="ensure_indexes",
+        description="Создание недостающих индексов из моделей в существующей БД"
+    )
+    p.add_argument("-d", "--db", required=True, help="DB URL (например, sqlite:///hn.db)")
+    p.add_argument("--dry-run", action="store_true", help="Только показать, каких индексов не хватает")
+    return p.parse_args()
+
+def main() -> int:
+    args = parse_args()
+    try:
+        engine = get_engine(args.db)
+        missing = missing_indexes(engine)
+        if not missing:
+            print("Все индексы на месте")
+            return 0
+        for idx in missing:
+            cols = ", ".join(c.name for c in idx.columns)
+            print(f"- {idx.name}: {idx.table.name}({cols})")
+        if args.dry_run:
+            print(f"Не хватает индексов: {len(missing)}. Ничего не создано (dry-run).")
+            return 0
+
+        t0 = perf_counter()
+        created = ensure_indexes(engine)
+        print(f"Создано индексов: {len(created)} за {perf_counter() - t0:.1f} с")
+        return 0
+    except Exception as e:
+        print(f"Ошибка: {e}")
+        return 1
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -4,46 +4,116 @@ import argparse
 from pathlib import Path
 from db.models import Comment, Story, Tech, story_tech
 from db import session_scope
+from db.incremental import ExportManifest, high_water, new_id_range, open_manifest
 from sqlalchemy import select, func
 
 def all_thread_comments_for_tech(session: session_scope, tech_id: int, since=None):
-    base_sel = (
-        select(
-            Comment.id.label("id"),
-            Comment.text.label("text"),
-            Comment.parent.label("parent"),
-            Story.id.label("story_id"),
+    # вся ветка истории — одно равенство по индексу comment.root_story_id
+    # (заполняется при импорте или db.scripts.backfill_threads) вместо рекурсивного обхода
+    stmt = (
+        select(Comment.text)
+        .join(story_tech, story_tech.c.story_id == Comment.root_story_id)
+        .where(
+            story_tech.c.tech_id == tech_id,
+            Comment.text.isnot(None),
+            Comment.text != "[dead]",
         )
-        .join(Story, Comment.parent == Story.id)
-        .join(story_tech, story_tech.c.story_id == Story.id)
-        .where(story_tech.c.tech_id == tech_id)
     )
     if since is not None:
-        base_sel = base_sel.where(Story.time >= since)
-
-    thread_cte = base_sel.cte(name="thread_comments", recursive=True)
-
-    replies_sel = (
-        select(
-            Comment.id,
-            Comment.text,
-            Comment.parent,
-            thread_cte.c.story_id,
-        )
-        .join(thread_cte, Comment.parent == thread_cte.c.id)
-    )
+        stmt = stmt.join(Story, Story.id == Comment.root_story_id).where(Story.time >= since)
 
-    thread_cte = thread_cte.union_all(replies_sel)
+    return [t for (t,) in session.execute(stmt).all()]
 
+def iter_tech_comments(session: session_scope, tech_ids, since=None, batch_size: int = 10_000,
+                       id_range=None, since_time=None):
+    """
+    (tech_id, text) для всех переданных технологий одним потоковым запросом
+    вместо отдельного обхода комментариев на каждую технологию.
+    id_range и since_time отбирают сами комментарии (Comment.id, Comment.time) —
+    для дозаписи новых комментариев, в том числе в старых ветках.
+    """
     stmt = (
-        select(thread_cte.c.text)
+        select(story_tech.c.tech_id, Comment.text)
+        .join(story_tech, story_tech.c.story_id == Comment.root_story_id)
         .where(
-            thread_cte.c.text.isnot(None),
-            thread_cte.c.text != "[dead]",
+            story_tech.c.tech_id.in_(list(tech_ids)),
+            Comment.text.isnot(None),
+            Comment.text != "[dead]",
         )
+        .execution_options(yield_per=batch_size)
     )
+    if since is not None:
+        stmt = stmt.join(Story, Story.id == Comment.root_story_id).where(Story.time >= since)
+    if id_range:
+        stmt = stmt.where(Comment.id.between(*id_range))
+    if since_time is not None:
+        stmt = stmt.where(Comment.time > since_time)
 
-    return [t for (t,) in session.execute(stmt).all()]
+    for tech_id, text in session.execute(stmt):
+        yield tech_id, text
+
+class TechWriters:
+    """
+    Раскладывает строки по файлам технологий с ограниченной буферизацией.
+
+    У каждой технологии свой буфер до buffer_lines строк; если суммарно в буферах
+    больше max_buffered строк, сбрасывается самый большой. Файл открывается только
+    на время сброса, поэтому число технологий не упирается в лимит дескрипторов.
+    """
+
+    def __init__(self, paths: dict, buffer_lines: int = 1000, max_buffered: int = 200_000,
+                 append=False):
+        self.paths = paths
+        self.buffer_lines = buffer_lines
+        self.max_buffered = max_buffered
+        self.buffers = {}
+        self.buffered = 0
+        # в режиме дозаписи существующие файлы не перезаписываются;
+        # append может быть набором ключей — тогда дописываются только их файлы
+        self.started = set(paths) if append is True else set(append or ())
+        self.counts = {}
+
+    def write(self, key, line: str) -> None:
+        buf = self.buffers.setdefault(key, [])
+        buf.append(line)
+        self.buffered += 1
+        self.counts[key] = self.counts.get(key, 0) + 1
+        if len(buf) >= self.buffer_lines:
+            self.flush(key)
+        elif self.buffered > self.max_buffered:
+            self.flush(max(self.buffers, key=lambda k: len(self.buffers[k])))
+
+    def flush(self, key) -> None:
+        buf = self.buffers.pop(key, None)
+        if not buf:
+            return
+        mode = "a" if key in self.started else "w"
+        self.started.add(key)
+        with self.paths[key].open(mode, encoding="utf-8") as f:
+            f.write("\n".join(buf) + "\n")
+        self.buffered -= len(buf)
+
+    def close(self) -> None:
+        for key in list(self.buffers):
+            self.flush(key)
+        # технология без строк тоже получает файл, иначе в папке остался бы прежний
+        for key, path in self.paths.items():
+            if key not in self.started:
+                path.open("w", encoding="utf-8").close()
+                self.started.add(key)
+
+def remove_stale_files(out_dir: Path, paths: dict, manifest, recorded) -> list:
+    """
+    Удаляет файлы технологий, которые больше не проходят порог --minimum.
+    Трогаются только файлы из манифеста прошлых выгрузок (recorded) —
+    чужие файлы в выходной папке не удаляются.
+    """
+    keep = {p.name for p in paths.values()}
+    stale = sorted(name for name in recorded if name not in keep)
+    for name in stale:
+        (out_dir / name).unlink(missing_ok=True)
+        manifest.files.pop(name, None)
+    return stale
 
 def parse_args():
     p = argparse.ArgumentParser(
@@ -54,6 +124,11 @@ def parse_args():
     p.add_argument("-m", "--minimum", type=int, default=100, help="Минимальное число статей для выгрузки")
     p.add_argument("-o", "--output", required=True, help="Путь к выходной папке")
     p.add_argument("-f", "--filetype", default="txt", help="Формат выходного файла")
+    p.add_argument("--buffer-lines", type=int, default=1000, help="Строк в буфере одной технологии до записи на диск (по умолчанию 1000)")
+    p.add_argument("--since-id", type=int, default=None, help="Дописать в файлы только комментарии с id больше заданного (только txt)")
+    p.add_argument("--since-time", default=None, help="Дописать в файлы только комментарии новее заданного времени (unix или ISO)")
+    p.add_argument("--incremental", action="store_true",
+                   help="Дописать комментарии после верхней границы из манифеста <output>.manifest.json (без манифеста — полная выгрузка)")
     return p.parse_args()
 
 def main():
@@ -76,34 +151,80 @@ def main():
 
             techs = session.execute(stmt).all()
 
+            names = {tech_id: tech_name for tech_id, tech_name, _cnt in techs}
+
             if args.filetype == "json":
-                out_path = Path(args.output)
-                out_path = out_path + "comments.json"
-                result = []
-                for tech_id, tech_name, _cnt in techs:
-                    cmts = all_thread_comments_for_tech(session=session, tech_id=tech_id)
-                    cmts = [c for c in cmts if c]
-                    result.append({
-                        "tech_id": tech_id,
-                        "tech": tech_name,
-                        "comments": cmts,
-                    })
+                if args.since_id is not None or args.since_time or args.incremental:
+                    raise ValueError("дозапись поддерживается только для -f txt: comments.json пишется целиком")
+                out_dir = Path(args.output)
+                out_dir.mkdir(parents=True, exist_ok=True)
+                out_path = out_dir / "comments.json"
+                by_tech = {tech_id: [] for tech_id in names}
+                for tech_id, text in iter_tech_comments(session, names):
+                    if text:
+                        by_tech[tech_id].append(text)
+                result = [
+                    {"tech_id": tech_id, "tech": names[tech_id], "comments": cmts}
+                    for tech_id, cmts in by_tech.items()
+                ]
                 with out_path.open("w", encoding="utf-8") as f:
                     json.dump(result, f, ensure_ascii=False, indent=2)
+                print(f'Готово: экспорт комментариев в {out_path}')
             elif args.filetype == "txt":
                 out_dir = Path(args.output)
                 out_dir.mkdir(parents=True, exist_ok=True)
 
-                for tech_id, tech_name, _cnt in techs:
-                    cmts = all_thread_comments_for_tech(session=session, tech_id=tech_id)
-                    cmts = [c.strip() for c in cmts if c and c.strip()]
-                    if not cmts:
-                        continue
+                # полная выгрузка начинает манифест заново — прошлые файлы берём из сохранённого
+                recorded = set(ExportManifest.load(out_dir, "export_comments_for_techs", args.filetype).files)
+                manifest, since_id, since_time = open_manifest(
+                    out_dir, "export_comments_for_techs", args.filetype,
+                    args.since_id, args.since_time, args.incremental)
+                append = since_id is not None or since_time is not None
+                # граница по комментариям: новые ответы в старых ветках тоже попадут в дозапись
+                upto = high_water(session, Comment.id, Comment.time)
+                id_range = new_id_range(since_id, upto[0])
+
+                paths = {}
+                for tech_id, tech_name in names.items():
                     safe_name = re.sub(r"[^\w.-]+", "_", tech_name.strip())
-                    file_path = out_dir / f"{safe_name}_{tech_id}.txt"
-                    with file_path.open("w", encoding="utf-8") as f:
-                        f.write("\n".join(cmts) + ("\n" if cmts else ""))
-                print(f'Готово: экспорт комментариев в {out_dir}')
+                    paths[tech_id] = out_dir / f"{safe_name}_{tech_id}.txt"
+
+                # технология, впервые прошедшая порог, в дозаписи получила бы только дельту —
+                # её файл выгружается целиком (до той же верхней границы)
+                fresh = [tech_id for tech_id, p in paths.items() if append and p.name not in manifest.files]
+                has_delta = id_range is not None and id_range[0] <= id_range[1]
+                stale = remove_stale_files(out_dir, paths, manifest, recorded)
+                if append and not has_delta and not fresh and not stale:
+                    print(f"Новых комментариев после id={since_id} нет, {out_dir} не изменена")
+                    return 0
+                for tech_id in fresh:
+                    paths[tech_id].unlink(missing_ok=True)
+
+                manifest.start(paths.values(), append)
+                writers = TechWriters(paths, buffer_lines=args.buffer_lines,
+                                      append=set(paths) - set(fresh) if append else False)
+                passes = []
+                if append:
+                    delta_ids = [tech_id for tech_id in names if tech_id not in fresh]
+                    if delta_ids and has_delta:
+                        passes.append((delta_ids, id_range, since_time))
+                    if fresh:
+                        passes.append((fresh, new_id_range(None, upto[0]), None))
+                else:
+                    passes.append((names, id_range, None))
+                try:
+                    for tech_ids, rng, after in passes:
+                        for tech_id, text in iter_tech_comments(session, tech_ids, id_range=rng, since_time=after):
+                            text = text.strip() if text else ""
+                            if text:
+                                writers.write(tech_id, text)
+                finally:
+                    writers.close()
+                manifest.record_run(since_id, since_time, upto, sum(writers.counts.values()), paths.values(), append)
+                manifest.save()
+                print(f'Готово: экспорт комментариев в {out_dir} ({len(writers.counts)} технологий'
+                      + (f', целиком: {len(fresh)}' if fresh else '')
+                      + (f', удалено устаревших файлов: {len(stale)}' if stale else '') + ')')
         return 0
     except Exception as e:
         print(f"Ошибка: {e}")
@@ -1,9 +1,13 @@
 import argparse
+import csv
+import json
 from pathlib import Path
-from sqlalchemy import select, func
 
-from db.models import Comment, Story
 from db import session_scope
+from db.export_engine import parallel_export
+from db.incremental import high_water, new_id_range, open_manifest
+from db.models import Story
+from db.queries import iter_story_contexts
 from utils.clean_text import clean_text
 
 def parse_args():
@@ -16,8 +20,48 @@ def parse_args():
     p.add_argument("--format", choices=["txt", "csv", "jsonl"], default="txt", help="Формат выхода (по умолчанию txt)")
     p.add_argument("--limit", type=int, default=None, help="Ограничение числа записей")
     p.add_argument("--keep-deleted", action="store_true", help="Не фильтровать deleted/dead")
+    p.add_argument("--aggregate", choices=["auto", "db", "stream"], default="auto",
+                   help="Где склеивать комментарии: db — агрегатом в СУБД, stream — на клиенте по одной ветке "
+                        "(для очень больших веток и MySQL); по умолчанию auto")
+    p.add_argument("-j", "--jobs", type=int, default=1, help="Число процессов выгрузки по диапазонам Story.id (по умолчанию 1)")
+    p.add_argument("--since-id", type=int, default=None, help="Дописать в файл только истории с id больше заданного")
+    p.add_argument("--since-time", default=None, help="Дописать в файл только истории новее заданного времени (unix или ISO, например 2024-05-01)")
+    p.add_argument("--incremental", action="store_true",
+                   help="Дописать истории после верхней границы из манифеста <out>.manifest.json (без манифеста — полная выгрузка)")
     return p.parse_args()
 
+def write_contexts(rows, out_path, fmt: str, header: bool = True, append: bool = False) -> int:
+    n = 0
+    mode = "a" if append else "w"
+    if fmt == "txt":
+        with open(out_path, mode, encoding="utf-8") as f:
+            for _, title, context in rows:
+                f.write(clean_text(f"{title} {context}") + "\n")
+                n += 1
+
+    elif fmt == "csv":
+        with open(out_path, mode, encoding="utf-8", newline="") as f:
+            w = csv.writer(f)
+            if header and not append:
+                w.writerow(["id", "title", "context"])
+            for _id, title, context in rows:
+                w.writerow([_id, title, clean_text(context)])
+                n += 1
+
+    else:  # jsonl
+        with open(out_path, mode, encoding="utf-8") as f:
+            for _id, title, context in rows:
+                obj = {"id": _id, "title": title, "context": clean_text(context)}
+                f.write(json.dumps(obj, ensure_ascii=False) + "\n")
+                n += 1
+    return n
+
+def export_range(db_url: str, lo: int, hi: int, part_path: str, fmt: str, aggregate: str,
+                 since_time=None) -> int:
+    with session_scope(db_url) as session:
+        rows = iter_story_contexts(session, method=aggregate, id_range=(lo, hi), since_time=since_time)
+        return write_contexts(rows, part_path, fmt, header=False)
+
 def main() -> int:
 
     args = parse_args()
@@ -25,30 +69,35 @@ def main() -> int:
         out_path = Path(args.out)
         out_path.parent.mkdir(parents=True, exist_ok=True)
 
+        manifest, since_id, since_time = open_manifest(
+            out_path, "export_context", args.format, args.since_id, args.since_time, args.incremental)
+        append = since_id is not None or since_time is not None
+
         with session_scope(args.db) as session:
-            if args.format == "txt":
-                with open(out_path, "w", encoding="utf-8") as f:
-                    stmt = (
-                    select(
-                        Story.id,
-                        Story.title,
-                        func.coalesce(func.string_agg(Comment.text, ' '), '')
-                    )
-                    .outerjoin(Comment, Comment.parent == Story.id)
-                    .group_by(Story.id, Story.title)
-                    .execution_options(stream_results=True)
-                )
-                    result = session.execute(stmt).tuples()
-                    for batch in result.partitions(10_000):
-                        lines = [f"{title} {context}\n" for _, title, context in batch]
-                        clean_lines = [clean_text(line) + "\n" for line in lines]
-                        f.writelines(clean_lines)
-            elif args.format == "csv":
-                pass
-            else:
-                pass
-
-        print(f"Готово: экспорт заголовков и комментариев в {out_path}")
+            upto = high_water(session, Story.id, Story.time)
+        id_range = new_id_range(since_id, upto[0])
+        if append and (id_range is None or id_range[0] > id_range[1]):
+            print(f"Новых историй после id={since_id} нет, {out_path} не изменён")
+            return 0
+
+        manifest.start([out_path], append)
+        if args.jobs > 1:
+            n = parallel_export(
+                export_range, args.db, out_path, Story.id, args.jobs,
+                fmt=args.format, limit=args.limit,
+                header=["id", "title", "context"] if args.format == "csv" else None,
+                id_range=id_range, append=append,
+                aggregate=args.aggregate, since_time=since_time,
+            )
+        else:
+            with session_scope(args.db) as session:
+                rows = iter_story_contexts(session, method=args.aggregate, limit=args.limit,
+                                           id_range=id_range, since_time=since_time)
+                n = write_contexts(rows, out_path, args.format, append=append)
+        manifest.record_run(since_id, since_time, upto, n, [out_path], append)
+        manifest.save()
+
+        print(f"Готово: экспорт заголовков и комментариев в {out_path}" + (f" (дописано {n} строк)" if append else ""))
         return 0
     except Exception as e:
         print(f"Ошибка: {e}")
@@ -1,10 +1,16 @@
 import argparse
 import csv
+import heapq
+from datetime import datetime
+from itertools import islice
 from pathlib import Path
 from sqlalchemy import select, func
 
 from db.models import Story, Tech, story_tech
 from db import session_scope
+from db.aggregates import string_agg
+from db.export_engine import parallel_export
+from db.columnar import FORMATS, ColumnarWriter, infer_format, stories_meta_schema
 
 def parse_args():
     p = argparse.ArgumentParser(
@@ -13,56 +19,124 @@ def parse_args():
     )
     p.add_argument("-d", "--db", required=True, help="DB URL (например, sqlite:///hn.db)")
     p.add_argument("-o", "--output", required=True, help="Путь к выходному файлу (например, samples/titles.txt)")
+    p.add_argument("--format", choices=FORMATS, default=None,
+                   help="Формат: csv, parquet или arrow (Arrow IPC/Feather); по умолчанию по расширению файла, иначе csv")
+    p.add_argument("--batch-size", type=int, default=50_000, help="Строк в одном пакете чтения/записи (по умолчанию 50000)")
+    p.add_argument("-j", "--jobs", type=int, default=1, help="Число процессов выгрузки по диапазонам Story.id (по умолчанию 1)")
     return p.parse_args()
 
+FIELDNAMES = ["id", "title", "score", "time", "descendants", "techs_count", "tech_names"]
+
+def stories_meta_stmt(id_range=None):
+    tech_agg = (
+        select(
+            story_tech.c.story_id.label("story_id"),
+            func.count(func.distinct(story_tech.c.tech_id)).label("techs_count"),
+            # пары (story_id, tech_id) уникальны по PK, а Tech.name уникален, так что DISTINCT не нужен
+            string_agg(Tech.name, "|").label("tech_names_csv"),
+        )
+        .select_from(story_tech.join(Tech, Tech.id == story_tech.c.tech_id))
+        .group_by(story_tech.c.story_id)
+    ).subquery()
+
+    stmt = (
+        select(
+            Story.id,
+            Story.title,
+            Story.score,
+            Story.time,
+            Story.descendants,
+            func.coalesce(tech_agg.c.techs_count, 0).label("techs_count"),
+            tech_agg.c.tech_names_csv.label("tech_names_csv"),
+        )
+        .outerjoin(tech_agg, tech_agg.c.story_id == Story.id)
+        # NULL в конце явно: по умолчанию SQLite ставит их в конец DESC, а PostgreSQL — в начало;
+        # NULLS LAST не поддерживает MySQL, поэтому сортируем по признаку IS NULL
+        .order_by(Story.descendants.is_(None), Story.descendants.desc(), Story.id.asc())
+    )
+    if id_range:
+        stmt = stmt.where(Story.id.between(*id_range))
+    return stmt
+
+def iter_meta_batches(session, batch_size: int, id_range=None):
+    """Пакеты кортежей (id, title, score, time, descendants, techs_count, [tech_names])."""
+    result = session.execute(stories_meta_stmt(id_range).execution_options(yield_per=batch_size))
+    for batch in result.partitions():
+        yield [
+            (r[0], r[1], r[2], r[3], r[4], r[5], r[6].split("|") if r[6] else [])
+            for r in batch
+        ]
+
+def write_meta(batches, out_path, fmt: str, header: bool = True) -> int:
+    n = 0
+    if fmt == "csv":
+        with open(out_path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            if header:
+                writer.writerow(FIELDNAMES)
+            for batch in batches:
+                writer.writerows(
+                    (_id, title, score, time.isoformat() if time else "", desc, cnt, "|".join(names))
+                    for _id, title, score, time, desc, cnt, names in batch
+                )
+                n += len(batch)
+    else:
+        with ColumnarWriter(out_path, stories_meta_schema(), fmt) as writer:
+            for batch in batches:
+                writer.write_rows(batch)
+        n = writer.rows
+    return n
+
+def export_range(db_url: str, lo: int, hi: int, part_path: str, fmt: str, batch_size: int) -> int:
+    with session_scope(db_url) as session:
+        return write_meta(iter_meta_batches(session, batch_size, id_range=(lo, hi)), part_path, fmt, header=False)
+
+def _sort_key(row):
+    # порядок stories_meta_stmt на любой СУБД: descendants по убыванию с NULL в конце, затем id
+    desc = row[4]
+    return (desc is None, -(desc or 0), row[0])
+
+def _iter_part_rows(part: Path, fmt: str):
+    if fmt == "csv":
+        with open(part, "r", encoding="utf-8", newline="") as f:
+            for r in csv.reader(f):
+                yield (int(r[0]), r[1], int(r[2]) if r[2] else None,
+                       datetime.fromisoformat(r[3]) if r[3] else None,
+                       int(r[4]) if r[4] else None, int(r[5]), r[6].split("|") if r[6] else [])
+        return
+    from db.columnar import read_batches
+    for batch in read_batches(part, fmt):
+        yield from zip(*(batch.column(i).to_pylist() for i in range(batch.num_columns)))
+
+def merge_parts(parts, out_path: Path, fmt: str, batch_size: int) -> None:
+    """Части отсортированы каждая по отдельности — сливаем их k-way слиянием потоково."""
+    merged = heapq.merge(*(_iter_part_rows(p, fmt) for p in parts), key=_sort_key)
+    write_meta(_batched(merged, batch_size), out_path, fmt)
+
+def _batched(rows, size: int):
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
 def main() -> int:
 
     args = parse_args()
     try:
         out_path = Path(args.output)
         out_path.parent.mkdir(parents=True, exist_ok=True)
+        fmt = args.format or infer_format(out_path)
 
-        with session_scope(args.db) as session:
-            fieldnames = ["id", "title", "score", "time", "descendants", "techs_count", "tech_names"]
-            with open(out_path, "w", encoding="utf-8", newline="") as f:
-                tech_agg = (
-                select(
-                    story_tech.c.story_id.label("story_id"),
-                    func.count(func.distinct(story_tech.c.tech_id)).label("techs_count"),
-                    func.group_concat(func.distinct(Tech.name)).label("tech_names_csv"),
-                )
-                .select_from(story_tech.join(Tech, Tech.id == story_tech.c.tech_id))
-                .group_by(story_tech.c.story_id)
-                ).subquery()
-
-                stmt = (
-                select(
-                    Story.id,
-                    Story.title,
-                    Story.score,
-                    Story.time,
-                    Story.descendants,
-                    func.coalesce(tech_agg.c.techs_count, 0).label("techs_count"),
-                    tech_agg.c.tech_names_csv.label("tech_names_csv"),
-                )
-                .outerjoin(tech_agg, tech_agg.c.story_id == Story.id)
-                .order_by(Story.descendants.desc(), Story.id.asc())
-                )
-
-                rows = session.execute(stmt).mappings().all()
-                result = [
-                    {
-                        **row,
-                        "tech_list": row["tech_names_csv"].split(",") if row["tech_names_csv"] else [],
-                    }
-                    for row in rows
-                ]
-                writer = csv.writer(f)
-                writer.writerow(fieldnames)
-                for r in result:
-                    time_str = r["time"].isoformat() if r["time"] else ""
-                    tech_names_str = "|".join(r["tech_list"])
-                    writer.writerow([r["id"], r["title"], r["score"], time_str, r["descendants"], r["techs_count"], tech_names_str])
+        if args.jobs > 1:
+            parallel_export(
+                export_range, args.db, out_path, Story.id, args.jobs, fmt=fmt,
+                merge=lambda parts, out: merge_parts(parts, out, fmt, args.batch_size),
+                batch_size=args.batch_size,
+            )
+        else:
+            with session_scope(args.db) as session:
+                write_meta(iter_meta_batches(session, args.batch_size), out_path, fmt)
 
         print(f"Готово: экспорт данных в {out_path}")
         return 0
@@ -71,4 +145,4 @@ def main() -> int:
         return 1
 
 if __name__ == "__main__":
-    raise SystemExit(main())
\ No newline at end of file
+    raise SystemExit(main())
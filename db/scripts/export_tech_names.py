@@ -3,6 +3,8 @@ from pathlib import Path
 import csv
 import json
 from db import session_scope
+from db.export_engine import parallel_export
+from db.models import Tech
 from db.queries import iter_tech_names
 
 def parse_args():
@@ -14,33 +16,54 @@ def parse_args():
     p.add_argument("-o", "--out", required=True, help="Путь к выходному файлу (например, samples/titles.txt)")
     p.add_argument("--format", choices=["txt", "csv", "jsonl"], default="txt", help="Формат выхода (по умолчанию txt)")
     p.add_argument("--limit", type=int, default=None, help="Ограничение числа записей")
+    p.add_argument("-j", "--jobs", type=int, default=1, help="Число процессов выгрузки по диапазонам Tech.id (по умолчанию 1)")
     return p.parse_args()
 
+def write_tech_names(rows, out_path, fmt: str, header: bool = True) -> int:
+    n = 0
+    if fmt == "txt":
+        with open(out_path, "w", encoding="utf-8") as f:
+            for _, name in rows:
+                f.write(name + "\n")
+                n += 1
+
+    elif fmt == "csv":
+        with open(out_path, "w", encoding="utf-8", newline="") as f:
+            w = csv.writer(f)
+            if header:
+                w.writerow(["id", "name"])
+            for _id, name in rows:
+                w.writerow([_id, name])
+                n += 1
+
+    else:
+        with open(out_path, "w", encoding="utf-8") as f:
+            for _id, name in rows:
+                f.write(json.dumps({"id": _id, "name": name}, ensure_ascii=False) + "\n")
+                n += 1
+    return n
+
+def export_range(db_url: str, lo: int, hi: int, part_path: str, fmt: str) -> int:
+    with session_scope(db_url) as session:
+        rows = iter_tech_names(session, id_range=(lo, hi))
+        return write_tech_names(rows, part_path, fmt, header=False)
+
 def main() -> int:
     args = parse_args()
     try:
         out_path = Path(args.out)
         out_path.parent.mkdir(parents=True, exist_ok=True)
 
-        with session_scope(args.db) as session:
-            rows = iter_tech_names(session, limit=args.limit)
-
-            if args.format == "txt":
-                with open(out_path, "w", encoding="utf-8") as f:
-                    for _, name in rows:
-                        f.write(name + "\n")
-
-            elif args.format == "csv":
-                with open(out_path, "w", encoding="utf-8", newline="") as f:
-                    w = csv.writer(f)
-                    w.writerow(["id", "name"])
-                    for _id, name in rows:
-                        w.writerow([_id, name])
-
-            else:
-                with open(out_path, "w", encoding="utf-8") as f:
-                    for _id, name in rows:
-                        f.write(json.dumps({"id": _id, "name": name}, ensure_ascii=False) + "\n")
+        if args.jobs > 1:
+            parallel_export(
+                export_range, args.db, out_path, Tech.id, args.jobs,
+                fmt=args.format, limit=args.limit,
+                header=["id", "name"] if args.format == "csv" else None,
+            )
+        else:
+            with session_scope(args.db) as session:
+                rows = iter_tech_names(session, limit=args.limit)
+                write_tech_names(rows, out_path, args.format)
 
         print(f"Готово: экспорт технологий в {out_path}")
         return 0
@@ -1,12 +1,14 @@
 import argparse
 import sys
+from contextlib import nullcontext
 from pathlib import Path
-from sqlalchemy import create_engine
 
-ROOT = Path(__file__).resolve().parents[1]
+ROOT = Path(__file__).resolve().parents[2]
 sys.path.insert(0, str(ROOT))
 
 from hackernews_handler import HNHandler
+from db.session import get_engine, sqlite_bulk_load
+from scripts.shards import MANIFEST_NAME, manifest_files
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
@@ -22,13 +24,32 @@ def parse_args() -> argparse.Namespace:
         "-i", "--input",
         required=True,
         nargs="+",
-        help="Путь(и) к файлам JSONL или JSONL.GZ с сырыми данными"
+        help="Путь(и) к файлам JSONL или JSONL.GZ с сырыми данными или к manifest.json шардированной загрузки"
     )
     parser.add_argument(
         "-b", "--batch-size",
         type=int,
-        default=1000,
-        help="Размер пакетной вставки (по умолчанию 1000)"
+        default=None,
+        help="Размер пакетной вставки (по умолчанию 1000, с --bulk для PostgreSQL — 50000)"
+    )
+    parser.add_argument(
+        "--bulk",
+        action="store_true",
+        help="Профиль массовой загрузки: для PostgreSQL — COPY во временную таблицу и один upsert на пакет, "
+             "для SQLite — WAL, synchronous=OFF, большой кэш, крупные транзакции и отложенное построение индексов"
+    )
+    parser.add_argument(
+        "--commit-every",
+        type=int,
+        default=None,
+        help="Сколько пакетов писать в одной транзакции (по умолчанию 1, с --bulk — 200)"
+    )
+    parser.add_argument(
+        "-w", "--workers",
+        type=int,
+        default=1,
+        help="Число процессов разбора JSON; при значении больше 1 файлы читаются параллельно, "
+             "а запись в БД идёт отдельным конвейером (по умолчанию 1)"
     )
     parser.add_argument(
         "--echo",
@@ -37,36 +58,68 @@ def parse_args() -> argparse.Namespace:
     )
     return parser.parse_args()
 
-def main() -> int:
-    args = parse_args()
-
-    try:
-        engine = create_engine(args.db, echo=args.echo)
-    except Exception as e:
-        print(f"Ошибка создания engine для '{args.db}': {e}", file=sys.stderr)
-        return 1
-
-    handler = HNHandler(engine, batch_size=args.batch_size)
-
+def ingest(handler: HNHandler, args: argparse.Namespace) -> int:
     total_stories = 0
     total_comments = 0
 
+    paths = []
     for path in args.input:
+        if Path(path).name == MANIFEST_NAME:
+            paths.extend(str(p) for p in manifest_files(path))
+        else:
+            paths.append(path)
+
+    if args.workers > 1:
         try:
-            print(f"Импорт из файла: {path}")
-            counts = handler.ingest_from_path(path)
-            print(f"Готово: stories={counts['stories']}, comments={counts['comments']}")
-            total_stories += counts["stories"]
-            total_comments += counts["comments"]
+            print(f"Конвейерный импорт {len(paths)} файл(ов), процессов разбора: {args.workers}")
+            per_file = handler.ingest_paths(paths, workers=args.workers)
         except FileNotFoundError as e:
             print(f"Файл не найден: {e}", file=sys.stderr)
             return 2
         except Exception as e:
-            print(f"Ошибка импорта из '{path}': {e}", file=sys.stderr)
+            print(f"Ошибка импорта: {e}", file=sys.stderr)
             return 3
+        for path, counts in per_file.items():
+            print(f"{path}: stories={counts['stories']}, comments={counts['comments']}")
+            total_stories += counts["stories"]
+            total_comments += counts["comments"]
+    else:
+        for path in paths:
+            try:
+                print(f"Импорт из файла: {path}")
+                counts = handler.ingest_from_path(path)
+                print(f"Готово: stories={counts['stories']}, comments={counts['comments']}")
+                total_stories += counts["stories"]
+                total_comments += counts["comments"]
+            except FileNotFoundError as e:
+                print(f"Файл не найден: {e}", file=sys.stderr)
+                return 2
+            except Exception as e:
+                print(f"Ошибка импорта из '{path}': {e}", file=sys.stderr)
+                return 3
 
     print(f"Всего загружено: stories={total_stories}, comments={total_comments}")
     return 0
 
+def main() -> int:
+    args = parse_args()
+
+    try:
+        engine = get_engine(args.db, echo=args.echo)
+    except Exception as e:
+        print(f"Ошибка создания engine для '{args.db}': {e}", file=sys.stderr)
+        return 1
+
+    dialect = engine.dialect.name
+    batch_size = args.batch_size or (50000 if args.bulk and dialect == "postgresql" else 1000)
+    commit_every = args.commit_every or (200 if args.bulk else 1)
+    handler = HNHandler(engine, batch_size=batch_size, bulk=args.bulk, commit_every=commit_every)
+    if args.bulk and dialect not in ("postgresql", "sqlite"):
+        print(f"--bulk для {dialect} включает только крупные транзакции", file=sys.stderr)
+
+    with sqlite_bulk_load(engine) if args.bulk else nullcontext():
+        return ingest(handler, args)
+
+
 if __name__ == "__main__":
     sys.exit(main())
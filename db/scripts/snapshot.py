@@ -0,0 +1,176 @@
+import argparse
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from itertools import islice
+from pathlib import Path
+from time import perf_counter
+
+from sqlalchemy import select
+
+from db import session_scope
+from db.columnar import (
+    PARTITIONED_TABLES, SNAPSHOT_MANIFEST, ds, month_partitioning, pa, pc, require_pyarrow, snapshot_schemas,
+)
+from db.models import Comment, Story, Tech, story_tech
+
+TABLES = ("story", "comment", "tech", "story_tech")
+
+# колонки в порядке схем snapshot_schemas (без month — он вычисляется из time)
+COLUMNS = {
+    "story": (Story.id, Story.author, Story.descendants, Story.score, Story.time, Story.title, Story.url),
+    "comment": (Comment.id, Comment.author, Comment.parent, Comment.time, Comment.text,
+                Comment.root_story_id, Comment.depth),
+    "tech": (Tech.id, Tech.name),
+    "story_tech": (story_tech.c.story_id, story_tech.c.tech_id),
+}
+
+def parse_args():
+    p = argparse.ArgumentParser(
+        prog="snapshot",
+        description="Снимок таблиц story, comment, tech и story_tech в колоночный датасет (Parquet/Arrow), "
+                    "story и comment партиционированы по месяцу time"
+    )
+    p.add_argument("-d", "--db", required=True, help="DB URL (например, sqlite:///hn.db)")
+    p.add_argument("-o", "--out", required=True, help="Папка снимка (например, artifacts/snapshot)")
+    p.add_argument("--format", choices=["parquet", "arrow"], default="parquet",
+                   help="parquet (zstd) или arrow (Arrow IPC, читается через memory map); по умолчанию parquet")
+    p.add_argument("-t", "--tables", nargs="+", choices=TABLES, default=list(TABLES),
+                   help="Какие таблицы снять (по умолчанию все)")
+    p.add_argument("--batch-size", type=int, default=100_000, help="Строк в одном пакете чтения/записи (по умолчанию 100000)")
+    p.add_argument("-j", "--jobs", type=int, default=1, help="Сколько таблиц снимать параллельно (по умолчанию 1)")
+    return p.parse_args()
+
+def iter_record_batches(session, table: str, schema, batch_size: int):
+    """Пакеты RecordBatch из таблицы БД по возрастанию ключа; month — YYYY-MM от time."""
+    cols = COLUMNS[table]
+    stmt = select(*cols).order_by(*(cols[:2] if table == "story_tech" else cols[:1]))
+    rows = iter(session.execute(stmt.execution_options(yield_per=batch_size)))
+    fields = [f for f in schema if f.name != "month"]
+    while True:
+        chunk = list(islice(rows, batch_size))
+        if not chunk:
+            return
+        columns = list(zip(*chunk))
+        arrays = [pa.array(col, type=field.type) for col, field in zip(columns, fields)]
+        if table in PARTITIONED_TABLES:
+            time_idx = [f.name for f in fields].index("time")
+            arrays.append(pc.strftime(arrays[time_idx], format="%Y-%m"))
+        yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+def snapshot_table(db_url: str, out_dir: str, table: str, fmt: str, batch_size: int) -> int:
+    """
+    Пишет одну таблицу во временную папку и подменяет ею прежнюю,
+    так что читатели никогда не видят наполовину записанный снимок таблицы.
+
+    Прежняя папка сначала переименовывается в .<table>.old, на её место
+    переименовывается новая, и только потом старая удаляется: папка таблицы
+    отсутствует лишь между двумя rename, а не на время удаления, и падение
+    в этот момент не теряет прежний снимок (см. restore_tables).
+    """
+    schema = snapshot_schemas()[table]
+    final = Path(out_dir) / table
+    tmp = Path(out_dir) / f".{table}.tmp"
+    old = Path(out_dir) / f".{table}.old"
+    restore_tables(Path(out_dir), [table])
+    shutil.rmtree(old, ignore_errors=True)
+    shutil.rmtree(tmp, ignore_errors=True)
+
+    if fmt == "parquet":
+        file_format = ds.ParquetFileFormat()
+        # словарное кодирование только для повторяющихся строк; длинные тексты словарь лишь раздувает
+        dict_columns = [f.name for f in schema if pa.types.is_dictionary(f.type)]
+        options = file_format.make_write_options(compression="zstd", use_dictionary=dict_columns)
+    else:
+        file_format = ds.IpcFileFormat()
+        options = file_format.make_write_options(compression="zstd")
+
+    rows = 0
+
+    def counted():
+        nonlocal rows
+        with session_scope(db_url) as session:
+            for batch in iter_record_batches(session, table, schema, batch_size):
+                rows += batch.num_rows
+                yield batch
+
+    ds.write_dataset(
+        counted(), str(tmp), schema=schema, format=file_format, file_options=options,
+        partitioning=month_partitioning() if table in PARTITIONED_TABLES else None,
+        max_rows_per_group=batch_size, existing_data_behavior="overwrite_or_ignore",
+    )
+    if final.exists():
+        final.rename(old)
+    tmp.rename(final)
+    shutil.rmtree(old, ignore_errors=True)
+    return rows
+
+def restore_tables(out_dir: Path, tables=TABLES) -> list:
+    """Возвращает на место таблицы, прошлый запуск которых упал между двумя rename в snapshot_table."""
+    restored = []
+    for table in tables:
+        old = out_dir / f".{table}.old"
+        if old.exists() and not (out_dir / table).exists():
+            old.rename(out_dir / table)
+            restored.append(table)
+    return restored
+
+def write_manifest(out_dir: Path, fmt: str, counts: dict) -> None:
+    path = out_dir / SNAPSHOT_MANIFEST
+    state = {"format": fmt, "tables": {}}
+    if path.exists():
+        with path.open("r", encoding="utf-8") as f:
+            state = json.load(f)
+    state["format"] = fmt
+    created = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    for table, rows in counts.items():
+        state["tables"][table] = {"rows": rows, "created": created,
+                                  "partitioning": "month" if table in PARTITIONED_TABLES else None}
+    # tmp + os.replace: прерванный запуск не оставит обрезанный манифест рядом с уже подменёнными таблицами
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def main() -> int:
+    args = parse_args()
+    try:
+        require_pyarrow()
+        out_dir = Path(args.out)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        for table in restore_tables(out_dir):
+            print(f"{table}: восстановлен прежний снимок после прерванной подмены")
+        manifest = out_dir / SNAPSHOT_MANIFEST
+        if manifest.exists():
+            with manifest.open("r", encoding="utf-8") as f:
+                prev = json.load(f).get("format")
+            if prev != args.format and set(args.tables) != set(TABLES):
+                raise ValueError(f"снимок в {out_dir} в формате {prev}; частичное обновление в {args.format} невозможно")
+
+        t0 = perf_counter()
+        counts = {}
+        if args.jobs > 1:
+            with ProcessPoolExecutor(max_workers=args.jobs) as ex:
+                futures = {t: ex.submit(snapshot_table, args.db, str(out_dir), t, args.format, args.batch_size)
+                           for t in args.tables}
+                for table, fut in futures.items():
+                    counts[table] = fut.result()
+                    print(f"{table}: {counts[table]} строк")
+        else:
+            for table in args.tables:
+                counts[table] = snapshot_table(args.db, str(out_dir), table, args.format, args.batch_size)
+                print(f"{table}: {counts[table]} строк")
+
+        write_manifest(out_dir, args.format, counts)
+        print(f"Готово: снимок в {out_dir} за {perf_counter() - t0:.1f}s")
+        return 0
+    except Exception as e:
+        print(f"Ошибка: {e}")
+        return 1
+
+if __name__ == "__main__":
+    raise SystemExit(main())
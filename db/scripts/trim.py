@@ -1,44 +1,184 @@
 import argparse
-from sqlalchemy import select, delete, func
+from time import perf_counter
+from typing import Callable, Optional
+
+from sqlalchemy import delete, exists, func, inspect, select, text
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import Session
 
-from db import session_scope
-from db.models import Story
+from db import get_engine
+from db.models import Comment, Story, comment_tech, story_tech, story_tech_mentions
+
+# без технологий: ни одной строки в story_tech
+_NO_TECHS = ~exists().where(story_tech.c.story_id == Story.id)
+
+
+def _has_mention_tables(session: Session) -> bool:
+    """comment_tech/story_tech_mentions появляются только после classify_comments."""
+    return inspect(session.get_bind()).has_table(comment_tech.name)
+
 
-def delete_stories_without_techs(session: Session, dry_run: bool = False) -> int:
-    # Посчитать количество историй без технологий
-    count_stmt = select(func.count(Story.id)).where(~Story.techs.any())
-    total = session.execute(count_stmt).scalar_one()
+def delete_stories_without_techs(session: Session,
+                                 dry_run: bool = False,
+                                 chunk_size: int = 5000,
+                                 start_id: Optional[int] = None,
+                                 time_budget: Optional[float] = None,
+                                 progress: Optional[Callable[[int, int, int], None]] = None) -> dict:
+    """
+    Удаляет истории без технологий вместе со всей веткой комментариев.
 
+    Истории выбираются по возрастанию id пакетами по chunk_size, и каждый пакет
+    удаляется своей короткой транзакцией: комментарии ветки по comment.root_story_id,
+    затем сами истории. Блокировка и журнал не растут с размером базы, а прерванный
+    запуск продолжается с --start-id. time_budget (секунды) останавливает удаление
+    после пакета, на котором бюджет исчерпан. Возвращает stories/comments/last_id/done.
+    """
     if dry_run:
-        print(f"Нашлось историй без технологий: {total}. Ничего не удалено (dry-run).")
-        return 0
+        victims = select(Story.id).where(_NO_TECHS)
+        if start_id is not None:
+            victims = victims.where(Story.id >= start_id)
+        total = session.execute(select(func.count()).select_from(victims.subquery())).scalar_one()
+        comments = session.execute(
+            select(func.count(Comment.id)).where(Comment.root_story_id.in_(victims))
+        ).scalar_one()
+        print(f"Нашлось историй без технологий: {total}, комментариев в их ветках: {comments}. "
+              f"Ничего не удалено (dry-run).")
+        return {"stories": 0, "comments": 0, "last_id": None, "done": True}
+
+    t0 = perf_counter()
+    has_mentions = _has_mention_tables(session)
+    last_id = start_id - 1 if start_id is not None else None
+    stories = comments = 0
+    while True:
+        stmt = select(Story.id).where(_NO_TECHS)
+        if last_id is not None:
+            stmt = stmt.where(Story.id > last_id)
+        ids = session.execute(stmt.order_by(Story.id).limit(chunk_size)).scalars().all()
+        if not ids:
+            return {"stories": stories, "comments": comments, "last_id": last_id, "done": True}
+
+        # сначала строки, ссылающиеся на удаляемые комментарии и истории (classify_comments)
+        if has_mentions:
+            session.execute(delete(comment_tech).where(
+                comment_tech.c.comment_id.in_(select(Comment.id).where(Comment.root_story_id.in_(ids)))
+            ))
+            session.execute(delete(story_tech_mentions).where(story_tech_mentions.c.story_id.in_(ids)))
+        comments += session.execute(delete(Comment).where(Comment.root_story_id.in_(ids))).rowcount or 0
+        stories += session.execute(delete(Story).where(Story.id.in_(ids))).rowcount or 0
+        session.commit()
+        last_id = ids[-1]
+
+        if progress:
+            progress(last_id, stories, comments)
+        if time_budget is not None and perf_counter() - t0 >= time_budget:
+            return {"stories": stories, "comments": comments, "last_id": last_id, "done": False}
 
-    # Массовое удаление
-    del_stmt = delete(Story).where(~Story.techs.any())
-    result = session.execute(del_stmt)
 
-    # Количество удаленных строк (может быть None в некоторых драйверах)
-    deleted = result.rowcount or 0
-    session.commit()
+def delete_orphan_comments(session: Session,
+                           chunk_size: int = 50000,
+                           unrooted: bool = False) -> int:
+    """
+    Удаляет комментарии, чья история уже удалена (остались от прошлых запусков trim).
 
-    print(f"Удалено историй: {deleted}")
+    Идёт по comment.id окнами по chunk_size, по транзакции на окно. unrooted=True
+    удаляет и комментарии без root_story_id: их цепочка родителей не дошла ни до
+    одной истории в БД (запустите db.scripts.backfill_threads перед этим).
+    """
+    lo, hi = session.execute(select(func.min(Comment.id), func.max(Comment.id))).one()
+    if lo is None:
+        return 0
+    no_story = ~exists().where(Story.id == Comment.root_story_id)
+    orphan = (Comment.root_story_id.is_(None) | no_story) if unrooted else (Comment.root_story_id.isnot(None) & no_story)
+
+    has_mentions = _has_mention_tables(session)
+    deleted = 0
+    for start in range(lo, hi + 1, chunk_size):
+        end = start + chunk_size - 1
+        if has_mentions:
+            session.execute(delete(comment_tech).where(
+                comment_tech.c.comment_id.in_(select(Comment.id).where(Comment.id.between(start, end), orphan))
+            ))
+        deleted += session.execute(delete(Comment).where(Comment.id.between(start, end), orphan)).rowcount or 0
+        session.commit()
     return deleted
 
+
+def compact(engine: Engine, vacuum: bool = False, analyze: bool = False) -> None:
+    """
+    VACUUM и/или ANALYZE после удаления. VACUUM нельзя выполнять в транзакции,
+    поэтому соединение переводится в AUTOCOMMIT. SQLite после VACUUM уменьшает файл;
+    PostgreSQL освобождает место внутри таблиц для новых строк (файлы уменьшает только VACUUM FULL).
+    """
+    tables = ("story", "comment", "story_tech")
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if vacuum:
+            if engine.dialect.name in ("mysql", "mariadb"):
+                conn.execute(text(f"OPTIMIZE TABLE {', '.join(tables)}"))
+            else:
+                conn.execute(text("VACUUM"))
+        if analyze:
+            if engine.dialect.name == "sqlite":
+                conn.execute(text("ANALYZE"))
+            else:
+                for tbl in tables:
+                    conn.execute(text(f"ANALYZE {tbl}"))
+
 def parse_args():
     p = argparse.ArgumentParser(
         prog="delete_stories_without_techs",
-        description="Удаление всех Story без связанных Tech из БД"
+        description="Удаление всех Story без связанных Tech из БД вместе с ветками комментариев"
     )
     p.add_argument("-d", "--db", required=True, help="DB URL (например, sqlite:///hn.db)")
     p.add_argument("--dry-run", action="store_true", help="Только показать количество, без удаления")
+    p.add_argument("-c", "--chunk-size", type=int, default=5000, help="Историй за одну транзакцию (по умолчанию 5000)")
+    p.add_argument("--start-id", type=int, default=None, help="Начать с истории с этим id (продолжение прерванного запуска)")
+    p.add_argument("--max-seconds", type=float, default=None,
+                   help="Бюджет времени на удаление: после исчерпания закончить текущий пакет и выйти")
+    p.add_argument("-p", "--progress-every", type=int, default=10, help="Печатать прогресс каждые N пакетов (по умолчанию 10)")
+    p.add_argument("--orphans", action="store_true",
+                   help="Также удалить комментарии, чьих историй уже нет в БД (остатки прошлых запусков)")
+    p.add_argument("--unrooted", action="store_true",
+                   help="С --orphans: удалить и комментарии без root_story_id (ветка не дошла до истории в БД)")
+    p.add_argument("--vacuum", action="store_true", help="Выполнить VACUUM после удаления (SQLite уменьшит файл БД)")
+    p.add_argument("--analyze", action="store_true", help="Обновить статистику планировщика (ANALYZE) после удаления")
     return p.parse_args()
 
 def main() -> int:
     args = parse_args()
     try:
-        with session_scope(args.db) as session:
-            delete_stories_without_techs(session, dry_run=args.dry_run)
+        engine = get_engine(args.db)
+        t0 = perf_counter()
+        chunks = 0
+
+        def progress(last_id, stories, comments):
+            nonlocal chunks
+            chunks += 1
+            if chunks % args.progress_every == 0:
+                print(f"[id<={last_id}] историй={stories} комментариев={comments} {perf_counter() - t0:.1f}s")
+
+        with Session(engine) as session:
+            stats = delete_stories_without_techs(
+                session, dry_run=args.dry_run, chunk_size=args.chunk_size, start_id=args.start_id,
+                time_budget=args.max_seconds, progress=progress,
+            )
+            if args.dry_run:
+                return 0
+            print(f"Удалено историй: {stats['stories']}, комментариев: {stats['comments']} "
+                  f"за {perf_counter() - t0:.1f}s")
+            if not stats["done"]:
+                print(f"Бюджет времени исчерпан. Продолжить: --start-id {stats['last_id'] + 1}")
+                return 0
+
+            if args.orphans:
+                t1 = perf_counter()
+                orphans = delete_orphan_comments(session, unrooted=args.unrooted)
+                print(f"Удалено комментариев без истории: {orphans} за {perf_counter() - t1:.1f}s")
+
+        if args.vacuum or args.analyze:
+            t1 = perf_counter()
+            compact(engine, vacuum=args.vacuum, analyze=args.analyze)
+            print(f"Готово: {' и '.join(op for op, on in (('VACUUM', args.vacuum), ('ANALYZE', args.analyze)) if on)} "
+                  f"за {perf_counter() - t1:.1f}s")
         return 0
     except Exception as e:
         print(f"Ошибка: {e}")
@@ -1,18 +1,148 @@
+import atexit
+import os
+import threading
 from contextlib import contextmanager
-from sqlalchemy import create_engine
+from typing import Callable, Dict, List, Tuple
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker
 
+from .migrate import model_indexes
 
-def get_engine(db_url: str):
-    return create_engine(db_url, pool_pre_ping=True, future=True)
+# Один Engine (и пул соединений) на набор параметров в пределах процесса
+_ENGINES: Dict[Tuple, Engine] = {}
+_SESSIONMAKERS: Dict[int, sessionmaker] = {}
+_LOCK = threading.Lock()
+
+
+def _sqlite_on_connect(dbapi_conn, _record):
+    # параллельные выгрузки и импорт в один файл ждут блокировку, а не падают с "database is locked"
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA busy_timeout=30000")
+    cur.close()
+
+
+# Хуки, выполняемые на каждом новом DBAPI-соединении, по имени диалекта
+CONNECT_HOOKS: Dict[str, List[Callable]] = {
+    "sqlite": [_sqlite_on_connect],
+}
+
+
+def register_connect_hook(dialect: str, hook: Callable) -> None:
+    """Добавляет hook(dbapi_conn, connection_record) для новых соединений диалекта (до первого get_engine)."""
+    CONNECT_HOOKS.setdefault(dialect, []).append(hook)
+
+
+def get_engine(db_url: str, pool_size: int | None = None, max_overflow: int | None = None,
+               pool_pre_ping: bool = True, **kwargs) -> Engine:
+    """
+    Engine из реестра процесса: повторные вызовы с теми же параметрами возвращают
+    тот же объект и переиспользуют его пул соединений. Остальные kwargs уходят
+    в create_engine (например, echo=True) и тоже входят в ключ.
+    """
+    key = (db_url, pool_size, max_overflow, pool_pre_ping, tuple(sorted(kwargs.items())))
+    with _LOCK:
+        engine = _ENGINES.get(key)
+        if engine is None:
+            opts = dict(kwargs)
+            if pool_size is not None:
+                opts["pool_size"] = pool_size
+            if max_overflow is not None:
+                opts["max_overflow"] = max_overflow
+            engine = create_engine(db_url, pool_pre_ping=pool_pre_ping, future=True, **opts)
+            for hook in CONNECT_HOOKS.get(engine.dialect.name, []):
+                event.listen(engine, "connect", hook)
+            _ENGINES[key] = engine
+        return engine
+
+
+def get_sessionmaker(engine: Engine) -> sessionmaker:
+    with _LOCK:
+        maker = _SESSIONMAKERS.get(id(engine))
+        if maker is None:
+            maker = sessionmaker(bind=engine, future=True)
+            _SESSIONMAKERS[id(engine)] = maker
+        return maker
+
+
+def dispose_engines() -> None:
+    """Закрывает пулы всех engine процесса и очищает реестр."""
+    with _LOCK:
+        for engine in _ENGINES.values():
+            engine.dispose()
+        _ENGINES.clear()
+        _SESSIONMAKERS.clear()
+
+
+def _reset_after_fork() -> None:
+    # соединения родителя нельзя использовать в дочернем процессе: забываем их, не закрывая
+    for engine in _ENGINES.values():
+        engine.dispose(close=False)
+    _ENGINES.clear()
+    _SESSIONMAKERS.clear()
+
+
+atexit.register(dispose_engines)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
 
 
 @contextmanager
-def session_scope(db_url: str):
-    engine = get_engine(db_url)
-    Session = sessionmaker(bind=engine, future=True)
+def session_scope(db_url: str, **engine_kwargs):
+    Session = get_sessionmaker(get_engine(db_url, **engine_kwargs))
     session = Session()
     try:
         yield session
     finally:
-        session.close()
\ No newline at end of file
+        session.close()
+
+
+@contextmanager
+def sqlite_bulk_load(engine, cache_mb: int = 512, mmap_mb: int = 1024, tables=None):
+    """
+    Профиль массовой загрузки для SQLite.
+
+    На время блока все новые соединения открываются с WAL, synchronous=OFF, большим
+    кэшем страниц и mmap, а вторичные индексы таблиц (по умолчанию всех из Base)
+    удаляются и строятся заново в конце — один проход сортировкой быстрее, чем
+    поддерживать индекс на каждой вставке. После блока журнал возвращается в DELETE,
+    соединения пересоздаются с настройками по умолчанию и выполняется ANALYZE.
+    Для других СУБД ничего не делает.
+    """
+    if engine.dialect.name != "sqlite":
+        yield
+        return
+
+    pragmas = (
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=OFF",
+        f"PRAGMA cache_size=-{cache_mb * 1024}",
+        f"PRAGMA mmap_size={mmap_mb * 1024 * 1024}",
+        "PRAGMA temp_store=MEMORY",
+    )
+
+    def on_connect(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        for pragma in pragmas:
+            cur.execute(pragma)
+        cur.close()
+
+    indexes = model_indexes(tables)
+
+    engine.dispose()
+    event.listen(engine, "connect", on_connect)
+    try:
+        with engine.begin() as conn:
+            for idx in indexes:
+                idx.drop(conn, checkfirst=True)
+        yield
+    finally:
+        with engine.begin() as conn:
+            for idx in indexes:
+                idx.create(conn, checkfirst=True)
+        event.remove(engine, "connect", on_connect)
+        engine.dispose()
+        with engine.connect() as conn:
+            conn.exec_driver_sql("PRAGMA journal_mode=DELETE")
+            conn.exec_driver_sql("ANALYZE")
+            conn.commit()
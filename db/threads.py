@@ -0,0 +1,127 @@
+from typing import Callable, Iterable, Optional
+
+from sqlalchemy import bindparam, select
+from sqlalchemy.orm import Session
+
+from .models import Comment, Story
+
+# ограничение на размер IN (...): SQLite по умолчанию принимает до 32766 параметров
+_IN_CHUNK = 5000
+
+
+def _chunks(ids: list, size: int = _IN_CHUNK) -> Iterable[list]:
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+
+def resolve_roots(session: Session, rows: list[dict]) -> int:
+    """
+    Заполняет root_story_id и depth у строк comment (dict с id/parent) на месте.
+
+    Родитель ищется сначала среди самих строк (ответ всегда новее родителя, поэтому
+    строки разбираются по возрастанию id), затем в БД: история даёт корень и глубину 0,
+    уже разрешённый комментарий — свои root_story_id и depth. Строки, чья цепочка
+    не доходит до известной истории, остаются с NULL. Возвращает число разрешённых строк.
+    """
+    pending = sorted((r for r in rows if r.get("root_story_id") is None and r.get("parent") is not None),
+                     key=lambda r: r["id"])
+    if not pending:
+        return 0
+
+    in_batch = {r["id"] for r in rows}
+    outside = sorted({r["parent"] for r in pending} - in_batch)
+    known: dict[int, tuple[int, int]] = {}
+    for chunk in _chunks(outside):
+        for (story_id,) in session.execute(select(Story.id).where(Story.id.in_(chunk))):
+            known[story_id] = (story_id, 0)
+        stmt = (
+            select(Comment.id, Comment.root_story_id, Comment.depth)
+            .where(Comment.id.in_(chunk), Comment.root_story_id.isnot(None))
+        )
+        for comment_id, root, depth in session.execute(stmt):
+            known[comment_id] = (root, depth or 0)
+
+    resolved = 0
+    for r in pending:
+        hit = known.get(r["parent"])
+        if hit is None:
+            continue
+        r["root_story_id"], r["depth"] = hit[0], hit[1] + 1
+        known[r["id"]] = (r["root_story_id"], r["depth"])
+        resolved += 1
+    return resolved
+
+
+def propagate_roots(session: Session, parents: dict[int, tuple[int, int]]) -> int:
+    """
+    Спускает root_story_id/depth к уже сохранённым потомкам.
+
+    parents — {id: (root_story_id, depth)} только что записанных историй (depth 0)
+    и разрешённых комментариев. Обход идёт по уровням через индекс comment.parent
+    и трогает только комментарии с root_story_id IS NULL: при загрузке по убыванию
+    id ответы попадают в БД раньше своих историй и без этого остались бы неразрешёнными.
+    Возвращает число обновлённых комментариев.
+    """
+    tbl = Comment.__table__
+    upd = (
+        tbl.update()
+        .where(tbl.c.id == bindparam("b_id"))
+        .values(root_story_id=bindparam("b_root"), depth=bindparam("b_depth"))
+    )
+    frontier = dict(parents)
+    updated = 0
+    while frontier:
+        children: dict[int, tuple[int, int]] = {}
+        for chunk in _chunks(sorted(frontier)):
+            stmt = select(Comment.id, Comment.parent).where(Comment.parent.in_(chunk), Comment.root_story_id.is_(None))
+            for comment_id, parent in session.execute(stmt):
+                root, depth = frontier[parent]
+                children[comment_id] = (root, depth + 1)
+        if children:
+            session.execute(upd, [{"b_id": i, "b_root": r, "b_depth": d} for i, (r, d) in children.items()])
+            updated += len(children)
+        frontier = children
+    return updated
+
+
+def backfill_roots(session: Session,
+                   batch_size: int = 10000,
+                   progress: Optional[Callable[[int, int, int], None]] = None) -> dict[str, int]:
+    """
+    Проставляет root_story_id/depth всем комментариям, у которых их нет.
+
+    Один проход по возрастанию id пакетами по batch_size: к моменту обработки
+    комментария его родитель уже разрешён и закоммичен в предыдущих пакетах
+    или стоит раньше в текущем. Повторный запуск трогает только оставшиеся NULL.
+    """
+    tbl = Comment.__table__
+    upd = (
+        tbl.update()
+        .where(tbl.c.id == bindparam("b_id"))
+        .values(root_story_id=bindparam("b_root"), depth=bindparam("b_depth"))
+    )
+    last_id = None
+    scanned = resolved = 0
+    while True:
+        stmt = select(Comment.id, Comment.parent).where(Comment.root_story_id.is_(None))
+        if last_id is not None:
+            stmt = stmt.where(Comment.id > last_id)
+        rows = session.execute(stmt.order_by(Comment.id).limit(batch_size)).all()
+        if not rows:
+            break
+
+        batch = [{"id": i, "parent": p, "root_story_id": None, "depth": None} for i, p in rows]
+        resolved += resolve_roots(session, batch)
+        params = [
+            {"b_id": r["id"], "b_root": r["root_story_id"], "b_depth": r["depth"]}
+            for r in batch if r["root_story_id"] is not None
+        ]
+        if params:
+            session.execute(upd, params)
+        session.commit()
+
+        last_id = rows[-1][0]
+        scanned += len(rows)
+        if progress:
+            progress(last_id, scanned, resolved)
+    return {"scanned": scanned, "resolved": resolved}
@@ -1,27 +1,45 @@
+import io
+import sys
 import json
 import gzip
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 from typing import Iterator, Optional, Iterable
 from datetime import datetime, timezone
 from html import unescape
 
-from sqlalchemy import select
+from sqlalchemy import func, select
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.types import JSON
 
 from db.models import Base, Story, Comment
+from db.migrate import ensure_columns
+from db.threads import propagate_roots, resolve_roots
 
 class HNHandler:
-    def __init__(self, engine, batch_size: int = 1000):
+    def __init__(self, engine, batch_size: int = 1000, bulk: bool = False, commit_every: int = 1):
         self.engine = engine
         self.batch_size = batch_size
+        # сколько пакетов писать в одной транзакции
+        self.commit_every = max(1, commit_every)
+        self._uncommitted = 0
+        # COPY + один set-based upsert на пакет; есть только для PostgreSQL
+        self.bulk = bulk and engine.dialect.name == "postgresql"
         self.SessionLocal = sessionmaker(bind=engine)
         self.create_schema()
 
     def create_schema(self) -> None:
         Base.metadata.create_all(self.engine)
+        ensure_columns(self.engine)
 
 
     def ingest_from_path(self, path: str | Path) -> dict[str, int]:
+        return self.ingest_items(iter_items(path))
+
+    def ingest_items(self, items: Iterable[dict]) -> dict[str, int]:
         story_batch: list[dict] = []
         comment_batch: list[dict] = []
         cnt_stories = 0
@@ -30,24 +48,20 @@ class HNHandler:
         with self.SessionLocal() as session:
             def flush():
                 nonlocal cnt_stories, cnt_comments
-                # дедупликат внутри батча по id, чтобы не ловить конфликт в одном наборе
-                if story_batch:
-                    story_by_id = {row["id"]: row for row in story_batch}
-                    cnt_stories += self._upsert_stories(session, list(story_by_id.values()))
-                    story_batch.clear()
-                if comment_batch:
-                    comment_by_id = {row["id"]: row for row in comment_batch}
-                    cnt_comments += self._upsert_comments(session, list(comment_by_id.values()))
-                    comment_batch.clear()
-
-            for item in iter_items(path):
+                n_stories, n_comments = self._write_rows(session, story_batch, comment_batch)
+                cnt_stories += n_stories
+                cnt_comments += n_comments
+                story_batch.clear()
+                comment_batch.clear()
+
+            for item in items:
                 t = item.get("type")
                 if t == "story":
-                    story = self._story_row(item)
+                    story = story_row(item)
                     if story:
                         story_batch.append(story)
                 elif t == "comment":
-                    comment = self._comment_row(item)
+                    comment = comment_row(item)
                     if comment:
                         comment_batch.append(comment)
 
@@ -56,47 +70,120 @@ class HNHandler:
 
             if story_batch or comment_batch:
                 flush()
+            self._commit(session, force=True)
 
         return {"stories": cnt_stories, "comments": cnt_comments}
 
+    def ingest_paths(self, paths: list[str | Path], workers: int = 4,
+                     max_pending: Optional[int] = None) -> dict[str, dict[str, int]]:
+        """
+        Конвейерная загрузка нескольких файлов.
+
+        Потоки-читатели (по одному на файл, не больше workers одновременно) распаковывают
+        файлы и режут их на пакеты по batch_size строк, процессы-парсеры превращают пакеты
+        в строки для story/comment, а запись в БД идёт в текущем потоке через те же upsert.
+        Очередь пакетов и число пакетов «в работе» ограничены max_pending, поэтому при
+        медленной БД чтение и разбор притормаживают, а не копят данные в памяти.
+        Пакеты одного файла пишутся в порядке чтения. Возвращает счётчики по каждому файлу.
+        """
+        paths = [str(p) for p in paths]
+        max_pending = max_pending or workers * 2
+        chunks: queue.Queue = queue.Queue(maxsize=max_pending)
+        counts = {p: {"stories": 0, "comments": 0} for p in paths}
+
+        pending: deque = deque()
+        files_left = len(paths)
+        stop = threading.Event()
+        with ThreadPoolExecutor(max_workers=max(1, min(len(paths), workers))) as readers, \
+                ProcessPoolExecutor(max_workers=workers) as parsers, \
+                self.SessionLocal() as session:
+            for p in paths:
+                readers.submit(_read_chunks, p, self.batch_size, chunks, stop)
+
+            try:
+                self._pipeline_loop(session, parsers, chunks, pending, files_left, max_pending, counts)
+                self._commit(session, force=True)
+            except BaseException:
+                # читатели могут висеть на полной очереди — отпускаем их до выхода из with
+                stop.set()
+                for _, fut in pending:
+                    fut.cancel()
+                raise
+
+        return counts
+
+    def _pipeline_loop(self, session, parsers, chunks, pending, files_left, max_pending, counts) -> None:
+        while files_left or pending:
+            # подкидываем парсерам новые пакеты, пока есть место
+            while files_left and len(pending) < max_pending:
+                try:
+                    path, lines = chunks.get(block=not pending)
+                except queue.Empty:
+                    break
+                if isinstance(lines, BaseException):
+                    raise lines
+                if lines is None:
+                    files_left -= 1
+                    continue
+                pending.append((path, parsers.submit(parse_lines, lines)))
+
+            if pending:
+                path, fut = pending.popleft()
+                stories, comments = fut.result()
+                n_stories, n_comments = self._write_rows(session, stories, comments)
+                counts[path]["stories"] += n_stories
+                counts[path]["comments"] += n_comments
+
+    def _commit(self, session, force: bool = False) -> None:
+        self._uncommitted += 1
+        if force or self._uncommitted >= self.commit_every:
+            session.commit()
+            self._uncommitted = 0
+
+    def _write_rows(self, session, stories: list[dict], comments: list[dict]) -> tuple[int, int]:
+        # дедупликат внутри батча по id, чтобы не ловить конфликт в одном наборе
+        n_stories = n_comments = 0
+        if stories:
+            rows = list({row["id"]: row for row in stories}.values())
+            if self.bulk:
+                n_stories = self._copy_upsert(session, Story.__table__, rows)
+            else:
+                n_stories = self._upsert_stories(session, rows)
+        if comments:
+            rows = list({row["id"]: row for row in comments}.values())
+            # истории пакета уже записаны, так что прямые ответы на них разрешатся сразу
+            resolve_roots(session, rows)
+            if self.bulk:
+                n_comments = self._copy_upsert(session, Comment.__table__, rows)
+            else:
+                n_comments = self._upsert_comments(session, rows)
+        if stories or comments:
+            # ответы, записанные раньше своих историй (загрузка по убыванию id), получают ветку сейчас
+            parents = {row["id"]: (row["id"], 0) for row in stories}
+            parents.update((row["id"], (row["root_story_id"], row["depth"]))
+                           for row in comments if row.get("root_story_id") is not None)
+            propagate_roots(session, parents)
+            # commit_every считает пакеты, а не отдельные INSERT историй и комментариев
+            self._commit(session)
+        return n_stories, n_comments
+
     # Преобразование в dict для Core-вставки
     def _story_row(self, item: dict) -> Optional[dict]:
-        if item.get("type") != "story" or not item.get("title"):
-            return None
-        ts = item.get("time")
-        dt = datetime.fromtimestamp(ts, tz=timezone.utc) if isinstance(ts, (int, float)) else None
-        return {
-            "id": item.get("id"),
-            "author": item.get("by"),
-            "descendants": item.get("descendants"),
-            "score": item.get("score"),
-            "time": dt,
-            "title": item.get("title"),
-            "url": item.get("url"),
-            "kids": item.get("kids", []) or [],
-        }
+        return story_row(item)
 
     def _comment_row(self, item: dict) -> Optional[dict]:
-        if item.get("type") != "comment":
-            return None
-        ts = item.get("time")
-        dt = datetime.fromtimestamp(ts, tz=timezone.utc) if isinstance(ts, (int, float)) else None
-        text_raw = item.get("text")
-        text = unescape(text_raw) if isinstance(text_raw, str) else None
-        return {
-            "id": item.get("id"),
-            "author": item.get("by"),
-            "parent": item.get("parent"),
-            "time": dt,
-            "text": text,
-        }
+        return comment_row(item)
 
     def _upsert_comments(self, session, rows: list[dict]) -> int:
         tbl = Comment.__table__
         dialect = session.bind.dialect.name
+        params = None
         if dialect == "sqlite":
+            # executemany одного закэшированного запроса: компиляция многострочного
+            # VALUES на каждый пакет в SQLAlchemy обходится дороже самой вставки
             from sqlalchemy.dialects.sqlite import insert as sqlite_insert
-            stmt = sqlite_insert(tbl).values(rows)
+            stmt = sqlite_insert(tbl)
+            params = rows
             excluded = stmt.excluded
             stmt = stmt.on_conflict_do_update(
                 index_elements=[tbl.c.id],
@@ -105,6 +192,9 @@ class HNHandler:
                     "parent": excluded.parent,
                     "time":   excluded.time,
                     "text":   excluded.text,
+                    # не затираем уже разрешённую ветку, если в этот раз родитель не нашёлся
+                    "root_story_id": func.coalesce(excluded.root_story_id, tbl.c.root_story_id),
+                    "depth":         func.coalesce(excluded.depth, tbl.c.depth),
                 },
             )
         elif dialect == "postgresql":
@@ -118,6 +208,9 @@ class HNHandler:
                     "parent": excluded.parent,
                     "time":   excluded.time,
                     "text":   excluded.text,
+                    # не затираем уже разрешённую ветку, если в этот раз родитель не нашёлся
+                    "root_story_id": func.coalesce(excluded.root_story_id, tbl.c.root_story_id),
+                    "depth":         func.coalesce(excluded.depth, tbl.c.depth),
                 },
             )
         elif dialect in ("mysql", "mariadb"):
@@ -128,21 +221,26 @@ class HNHandler:
                 parent=ins.inserted.parent,
                 time=ins.inserted.time,
                 text=ins.inserted.text,
+                root_story_id=func.coalesce(ins.inserted.root_story_id, tbl.c.root_story_id),
+                depth=func.coalesce(ins.inserted.depth, tbl.c.depth),
             )
         else:
             stmt = tbl.insert().values(rows)
 
-        res = session.execute(stmt)
-        session.commit()
+        res = session.execute(stmt, params) if params else session.execute(stmt)
         return res.rowcount
 
 
     def _upsert_stories(self, session, rows: list[dict]) -> int:
         tbl = Story.__table__
         dialect = session.bind.dialect.name
+        params = None
         if dialect == "sqlite":
+            # executemany одного закэшированного запроса: компиляция многострочного
+            # VALUES на каждый пакет в SQLAlchemy обходится дороже самой вставки
             from sqlalchemy.dialects.sqlite import insert as sqlite_insert
-            stmt = sqlite_insert(tbl).values(rows)
+            stmt = sqlite_insert(tbl)
+            params = rows
             excluded = stmt.excluded
             stmt = stmt.on_conflict_do_update(
                 index_elements=[tbl.c.id],
@@ -187,8 +285,52 @@ class HNHandler:
         else:
             stmt = tbl.insert().values(rows)
 
+        res = session.execute(stmt, params) if params else session.execute(stmt)
+        return res.rowcount
+
+    def _copy_upsert(self, session, tbl, rows: list[dict]) -> int:
+        """
+        Быстрый путь для PostgreSQL: пакет уходит через COPY во временную таблицу
+        (временные таблицы не пишутся в WAL, как и UNLOGGED) и сливается в основную
+        одним INSERT ... SELECT ... ON CONFLICT DO UPDATE.
+        """
+        from sqlalchemy import column, table, text
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+        stage = f"{tbl.name}_stage"
+        cols = [c.name for c in tbl.columns]
+        session.execute(text(
+            f"CREATE TEMPORARY TABLE IF NOT EXISTS {stage} (LIKE {tbl.name} INCLUDING DEFAULTS)"
+        ))
+        session.execute(text(f"TRUNCATE {stage}"))
+
+        buf = io.StringIO()
+        for row in rows:
+            buf.write("\t".join(_copy_value(row.get(c), tbl.c[c]) for c in cols))
+            buf.write("\n")
+        copy_sql = f"COPY {stage} ({', '.join(cols)}) FROM STDIN"
+
+        cur = session.connection().connection.cursor()
+        try:
+            if hasattr(cur, "copy_expert"):
+                # psycopg2
+                buf.seek(0)
+                cur.copy_expert(copy_sql, buf)
+            else:
+                # psycopg 3
+                with cur.copy(copy_sql) as copy:
+                    copy.write(buf.getvalue())
+        finally:
+            cur.close()
+
+        src = table(stage, *[column(c) for c in cols])
+        stmt = pg_insert(tbl).from_select(cols, src.select())
+        set_ = {c: stmt.excluded[c] for c in cols if c != "id"}
+        for c in ("root_story_id", "depth"):
+            if c in set_:
+                set_[c] = func.coalesce(stmt.excluded[c], tbl.c[c])
+        stmt = stmt.on_conflict_do_update(index_elements=[tbl.c.id], set_=set_)
         res = session.execute(stmt)
-        session.commit()
         return res.rowcount
 
     def _to_story(self, item: dict) -> Optional[Story]:
@@ -250,6 +392,111 @@ class HNHandler:
             yield from session.scalars(stmt)
 
 
+def story_row(item: dict) -> Optional[dict]:
+    if item.get("type") != "story" or not item.get("title"):
+        return None
+    ts = item.get("time")
+    dt = datetime.fromtimestamp(ts, tz=timezone.utc) if isinstance(ts, (int, float)) else None
+    return {
+        "id": item.get("id"),
+        "author": item.get("by"),
+        "descendants": item.get("descendants"),
+        "score": item.get("score"),
+        "time": dt,
+        "title": item.get("title"),
+        "url": item.get("url"),
+        "kids": item.get("kids", []) or [],
+    }
+
+
+def comment_row(item: dict) -> Optional[dict]:
+    if item.get("type") != "comment":
+        return None
+    ts = item.get("time")
+    dt = datetime.fromtimestamp(ts, tz=timezone.utc) if isinstance(ts, (int, float)) else None
+    text_raw = item.get("text")
+    text = unescape(text_raw) if isinstance(text_raw, str) else None
+    return {
+        "id": item.get("id"),
+        "author": item.get("by"),
+        "parent": item.get("parent"),
+        "time": dt,
+        "text": text,
+        "root_story_id": None,
+        "depth": None,
+    }
+
+
+def parse_lines(lines: list[bytes]) -> tuple[list[dict], list[dict]]:
+    """Пакет сырых строк JSONL -> (строки story, строки comment). Выполняется в процессе-парсере."""
+    stories, comments = [], []
+    for line in lines:
+        try:
+            obj = json.loads(line)
+        except ValueError:
+            continue
+        if not isinstance(obj, dict):
+            continue
+        t = obj.get("type")
+        if t == "story":
+            row = story_row(obj)
+            if row:
+                stories.append(row)
+        elif t == "comment":
+            row = comment_row(obj)
+            if row:
+                comments.append(row)
+    return stories, comments
+
+
+def _put(out: "queue.Queue", item, stop: threading.Event) -> bool:
+    while not stop.is_set():
+        try:
+            out.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _read_chunks(path: str, chunk_lines: int, out: "queue.Queue", stop: threading.Event) -> None:
+    """Поток-читатель: кладёт в out пакеты (path, [строки]), в конце — (path, None) или (path, ошибка)."""
+    try:
+        p = Path(path)
+        if not p.exists():
+            raise FileNotFoundError(f"Path not found: {p}")
+        opener = gzip.open if p.suffix == ".gz" else open
+        chunk = []
+        with opener(p, "rb") as f:
+            try:
+                for line in f:
+                    if line.strip():
+                        chunk.append(line)
+                    if len(chunk) >= chunk_lines:
+                        if not _put(out, (path, chunk), stop):
+                            return
+                        chunk = []
+            except EOFError:
+                print(f"Предупреждение: файл {p} обрезан, прочитано до места обрыва", file=sys.stderr)
+        if chunk and not _put(out, (path, chunk), stop):
+            return
+        _put(out, (path, None), stop)
+    except Exception as e:
+        _put(out, (path, e), stop)
+
+
+def _copy_value(value, col) -> str:
+    """Значение в текстовом формате COPY: NULL = \\N, спецсимволы экранируются."""
+    if value is None:
+        return "\\N"
+    if isinstance(col.type, JSON):
+        value = json.dumps(value)
+    s = str(value)
+    if "\\" in s or "\t" in s or "\n" in s or "\r" in s:
+        s = s.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+    return s
+
+
 def iter_items(path: str | Path) -> Iterator[dict]:
     p = Path(path)
     if not p.exists():
@@ -257,13 +504,18 @@ def iter_items(path: str | Path) -> Iterator[dict]:
 
     opener = gzip.open if p.suffix == ".gz" else open
     with opener(p, "rt", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                obj = json.loads(line)
-            except json.JSONDecodeError:
-                continue
-            if isinstance(obj, dict):
-                yield obj
+        try:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    obj = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if isinstance(obj, dict):
+                    yield obj
+        except EOFError:
+            # обрезанный gzip (загрузка упала): всё до последнего sync-flush читается,
+            # недописанный хвост будет докачан через scripts.retrieve --resume
+            print(f"Предупреждение: файл {p} обрезан, прочитано до места обрыва", file=sys.stderr)
@@ -1,29 +1,226 @@
+import json
+import random
+import asyncio
+import threading
+import time
+
 import requests
 
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+API_BASE = "https://hacker-news.firebaseio.com/v0/"
+
+# Ответы, после которых имеет смысл повторить запрос
+RETRY_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+
+
+def minify_item_bytes(body: bytes) -> bytes | None:
+    """
+    Дешёвая проверка и сжатие сырого ответа API без разбора JSON.
+
+    `null` и пустой ответ означают отсутствующий item. Переводы строк внутри
+    JSON-строк всегда экранированы, поэтому «сырые» переводы строк и отступы
+    вокруг них — это только форматирование (print=pretty), и их можно срезать построчно.
+    """
+    body = body.strip()
+    if not body or body == b"null":
+        return None
+    if b"\n" in body:
+        body = b"".join(line.strip() for line in body.splitlines())
+    return body
+
+
+class RateLimiter:
+    """
+    Token bucket на `rate` запросов в секунду с запасом `burst`.
+
+    reserve() сразу забирает токен (возможно, «в долг») и возвращает, сколько
+    нужно подождать, поэтому один и тот же лимитер работает и из потоков
+    (acquire), и из event loop (acquire_async). rate=None — без ограничения.
+    """
+
+    def __init__(self, rate: float | None = None, burst: float | None = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate or 1.0)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1.0
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def acquire(self) -> None:
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self) -> None:
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class RetryPolicy:
+    """Экспоненциальная пауза с полным джиттером; Retry-After от сервера имеет приоритет."""
+
+    def __init__(self, retries: int = 5, backoff: float = 0.5, max_backoff: float = 30.0):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def delay(self, attempt: int, retry_after: str | None = None) -> float:
+        if retry_after:
+            try:
+                return min(self.max_backoff, float(retry_after))
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+
+class RetryableHTTPError(Exception):
+    def __init__(self, status: int, retry_after: str | None = None):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+        self.retry_after = retry_after
+
+
 class HNRetriever:
 
     url_base = ""
 
-    def __init__(self):
-        self.url_base = "https://hacker-news.firebaseio.com/v0/"
-
-    def retrieve_item(self, item_id, session=None, timeout=10):
-        url = f"{self.url_base}item/{item_id}.json"
-        sess = session or requests
-        resp = sess.get(url, timeout=timeout)
-        resp.raise_for_status()
-        data = resp.json()
-        return data
-
-    def get_maxitem_id(self):
-        url = f"{self.url_base}maxitem.json?print=pretty"
-        response = requests.get(url)
-        return response.json()
-    
-    def retrieve_best_stories(self):
-        url = f"{self.url_base}beststories.json?print=pretty"
-        response = requests.get(url)
-        return response.json()
-    
-retriever = HNRetriever()
-max_item = retriever.get_maxitem_id()
+    def __init__(self,
+                 url_base: str = API_BASE,
+                 rate_limiter: RateLimiter | None = None,
+                 retry: RetryPolicy | None = None,
+                 timeout: float = 10):
+        self.url_base = url_base
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.retry = retry or RetryPolicy()
+        self.timeout = timeout
+        self._session = None
+
+    @property
+    def session(self) -> requests.Session:
+        if self._session is None:
+            self._session = requests.Session()
+        return self._session
+
+    def _get(self, url, session=None, timeout=None) -> requests.Response:
+        """GET через общий лимитер; 408/429/5xx и сетевые сбои повторяются по RetryPolicy."""
+        sess = session or self.session
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            try:
+                resp = sess.get(url, timeout=timeout or self.timeout)
+                if resp.status_code in RETRY_STATUSES:
+                    raise RetryableHTTPError(resp.status_code, resp.headers.get("Retry-After"))
+                resp.raise_for_status()
+                return resp
+            except (RetryableHTTPError, requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.retry.retries:
+                    raise
+                time.sleep(self.retry.delay(attempt, getattr(e, "retry_after", None)))
+                attempt += 1
+
+    def retrieve_item(self, item_id, session=None, timeout=None):
+        resp = self._get(f"{self.url_base}item/{item_id}.json", session, timeout)
+        return resp.json()
+
+    def retrieve_item_raw(self, item_id, session=None, timeout=None):
+        resp = self._get(f"{self.url_base}item/{item_id}.json", session, timeout)
+        return minify_item_bytes(resp.content)
+
+    def get_maxitem_id(self, session=None):
+        return self._get(f"{self.url_base}maxitem.json", session).json()
+
+    def retrieve_best_stories(self, session=None):
+        return self._get(f"{self.url_base}beststories.json", session).json()
+
+    def get_updates(self, session=None):
+        """{"items": [...], "profiles": [...]} — недавно изменённые items и профили."""
+        return self._get(f"{self.url_base}updates.json", session).json() or {}
+
+
+class AsyncHNRetriever:
+    """
+    Асинхронный клиент HN API поверх aiohttp.
+
+    Держит один пул keep-alive соединений на всё время жизни объекта,
+    поэтому используется как async context manager:
+
+        async with AsyncHNRetriever(pool_size=2048) as r:
+            item = await r.retrieve_item(8863)
+    """
+
+    def __init__(self,
+                 url_base: str = API_BASE,
+                 pool_size: int = 1024,
+                 timeout: float = 10,
+                 keepalive_timeout: float = 30,
+                 rate_limiter: RateLimiter | None = None,
+                 retry: RetryPolicy | None = None):
+        if aiohttp is None:
+            raise RuntimeError("Для асинхронной загрузки нужен пакет aiohttp (pip install aiohttp)")
+        self.url_base = url_base
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.keepalive_timeout = keepalive_timeout
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.retry = retry or RetryPolicy()
+        self.session = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(
+            limit=self.pool_size,
+            limit_per_host=0,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=300,
+        )
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.session.close()
+        self.session = None
+
+    async def _get(self, url) -> bytes:
+        attempt = 0
+        while True:
+            await self.rate_limiter.acquire_async()
+            try:
+                async with self.session.get(url) as resp:
+                    if resp.status in RETRY_STATUSES:
+                        raise RetryableHTTPError(resp.status, resp.headers.get("Retry-After"))
+                    resp.raise_for_status()
+                    return await resp.read()
+            except (RetryableHTTPError, aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt >= self.retry.retries:
+                    raise
+                await asyncio.sleep(self.retry.delay(attempt, getattr(e, "retry_after", None)))
+                attempt += 1
+
+    async def retrieve_item(self, item_id):
+        return json.loads(await self._get(f"{self.url_base}item/{item_id}.json"))
+
+    async def retrieve_item_raw(self, item_id):
+        return minify_item_bytes(await self._get(f"{self.url_base}item/{item_id}.json"))
+
+    async def get_maxitem_id(self):
+        return json.loads(await self._get(f"{self.url_base}maxitem.json"))
+
+    async def retrieve_best_stories(self):
+        return json.loads(await self._get(f"{self.url_base}beststories.json"))
@@ -0,0 +1,150 @@
+import json
+import os
+import threading
+from bisect import bisect_right
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+
+class IdRanges:
+    """
+    Множество ID в виде отсортированного списка непересекающихся отрезков [start, end].
+
+    Загрузки идут почти подряд, поэтому даже при десятках миллионов ID
+    отрезков остаётся порядка числа запросов «в полёте».
+
+    Потокобезопасно: с --writer-thread поток записи добавляет ID, пока основной
+    поток проверяет их в skip_done, поэтому чтение и запись идут под блокировкой,
+    а итерация отдаёт снимок отрезков.
+    """
+
+    def __init__(self, ranges: Optional[Iterable[Iterable[int]]] = None):
+        self._starts: List[int] = []
+        self._ends: List[int] = []
+        self._lock = threading.Lock()
+        for a, b in ranges or ():
+            self.add_range(a, b)
+
+    def __contains__(self, item_id: int) -> bool:
+        with self._lock:
+            i = bisect_right(self._starts, item_id) - 1
+            return i >= 0 and item_id <= self._ends[i]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(b - a + 1 for a, b in zip(self._starts, self._ends))
+
+    def __iter__(self) -> Iterator[List[int]]:
+        with self._lock:
+            snapshot = [[a, b] for a, b in zip(self._starts, self._ends)]
+        return iter(snapshot)
+
+    def add(self, item_id: int) -> None:
+        self.add_range(item_id, item_id)
+
+    def add_range(self, start: int, end: int) -> None:
+        if start > end:
+            start, end = end, start
+        with self._lock:
+            self._add_range(start, end)
+
+    def _add_range(self, start: int, end: int) -> None:
+        i = bisect_right(self._starts, start) - 1
+        # сливаемся с левым соседом, если он касается или перекрывает новый отрезок
+        if i >= 0 and self._ends[i] >= start - 1:
+            start = self._starts[i]
+            end = max(end, self._ends[i])
+        else:
+            i += 1
+        # поглощаем все правые отрезки, которые начинаются не дальше end + 1
+        j = i
+        while j < len(self._starts) and self._starts[j] <= end + 1:
+            end = max(end, self._ends[j])
+            j += 1
+        self._starts[i:j] = [start]
+        self._ends[i:j] = [end]
+
+
+def checkpoint_path(out_path: str | Path) -> Path:
+    p = Path(out_path)
+    return p.with_name(p.name + ".ckpt.json")
+
+
+def _split_suffixes(p: Path) -> Tuple[str, str]:
+    suffixes = "".join(p.suffixes)
+    return (p.name[: -len(suffixes)] if suffixes else p.name), suffixes
+
+
+def segment_path(out_path: str | Path, index: int) -> Path:
+    """raw_data/hn.jsonl.gz, 2 -> raw_data/hn.seg-0002.jsonl.gz"""
+    p = Path(out_path)
+    if index == 0:
+        return p
+    base, suffixes = _split_suffixes(p)
+    return p.with_name(f"{base}.seg-{index:04d}{suffixes}")
+
+
+def segment_files(out_path: str | Path) -> List[Path]:
+    """Сегменты, лежащие на диске: сам out_path и все out_path.seg-NNNN по порядку."""
+    p = Path(out_path)
+    base, suffixes = _split_suffixes(p)
+    files = [p] if p.exists() else []
+    return files + sorted(p.parent.glob(f"{base}.seg-[0-9][0-9][0-9][0-9]{suffixes}"))
+
+
+def failed_path(segment: str | Path) -> Path:
+    """Dead-letter файл сегмента: ID, которые не скачались и после всех повторов."""
+    p = Path(segment)
+    return p.with_name(p.name + ".failed")
+
+
+def read_failed_ids(out_path: str | Path, segments: Iterable[str]) -> List[int]:
+    ids = set()
+    root = Path(out_path).parent
+    for seg in segments:
+        p = failed_path(root / seg)
+        if not p.exists():
+            continue
+        with p.open("r", encoding="utf-8") as f:
+            ids.update(int(line) for line in f if line.strip())
+    return sorted(ids)
+
+
+class Checkpoint:
+    """
+    Журнал уже скачанных диапазонов ID рядом с выходным файлом (<out>.ckpt.json).
+
+    Файл перезаписывается атомарно (tmp + os.replace), поэтому после падения
+    в нём всегда лежит последнее согласованное состояние. Каждый запуск с --resume
+    пишет в новый сегмент: хвост предыдущего gzip мог остаться обрезанным.
+    """
+
+    def __init__(self, out_path: str | Path):
+        self.out_path = Path(out_path)
+        self.path = checkpoint_path(out_path)
+        self.done = IdRanges()
+        self.segments: List[str] = []
+
+    @classmethod
+    def load(cls, out_path: str | Path) -> "Checkpoint":
+        ckpt = cls(out_path)
+        if ckpt.path.exists():
+            with ckpt.path.open("r", encoding="utf-8") as f:
+                state = json.load(f)
+            ckpt.done = IdRanges(state.get("ranges", []))
+            ckpt.segments = list(state.get("segments", []))
+        return ckpt
+
+    def next_segment(self) -> Path:
+        seg = segment_path(self.out_path, len(self.segments))
+        self.segments.append(seg.name)
+        return seg
+
+    def save(self) -> None:
+        state = {"ranges": list(self.done), "segments": self.segments}
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
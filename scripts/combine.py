@@ -5,6 +5,8 @@ import hashlib
 from pathlib import Path
 from typing import Iterable
 
+from scripts.shards import manifest_files
+
 def iter_files(input_dir: Path, pattern: str, recursive: bool) -> Iterable[Path]:
     if recursive:
         yield from sorted(input_dir.rglob(pattern))
@@ -34,10 +36,16 @@ def merge_jsonl_gz(
     recursive: bool = False,
     encoding: str = "utf-8",
     dedup: str = "line",  # 'line' или 'json'
+    manifest: Path | None = None,
 ) -> None:
-    files = list(iter_files(input_dir, pattern, recursive))
-    if not files:
-        raise FileNotFoundError(f"Не нашёл файлов по маске {pattern} в {input_dir}")
+    if manifest is not None:
+        files = manifest_files(manifest)
+        if not files:
+            raise FileNotFoundError(f"В манифесте {manifest} нет существующих файлов")
+    else:
+        files = list(iter_files(input_dir, pattern, recursive))
+        if not files:
+            raise FileNotFoundError(f"Не нашёл файлов по маске {pattern} в {input_dir}")
 
     if dedup not in {"line", "json"}:
         raise ValueError("Параметр --dedup должен быть 'line' или 'json'")
@@ -87,9 +95,12 @@ def main():
     parser.add_argument("--recursive", action="store_true", help="Искать рекурсивно")
     parser.add_argument("--dedup", choices=["line", "json"], default="line",
                         help="Как определять дубликаты: 'line' (по строкам) или 'json' (по канонизированному JSON)")
+    parser.add_argument("--manifest", type=Path, default=None,
+                        help="manifest.json шардированной загрузки (scripts.retrieve --shards); заменяет -i/--pattern")
     args = parser.parse_args()
 
-    merge_jsonl_gz(args.input_dir, args.output, args.pattern, args.recursive, dedup=args.dedup)
+    merge_jsonl_gz(args.input_dir, args.output, args.pattern, args.recursive, dedup=args.dedup,
+                   manifest=args.manifest)
 
 if __name__ == "__main__":
     main()
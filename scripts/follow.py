@@ -0,0 +1,219 @@
+import sys
+import json
+import os
+import argparse
+import requests
+from pathlib import Path
+from time import perf_counter, sleep
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from hackernews_retriever import API_BASE, HNRetriever
+from hackernews_handler import HNHandler
+from db.session import get_engine
+
+def load_state(path: Path) -> dict:
+    if path.exists():
+        with path.open("r", encoding="utf-8") as f:
+            state = json.load(f)
+        retry = state.get("retry") or {}
+        if isinstance(retry, list):
+            # состояние старого формата: список ID без счётчика попыток
+            retry = {str(i): 0 for i in retry}
+        state["retry"] = retry
+        return state
+    return {"last_id": None, "retry": {}}
+
+def save_state(path: Path, state: dict) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+def fetch_items(ex, retriever, ids, session):
+    """(скачанные items, ID с ошибкой загрузки, ID, на которые API вернул null)."""
+    def fetch(item_id):
+        try:
+            return item_id, retriever.retrieve_item(item_id, session), True
+        except Exception:
+            return item_id, None, False
+
+    items, failed, missing = [], [], []
+    for item_id, item, ok in ex.map(fetch, ids):
+        if not ok:
+            failed.append(item_id)
+        elif item:
+            items.append(item)
+        else:
+            missing.append(item_id)
+    return items, failed, missing
+
+def follow_once(retriever, handler, state, ex, session, batch_size=500, max_per_poll=50000, max_attempts=20):
+    """
+    Один цикл опроса: новые ID из (last_id, maxitem], изменённые из updates.json
+    и ID, не скачавшиеся в прошлый раз. Всё скачанное сразу уходит в HNHandler
+    микропакетами по batch_size ID.
+
+    Новый ID у самого maxitem API может какое-то время отдавать как null, поэтому
+    такие ID, как и упавшие с ошибкой, попадают в state["retry"] со счётчиком
+    попыток и повторяются в следующих циклах; после max_attempts неудачных
+    попыток ID выбрасывается из очереди.
+    """
+    max_id = retriever.get_maxitem_id()
+    last_id = state["last_id"]
+    if last_id is None:
+        # первый запуск без --start-id: следим только за тем, что появится дальше
+        last_id = max_id
+
+    upto = min(max_id, last_id + max_per_poll)
+    new_ids = list(range(last_id + 1, upto + 1))
+    updated = [i for i in retriever.get_updates().get("items", []) if i <= last_id]
+    attempts = {int(i): n for i, n in state.get("retry", {}).items()}
+    ids = list(dict.fromkeys(list(attempts) + updated + new_ids))
+
+    stories = comments = 0
+    failed, missing = [], []
+    for i in range(0, len(ids), batch_size):
+        items, chunk_failed, chunk_missing = fetch_items(ex, retriever, ids[i:i + batch_size], session)
+        failed.extend(chunk_failed)
+        missing.extend(chunk_missing)
+        if items:
+            counts = handler.ingest_items(items)
+            stories += counts["stories"]
+            comments += counts["comments"]
+
+    # null у изменённого item — он удалён, повторять нечего; null у нового или
+    # уже повторяемого ID — item ещё не опубликован, ждём его следующими циклами
+    pending = set(new_ids) | set(attempts)
+    retry, dropped = {}, 0
+    for item_id in failed + [i for i in missing if i in pending]:
+        n = attempts.get(item_id, 0) + 1
+        if n < max_attempts:
+            retry[str(item_id)] = n
+        else:
+            dropped += 1
+
+    # состояние сохраняем только после записи в БД: при падении цикл повторится, upsert это переживёт
+    state["last_id"] = upto
+    state["retry"] = retry
+    return {
+        "max_id": max_id,
+        "last_id": upto,
+        "new": len(new_ids),
+        "updated": len(updated),
+        "failed": len(failed),
+        "missing": len(missing),
+        "retry": len(retry),
+        "dropped": dropped,
+        "stories": stories,
+        "comments": comments,
+    }
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="hn_follow",
+        description="Инкрементальная загрузка новых и изменённых items Hacker News прямо в БД"
+    )
+    parser.add_argument(
+        "-d", "--db",
+        required=True,
+        help="Строка подключения SQLAlchemy, например: sqlite:///hn.db"
+    )
+    parser.add_argument(
+        "--state",
+        default="raw_data/follow_state.json",
+        help="Файл состояния с последним загруженным ID (по умолчанию raw_data/follow_state.json)"
+    )
+    parser.add_argument(
+        "-s", "--start-id",
+        type=int,
+        default=None,
+        help="С какого ID начинать, если состояния ещё нет (по умолчанию — с текущего maxitem)"
+    )
+    parser.add_argument(
+        "-i", "--interval",
+        type=float,
+        default=5.0,
+        help="Период опроса maxitem/updates в секундах (по умолчанию 5)"
+    )
+    parser.add_argument(
+        "-w", "--workers",
+        type=int,
+        default=16,
+        help="Количество потоков загрузки (по умолчанию 16)"
+    )
+    parser.add_argument(
+        "-b", "--batch-size",
+        type=int,
+        default=500,
+        help="Размер микропакета ID, после которого данные пишутся в БД (по умолчанию 500)"
+    )
+    parser.add_argument(
+        "--max-per-poll",
+        type=int,
+        default=50000,
+        help="Сколько новых ID максимум брать за один цикл, чтобы догонять большой отрыв частями (по умолчанию 50000)"
+    )
+    parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=20,
+        help="Сколько циклов подряд повторять ID, который не скачался или ещё отдаётся как null, "
+             "прежде чем отказаться от него (по умолчанию 20)"
+    )
+    parser.add_argument(
+        "--once",
+        action="store_true",
+        help="Выполнить один цикл опроса и выйти"
+    )
+    parser.add_argument(
+        "--api-base",
+        default=API_BASE,
+        help=f"Базовый URL HN API (по умолчанию {API_BASE})"
+    )
+    return parser.parse_args()
+
+def main() -> int:
+    args = parse_args()
+
+    try:
+        engine = get_engine(args.db)
+        handler = HNHandler(engine, batch_size=args.batch_size)
+        retriever = HNRetriever(url_base=args.api_base)
+
+        state_path = Path(args.state)
+        state = load_state(state_path)
+        if state["last_id"] is None and args.start_id is not None:
+            state["last_id"] = args.start_id - 1
+
+        with ThreadPoolExecutor(max_workers=args.workers) as ex, requests.Session() as session:
+            while True:
+                t0 = perf_counter()
+                stats = follow_once(retriever, handler, state, ex, session,
+                                    batch_size=args.batch_size, max_per_poll=args.max_per_poll,
+                                    max_attempts=args.max_attempts)
+                save_state(state_path, state)
+                elapsed = perf_counter() - t0
+                print(f"[last_id={stats['last_id']} maxitem={stats['max_id']}] new={stats['new']} "
+                      f"updated={stats['updated']} failed={stats['failed']} missing={stats['missing']} "
+                      f"retry={stats['retry']} dropped={stats['dropped']} stories={stats['stories']} "
+                      f"comments={stats['comments']} elapsed={elapsed:.1f}s")
+                if args.once:
+                    break
+                # если отстаём от maxitem, следующий цикл начинаем сразу
+                if stats["last_id"] >= stats["max_id"]:
+                    sleep(max(0.0, args.interval - elapsed))
+        return 0
+    except KeyboardInterrupt:
+        print("Остановлено пользователем (Ctrl+C)", file=sys.stderr)
+        return 130
+    except Exception as e:
+        print(f"Ошибка: {e}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,73 +5,308 @@ import argparse
 import gzip
 import os
 import itertools
+import asyncio
+import queue
+import threading
 from pathlib import Path
 from time import perf_counter
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 
 ROOT = Path(__file__).resolve().parents[1]
 sys.path.insert(0, str(ROOT))
 
-from hackernews_retriever import HNRetriever
+from hackernews_retriever import API_BASE, HNRetriever, AsyncHNRetriever, RateLimiter, RetryPolicy
+from scripts.checkpoint import Checkpoint, IdRanges, failed_path, read_failed_ids, segment_path
+from scripts.shards import partition_range, part_name, shards_dir, write_manifest, read_manifest, MANIFEST_NAME
 
-def iter_hn_ids(start_id=None, end_id=None, session=None):
-    sess = session or requests
+def iter_hn_ids(start_id=None, end_id=None, session=None, url_base=API_BASE):
     if start_id is None or end_id is None:
-        r = sess.get("https://hacker-news.firebaseio.com/v0/maxitem.json", timeout=10)
-        r.raise_for_status()
-        max_id = r.json()
+        max_id = HNRetriever(url_base=url_base).get_maxitem_id(session)
         start_id = start_id or max_id
         end_id = end_id or 1
     step = 1 if start_id <= end_id else -1
     for i in range(start_id, end_id + step, step):
         yield i
 
+def skip_done(id_iter, done: IdRanges):
+    for i in id_iter:
+        if i not in done:
+            yield i
+
+class ItemWriter:
+    """
+    Пишет элементы в выходной файл и отмечает обработанные ID в чекпоинте.
+
+    Элемент — либо dict (сериализуется через json.dumps), либо уже готовые байты
+    из retrieve_item_raw, которые пишутся как есть. С threaded=True запись и
+    gzip-сжатие уходят в отдельный поток через ограниченную очередь.
+    ID, не скачавшиеся после всех повторов, пишутся в dead-letter файл (fail).
+
+    Раз в `checkpoint_every` элементов сбрасывает gzip (Z_SYNC_FLUSH) и fsync-ает файл,
+    и только после этого сохраняет чекпоинт — так в журнал попадают лишь ID,
+    чьи данные уже лежат на диске.
+    """
+
+    _STOP = object()
+    _FAILED = object()
+
+    def __init__(self, out_path, compress=True, checkpoint=None, checkpoint_every=10000,
+                 threaded=False, queue_size=10000, failed_path=None):
+        self.out_path = out_path
+        self.failed_path = failed_path
+        self.failed = None
+        self.compress = compress
+        self.checkpoint = checkpoint
+        self.checkpoint_every = checkpoint_every
+        self.threaded = threaded
+        self.queue_size = queue_size
+        self._since_sync = 0
+        self._queue = None
+        self._thread = None
+        self._error = None
+        self.f = None
+
+    def __enter__(self):
+        opener = gzip.open if self.compress else open
+        self.f = opener(self.out_path, "wb")
+        if self.failed_path is not None:
+            self.failed = open(self.failed_path, "w", encoding="utf-8")
+        if self.threaded:
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            self._thread = threading.Thread(target=self._run, name="item-writer", daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._thread is not None:
+            self._queue.put(self._STOP)
+            self._thread.join()
+        # close() дописывает gzip-трейлер и при Ctrl+C, так что всё записанное уже на диске
+        self.f.close()
+        if self.failed is not None:
+            self.failed.close()
+        if self.checkpoint is not None:
+            self.checkpoint.save()
+        if self._error is not None and exc_type is None:
+            raise self._error
+
+    def write(self, item_id, item) -> bool:
+        if self._thread is None:
+            self._write_now(item_id, item)
+        else:
+            if self._error is not None:
+                raise self._error
+            self._queue.put((item_id, item))
+        return bool(item)
+
+    def fail(self, item_id) -> None:
+        if self._thread is None:
+            self._fail_now(item_id)
+        else:
+            self._queue.put((item_id, self._FAILED))
+
+    def _fail_now(self, item_id) -> None:
+        if self.failed is not None:
+            self.failed.write(f"{item_id}\n")
+
+    def _run(self) -> None:
+        while True:
+            task = self._queue.get()
+            if task is self._STOP:
+                return
+            if self._error is not None:
+                continue
+            try:
+                self._write_now(*task)
+            except Exception as e:
+                self._error = e
+
+    def _write_now(self, item_id, item) -> None:
+        if item is self._FAILED:
+            self._fail_now(item_id)
+            return
+        if item:
+            if isinstance(item, bytes):
+                self.f.write(item + b"\n")
+            else:
+                self.f.write(json.dumps(item, ensure_ascii=False).encode("utf-8") + b"\n")
+        self.mark_done(item_id)
+
+    def mark_done(self, item_id) -> None:
+        if self.checkpoint is None:
+            return
+        self.checkpoint.done.add(item_id)
+        self._since_sync += 1
+        if self.checkpoint_every and self._since_sync >= self.checkpoint_every:
+            self.sync()
+
+    def sync(self) -> None:
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.checkpoint.save()
+        self._since_sync = 0
+
 def download_items_streaming(id_iter,
                              retriever,
                              out_path="raw_data/hn_data.jsonl.gz",
                              workers=16,
                              compress=True,
-                             progress_every=10000):
-    opener = gzip.open if compress else open
-    mode = "wt" if compress else "w"
+                             progress_every=10000,
+                             checkpoint=None,
+                             checkpoint_every=10000,
+                             raw=False,
+                             writer_thread=False):
+    fetch = retriever.retrieve_item_raw if raw else retriever.retrieve_item
 
     start = perf_counter()
     saved = 0
     errors = 0
     total_seen = 0
 
-    with opener(out_path, mode, encoding="utf-8") as f, requests.Session() as session:
+    writer = ItemWriter(out_path, compress, checkpoint, checkpoint_every,
+                        threaded=writer_thread, failed_path=failed_path(out_path))
+    with writer, requests.Session() as session:
         with ThreadPoolExecutor(max_workers=workers) as ex:
             pending = {}
             for item_id in itertools.islice(id_iter, workers):
-                pending[ex.submit(retriever.retrieve_item, item_id, session)] = item_id
+                pending[ex.submit(fetch, item_id, session)] = item_id
 
             while pending:
-                for fut in as_completed(list(pending.keys()), timeout=None):
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
                     item_id = pending.pop(fut)
                     total_seen += 1
                     try:
                         item = fut.result()
-                        if item:
-                            f.write(json.dumps(item, ensure_ascii=False) + "\n")
+                        if writer.write(item_id, item):
                             saved += 1
                     except Exception:
                         errors += 1
+                        writer.fail(item_id)
 
-                    try:
-                        next_id = next(id_iter)
-                    except StopIteration:
-                        next_id = None
+                    next_id = next(id_iter, None)
                     if next_id is not None:
-                        pending[ex.submit(retriever.retrieve_item, next_id, session)] = next_id
+                        pending[ex.submit(fetch, next_id, session)] = next_id
 
                     if progress_every and (total_seen % progress_every == 0):
                         elapsed = perf_counter() - start
                         rate = saved / elapsed if elapsed > 0 else 0.0
                         print(f"[seen={total_seen}] saved={saved} errors={errors} "
                               f"elapsed={elapsed:.1f}s rate={rate:.1f} items/s")
+
+    elapsed = perf_counter() - start
+    size_bytes = os.path.getsize(out_path)
+    return {
+        "saved": saved,
+        "seen": total_seen,
+        "errors": errors,
+        "elapsed": elapsed,
+        "size_bytes": size_bytes,
+        "out_path": str(out_path),
+    }
+
+class AdaptiveConcurrency:
+    """
+    AIMD-регулятор числа одновременных запросов.
+
+    По окну из `window` завершённых запросов смотрит на долю ошибок и медианную
+    задержку: если обе в пределах нормы — лимит растёт на 25%, иначе — падает вдвое.
+    """
+
+    def __init__(self,
+                 initial=64,
+                 minimum=8,
+                 maximum=2048,
+                 target_latency=1.0,
+                 max_error_rate=0.02,
+                 window=200):
+        self.limit = max(minimum, min(initial, maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.max_error_rate = max_error_rate
+        self.window = window
+        self._latencies = []
+        self._errors = 0
+
+    def record(self, latency, ok):
+        self._latencies.append(latency)
+        if not ok:
+            self._errors += 1
+        if len(self._latencies) < self.window:
+            return
+
+        self._latencies.sort()
+        median = self._latencies[len(self._latencies) // 2]
+        error_rate = self._errors / len(self._latencies)
+        if error_rate > self.max_error_rate or median > self.target_latency:
+            self.limit = max(self.minimum, self.limit // 2)
+        else:
+            self.limit = min(self.maximum, self.limit + max(1, self.limit // 4))
+        self._latencies = []
+        self._errors = 0
+
+async def download_items_async(id_iter,
+                               retriever,
+                               out_path="raw_data/hn_data.jsonl.gz",
+                               concurrency=None,
+                               compress=True,
+                               progress_every=10000,
+                               checkpoint=None,
+                               checkpoint_every=10000,
+                               raw=False,
+                               writer_thread=False):
+    concurrency = concurrency or AdaptiveConcurrency()
+    retrieve = retriever.retrieve_item_raw if raw else retriever.retrieve_item
+
+    start = perf_counter()
+    saved = 0
+    errors = 0
+    total_seen = 0
+
+    async def fetch(item_id):
+        t0 = perf_counter()
+        try:
+            item = await retrieve(item_id)
+            return item_id, item, perf_counter() - t0, True
+        except Exception:
+            return item_id, None, perf_counter() - t0, False
+
+    writer = ItemWriter(out_path, compress, checkpoint, checkpoint_every,
+                        threaded=writer_thread, failed_path=failed_path(out_path))
+    with writer:
+        async with retriever:
+            in_flight = set()
+            exhausted = False
+            while True:
+                while not exhausted and len(in_flight) < concurrency.limit:
+                    item_id = next(id_iter, None)
+                    if item_id is None:
+                        exhausted = True
+                        break
+                    in_flight.add(asyncio.create_task(fetch(item_id)))
+
+                if not in_flight:
                     break
 
+                done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    item_id, item, latency, ok = task.result()
+                    concurrency.record(latency, ok)
+                    total_seen += 1
+                    if not ok:
+                        errors += 1
+                        writer.fail(item_id)
+                    elif writer.write(item_id, item):
+                        saved += 1
+
+                    if progress_every and (total_seen % progress_every == 0):
+                        elapsed = perf_counter() - start
+                        rate = saved / elapsed if elapsed > 0 else 0.0
+                        print(f"[seen={total_seen}] saved={saved} errors={errors} "
+                              f"limit={concurrency.limit} "
+                              f"elapsed={elapsed:.1f}s rate={rate:.1f} items/s")
+
     elapsed = perf_counter() - start
     size_bytes = os.path.getsize(out_path)
     return {
@@ -80,7 +315,7 @@ def download_items_streaming(id_iter,
         "errors": errors,
         "elapsed": elapsed,
         "size_bytes": size_bytes,
-        "out_path": out_path,
+        "out_path": str(out_path),
     }
 
 def retrieve(path, ids):
@@ -88,6 +323,129 @@ def retrieve(path, ids):
     stats = download_items_streaming(ids, retriever, out_path=path, workers=32, compress=True)
     print(stats)
 
+def run_download(start_id, end_id, out_path, opts: dict) -> dict:
+    """Одна загрузка диапазона с чекпоинтом; opts — аргументы командной строки (vars(args))."""
+    if opts["retry_failed"]:
+        checkpoint = Checkpoint.load(out_path)
+        if not checkpoint.segments:
+            raise FileNotFoundError(f"Нет чекпоинта {checkpoint.path}: нечего перекачивать")
+        failed = [i for i in read_failed_ids(out_path, checkpoint.segments) if i not in checkpoint.done]
+        print(f"Повторная загрузка {out_path}: {len(failed)} ID из dead-letter файлов")
+        ids = iter(failed)
+    else:
+        ids = iter_hn_ids(start_id, end_id, url_base=opts["api_base"])
+        checkpoint = Checkpoint.load(out_path) if opts["resume"] else Checkpoint(out_path)
+        if checkpoint.segments:
+            print(f"Продолжаем загрузку {out_path}: уже обработано {len(checkpoint.done)} ID "
+                  f"в {len(checkpoint.segments)} сегмент(ах)")
+            ids = skip_done(ids, checkpoint.done)
+    segment = checkpoint.next_segment()
+
+    rate_limiter = RateLimiter(opts["rps"])
+    retry = RetryPolicy(retries=opts["retries"])
+    if opts["engine"] == "async":
+        retriever = AsyncHNRetriever(url_base=opts["api_base"], pool_size=opts["max_concurrency"],
+                                     rate_limiter=rate_limiter, retry=retry)
+        concurrency = AdaptiveConcurrency(
+            initial=opts["workers"],
+            maximum=opts["max_concurrency"],
+            target_latency=opts["target_latency"],
+        )
+        stats = asyncio.run(download_items_async(
+            ids,
+            retriever,
+            out_path=segment,
+            concurrency=concurrency,
+            compress=opts["compress"],
+            progress_every=opts["progress_every"],
+            checkpoint=checkpoint,
+            checkpoint_every=opts["checkpoint_every"],
+            raw=opts["raw"],
+            writer_thread=opts["writer_thread"],
+        ))
+    else:
+        retriever = HNRetriever(url_base=opts["api_base"], rate_limiter=rate_limiter, retry=retry)
+        stats = download_items_streaming(
+            ids,
+            retriever,
+            out_path=segment,
+            workers=opts["workers"],
+            compress=opts["compress"],
+            progress_every=opts["progress_every"],
+            checkpoint=checkpoint,
+            checkpoint_every=opts["checkpoint_every"],
+            raw=opts["raw"],
+            writer_thread=opts["writer_thread"],
+        )
+    stats["segments"] = list(checkpoint.segments)
+    return stats
+
+def run_shard(index, start_id, end_id, out_path, opts: dict) -> dict:
+    stats = run_download(start_id, end_id, out_path, opts)
+    stats["index"] = index
+    return stats
+
+def download_sharded(start_id, end_id, out_dir, shards, opts: dict) -> dict:
+    """
+    Делит [start_id, end_id] на `shards` смежных поддиапазонов и качает каждый в своём процессе
+    в out_dir/part-XXXX.jsonl.gz. Итог описывается в out_dir/manifest.json, который принимают
+    scripts.combine (--manifest) и db.scripts.ingest (-i .../manifest.json).
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    if (opts["resume"] or opts["retry_failed"]) and (out_dir / MANIFEST_NAME).exists():
+        # при продолжении разбиение берём из манифеста, иначе чекпоинты частей не совпадут
+        manifest = read_manifest(out_dir)
+        ranges = [(sh["start_id"], sh["end_id"]) for sh in manifest["shards"]]
+    else:
+        ranges = partition_range(start_id, end_id, shards)
+
+    manifest = {
+        "start_id": ranges[0][0],
+        "end_id": ranges[-1][1],
+        "shards": [
+            {"part": part_name(i, opts["compress"]), "start_id": a, "end_id": b}
+            for i, (a, b) in enumerate(ranges)
+        ],
+    }
+    # сегменты пишутся в манифест сразу: если запуск упадёт, combine и ingest
+    # всё равно увидят и прежние сегменты частей, и тот, что пишется сейчас
+    for sh in manifest["shards"]:
+        part = out_dir / sh["part"]
+        ckpt = Checkpoint.load(part) if opts["resume"] or opts["retry_failed"] else Checkpoint(part)
+        sh["segments"] = ckpt.segments + [segment_path(part, len(ckpt.segments)).name]
+    write_manifest(out_dir, manifest)
+
+    # бюджет запросов в секунду общий на все процессы
+    opts = dict(opts, rps=opts["rps"] / len(ranges) if opts["rps"] else None)
+
+    start = perf_counter()
+    with ProcessPoolExecutor(max_workers=len(ranges)) as ex:
+        futures = [
+            ex.submit(run_shard, i, sh["start_id"], sh["end_id"], out_dir / sh["part"], opts)
+            for i, sh in enumerate(manifest["shards"])
+        ]
+        for fut in futures:
+            stats = fut.result()
+            manifest["shards"][stats["index"]].update({
+                "segments": stats["segments"],
+                "saved": stats["saved"],
+                "seen": stats["seen"],
+                "errors": stats["errors"],
+            })
+    write_manifest(out_dir, manifest)
+
+    shards_stats = manifest["shards"]
+    return {
+        "saved": sum(sh["saved"] for sh in shards_stats),
+        "seen": sum(sh["seen"] for sh in shards_stats),
+        "errors": sum(sh["errors"] for sh in shards_stats),
+        "elapsed": perf_counter() - start,
+        "size_bytes": sum((out_dir / seg).stat().st_size for sh in shards_stats for seg in sh["segments"]),
+        "out_path": str(out_dir / MANIFEST_NAME),
+    }
+
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
@@ -117,6 +475,75 @@ def parse_args() -> argparse.Namespace:
         default=32,
         help="Количество потоков для загрузки (по умолчанию 32)"
     )
+    parser.add_argument(
+        "--engine",
+        choices=["threads", "async"],
+        default="threads",
+        help="Движок загрузки: threads (пул потоков) или async (asyncio + aiohttp); по умолчанию threads"
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=2048,
+        help="Верхняя граница одновременных запросов для --engine async (по умолчанию 2048)"
+    )
+    parser.add_argument(
+        "--target-latency",
+        type=float,
+        default=1.0,
+        help="Медианная задержка (сек), выше которой async-движок снижает параллелизм (по умолчанию 1.0)"
+    )
+    parser.add_argument(
+        "--api-base",
+        default=API_BASE,
+        help=f"Базовый URL HN API (по умолчанию {API_BASE})"
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help="Число процессов: диапазон делится на смежные части, каждая пишется в свой part-XXXX.jsonl.gz "
+             "в папке <out без расширений>/ вместе с manifest.json (по умолчанию 1)"
+    )
+    parser.add_argument(
+        "--rps",
+        type=float,
+        default=None,
+        help="Ограничение запросов в секунду на всю загрузку (token bucket; по умолчанию без ограничения)"
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=5,
+        help="Сколько раз повторять запрос при 408/429/5xx и сетевых ошибках (по умолчанию 5)"
+    )
+    parser.add_argument(
+        "--retry-failed",
+        action="store_true",
+        help="Перекачать только ID из dead-letter файлов (<сегмент>.failed) предыдущих запусков в новый сегмент"
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Продолжить прерванную загрузку: пропустить ID из чекпоинта <out>.ckpt.json и писать в новый сегмент"
+    )
+    parser.add_argument(
+        "--checkpoint-every",
+        type=int,
+        default=10000,
+        help="Как часто сбрасывать файл на диск и сохранять чекпоинт (в элементах, по умолчанию 10000)"
+    )
+    parser.add_argument(
+        "--raw",
+        action="store_true",
+        help="Архивный режим: писать тело ответа API как есть (без json.loads/json.dumps), "
+             "отбрасывая null и лишние пробелы форматирования"
+    )
+    parser.add_argument(
+        "--writer-thread",
+        action="store_true",
+        help="Вынести запись и gzip-сжатие в отдельный поток"
+    )
     parser.add_argument(
         "--no-compress",
         action="store_false",
@@ -140,16 +567,16 @@ def main() -> int:
         return 2
 
     try:
-        retriever = HNRetriever()
-        ids = iter_hn_ids(args.start_id, args.end_id)
-        stats = download_items_streaming(
-            ids,
-            retriever,
-            out_path=args.out,
-            workers=args.workers,
-            compress=args.compress,
-            progress_every=args.progress_every,
-        )
+        opts = vars(args)
+        if args.shards > 1:
+            start_id, end_id = args.start_id, args.end_id
+            if start_id is None or end_id is None:
+                max_id = HNRetriever(url_base=args.api_base).get_maxitem_id()
+                start_id = start_id or max_id
+                end_id = end_id or 1
+            stats = download_sharded(start_id, end_id, shards_dir(args.out), args.shards, opts)
+        else:
+            stats = run_download(args.start_id, args.end_id, args.out, opts)
         print(
             f"Done: saved={stats['saved']} seen={stats['seen']} errors={stats['errors']} "
             f"elapsed={stats['elapsed']:.1f}s size={stats['size_bytes']}B out={stats['out_path']}"
@@ -0,0 +1,77 @@
+import json
+import os
+from pathlib import Path
+from typing import List, Tuple
+
+from scripts.checkpoint import segment_files
+
+MANIFEST_NAME = "manifest.json"
+
+
+def partition_range(start_id: int, end_id: int, shards: int) -> List[Tuple[int, int]]:
+    """
+    Делит [start_id, end_id] на `shards` смежных поддиапазонов почти равной длины.
+    Направление обхода (по возрастанию или убыванию ID) сохраняется.
+    """
+    step = 1 if start_id <= end_id else -1
+    total = abs(end_id - start_id) + 1
+    shards = max(1, min(shards, total))
+    base, extra = divmod(total, shards)
+
+    ranges = []
+    cur = start_id
+    for i in range(shards):
+        size = base + (1 if i < extra else 0)
+        last = cur + step * (size - 1)
+        ranges.append((cur, last))
+        cur = last + step
+    return ranges
+
+
+def part_name(index: int, compress: bool = True) -> str:
+    return f"part-{index:04d}.jsonl" + (".gz" if compress else "")
+
+
+def shards_dir(out_path: str | Path) -> Path:
+    """raw_data/hn_data.jsonl.gz -> raw_data/hn_data/"""
+    p = Path(out_path)
+    suffixes = "".join(p.suffixes)
+    return p.with_name(p.name[: -len(suffixes)] if suffixes else p.name)
+
+
+def write_manifest(out_dir: str | Path, manifest: dict) -> Path:
+    path = Path(out_dir) / MANIFEST_NAME
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+    return path
+
+
+def read_manifest(path: str | Path) -> dict:
+    p = Path(path)
+    if p.is_dir():
+        p = p / MANIFEST_NAME
+    with p.open("r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def manifest_files(path: str | Path) -> List[Path]:
+    """
+    Все файлы данных (части и их сегменты после --resume), перечисленные в манифесте.
+    Если у части нет списка segments (манифест старого формата), берутся все её
+    сегменты, найденные на диске.
+    """
+    p = Path(path)
+    root = p if p.is_dir() else p.parent
+    manifest = read_manifest(p)
+    files = []
+    for shard in manifest["shards"]:
+        if "segments" not in shard:
+            files.extend(segment_files(root / shard["part"]))
+            continue
+        for seg in shard["segments"]:
+            f = root / seg
+            if f.exists():
+                files.append(f)
+    return files
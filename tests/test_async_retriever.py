@@ -0,0 +1,149 @@
+import asyncio
+import json
+from time import monotonic
+
+import pytest
+
+aiohttp = pytest.importorskip("aiohttp")
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from hackernews_retriever import AsyncHNRetriever, RateLimiter, RetryableHTTPError, RetryPolicy
+from scripts.checkpoint import failed_path
+from scripts.retrieve import AdaptiveConcurrency, download_items_async
+
+
+class FakeAPI:
+    """
+    Тестовый HN API: для item задаётся очередь ответов [(status, заголовки)], после
+    которой отдаётся сам item, и задержка ответа в секундах; время каждого запроса запоминается.
+    """
+
+    def __init__(self, script=None, delay=None):
+        self.script = {k: list(v) for k, v in (script or {}).items()}
+        self.delay = delay or {}
+        self.hits = {}
+
+    async def item(self, request):
+        item_id = int(request.match_info["id"])
+        self.hits.setdefault(item_id, []).append(monotonic())
+        if item_id in self.delay:
+            await asyncio.sleep(self.delay[item_id])
+        queue = self.script.get(item_id)
+        if queue:
+            status, headers = queue.pop(0)
+            return web.Response(status=status, headers=headers)
+        return web.json_response({"id": item_id, "type": "story", "title": f"t{item_id}"})
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/v0/item/{id}.json", self.item)
+        return app
+
+
+def run_with_server(api, body):
+    async def main():
+        async with TestServer(api.app()) as server:
+            return await body(str(server.make_url("/v0/")))
+    return asyncio.run(main())
+
+
+def fast_retry(retries=3):
+    return RetryPolicy(retries=retries, backoff=0.001, max_backoff=1.0)
+
+
+def test_retryable_statuses_are_retried():
+    api = FakeAPI({1: [(429, {}), (503, {}), (502, {})]})
+
+    async def body(url):
+        async with AsyncHNRetriever(url_base=url, retry=fast_retry()) as r:
+            return await r.retrieve_item(1)
+
+    assert run_with_server(api, body) == {"id": 1, "type": "story", "title": "t1"}
+    assert len(api.hits[1]) == 4
+
+
+def test_retry_after_is_honoured():
+    api = FakeAPI({1: [(429, {"Retry-After": "0.3"})]})
+
+    async def body(url):
+        async with AsyncHNRetriever(url_base=url, retry=fast_retry()) as r:
+            return await r.retrieve_item(1)
+
+    assert run_with_server(api, body)["id"] == 1
+    first, second = api.hits[1]
+    assert second - first >= 0.3
+
+
+def test_retries_are_bounded():
+    api = FakeAPI({1: [(500, {})] * 10})
+
+    async def body(url):
+        async with AsyncHNRetriever(url_base=url, retry=fast_retry(retries=2)) as r:
+            with pytest.raises(RetryableHTTPError):
+                await r.retrieve_item(1)
+
+    run_with_server(api, body)
+    assert len(api.hits[1]) == 3
+
+
+def test_download_respects_rate_limiter(tmp_path):
+    rate, n = 20.0, 12
+    # повторы после 429/503 тоже идут через лимитер, 404 не повторяется
+    api = FakeAPI({3: [(429, {})], 7: [(503, {})], 9: [(404, {})]})
+    out = tmp_path / "items.jsonl"
+
+    async def body(url):
+        retriever = AsyncHNRetriever(url_base=url, rate_limiter=RateLimiter(rate, burst=1),
+                                     retry=fast_retry())
+        return await download_items_async(
+            iter(range(1, n + 1)), retriever, out_path=out,
+            concurrency=AdaptiveConcurrency(initial=8, minimum=1), compress=False, progress_every=0,
+        )
+
+    stats = run_with_server(api, body)
+    assert (stats["seen"], stats["saved"], stats["errors"]) == (n, n - 1, 1)
+    assert sorted(json.loads(line)["id"] for line in out.read_text().splitlines()) == [
+        i for i in range(1, n + 1) if i != 9
+    ]
+    # 404 не повторяется и уходит в dead-letter файл
+    assert failed_path(out).read_text().split() == ["9"]
+
+    requests = sum(len(hits) for hits in api.hits.values())
+    assert requests == n + 2
+    # burst=1: каждый запрос после первого ждёт свой токен, так что быстрее (requests - 1) / rate
+    # загрузка пройти не может, хотя одновременно разрешено до 8 запросов
+    assert stats["elapsed"] >= (requests - 1) / rate
+
+
+class RecordingConcurrency(AdaptiveConcurrency):
+    """AdaptiveConcurrency, запоминающий лимит после каждого окна."""
+
+    def __init__(self, **kw):
+        super().__init__(**kw)
+        self.history = []
+
+    def record(self, latency, ok):
+        super().record(latency, ok)
+        if not self._latencies:
+            self.history.append(self.limit)
+
+
+def test_adaptive_concurrency_follows_latency_and_errors(tmp_path):
+    # 1..10 — быстрые ответы, 11..20 — медленные, 21..30 — 500 без повторов
+    api = FakeAPI(script={i: [(500, {})] for i in range(21, 31)},
+                  delay={i: 0.2 for i in range(11, 21)})
+    concurrency = RecordingConcurrency(initial=8, minimum=1, target_latency=0.05, window=10)
+
+    async def body(url):
+        retriever = AsyncHNRetriever(url_base=url, retry=fast_retry(retries=0))
+        return await download_items_async(
+            iter(range(1, 31)), retriever, out_path=tmp_path / "items.jsonl",
+            concurrency=concurrency, compress=False, progress_every=0,
+        )
+
+    stats = run_with_server(api, body)
+    assert (stats["saved"], stats["errors"]) == (20, 10)
+    # первое окно целиком из быстрых ответов: +25%; дальше в каждом окне медиана
+    # выше target_latency или доля ошибок выше max_error_rate: лимит падает вдвое
+    assert concurrency.history == [10, 5, 2]
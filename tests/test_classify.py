@@ -0,0 +1,87 @@
+import re
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from db.models import Base, Comment, Story, comment_tech, story_tech
+from analytics.embeddings.patterns import PATTERNS
+from analytics.embeddings.scripts.classify_comments import tag_comments
+from analytics.embeddings.scripts.classify_tech import classify_new_stories, classify_stories
+
+
+def links(session) -> set:
+    return {tuple(r) for r in session.execute(select(story_tech.c.story_id, story_tech.c.tech_id))}
+
+
+def add_stories(session, titles: dict) -> None:
+    session.add_all([Story(id=i, title=t, kids=[]) for i, t in titles.items()])
+    session.commit()
+
+
+def test_incremental_classifies_late_lower_id_stories(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'hn.db'}")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        add_stories(session, {100: "Show HN: a Rust web server", 101: "Ask HN: anything"})
+        classify_new_stories(session)
+
+        # догрузка старого диапазона: id меньше уже размеченных
+        add_stories(session, {5: "Why we moved from Python to Go", 6: "nothing here"})
+        stats = classify_new_stories(session)
+        assert stats["new"] == 2 and not stats["stale"]
+        incremental = links(session)
+
+        classify_stories(session)
+        assert links(session) == incremental
+        assert {story_id for story_id, _ in incremental} == {5, 100}
+        assert classify_new_stories(session)["new"] == 0
+
+
+def tags(session) -> set:
+    return {tuple(r) for r in session.execute(select(comment_tech.c.comment_id, comment_tech.c.tech_id,
+                                                     comment_tech.c.count))}
+
+
+def add_comments(session, texts: dict) -> None:
+    session.add_all([Comment(id=i, text=t) for i, t in texts.items()])
+    session.commit()
+
+
+def test_incremental_tags_late_lower_id_comments(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'hn.db'}")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        add_comments(session, {100: "rust and more rust", 101: "no mentions"})
+        tag_comments(session, incremental=True)
+
+        add_comments(session, {5: "written in python", 6: "nothing"})
+        stats = tag_comments(session, incremental=True)
+        assert stats["comments"] == 2 and not stats["stale"]
+        incremental = tags(session)
+
+        tag_comments(session, full=True)
+        assert tags(session) == incremental
+        assert {comment_id for comment_id, _, _ in incremental} == {5, 100}
+        assert tag_comments(session, incremental=True)["comments"] == 0
+
+
+def test_changed_patterns_refresh_counts(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'hn.db'}")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        add_comments(session, {1: "rust, cargo and rustc"})
+        patterns = {"rust": [re.compile(r"\brust\b")], "go": [re.compile(r"\bgolang\b")]}
+        tag_comments(session, patterns, incremental=True)
+        assert {count for _, _, count in tags(session)} == {1}
+
+        # изменилась только rust: она размечается заново, count уже записанной пары обновляется
+        patterns["rust"] = [re.compile(r"\brust\b"), re.compile(r"\bcargo\b"), re.compile(r"\brustc\b")]
+        stats = tag_comments(session, patterns, incremental=True)
+        assert stats["stale"] == ["rust"]
+        assert {count for _, _, count in tags(session)} == {3}
+
+        # повторная разметка диапазона тоже обновляет count, а не пропускает пару
+        session.execute(comment_tech.update().values(count=99))
+        session.commit()
+        tag_comments(session, patterns, start_id=1)
+        assert {count for _, _, count in tags(session)} == {3}
@@ -0,0 +1,100 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from db.models import Comment, Story
+from hackernews_handler import HNHandler
+from scripts.follow import follow_once, load_state, save_state
+
+
+class FakeHNAPI:
+    """Подменяет HNRetriever: maxitem, updates.json и items задаются прямо в тесте."""
+
+    def __init__(self):
+        self.items = {}
+        self.max_id = 0
+        self.updates = []
+        self.requests = []
+
+    def get_maxitem_id(self, session=None):
+        return self.max_id
+
+    def get_updates(self, session=None):
+        return {"items": list(self.updates), "profiles": []}
+
+    def retrieve_item(self, item_id, session=None):
+        self.requests.append(item_id)
+        return self.items.get(item_id)
+
+
+def story(item_id, title, score=1):
+    return {"id": item_id, "type": "story", "by": "pg", "time": 1700000000, "title": title, "score": score}
+
+
+def comment(item_id, parent, text):
+    return {"id": item_id, "type": "comment", "by": "dang", "time": 1700000000, "parent": parent, "text": text}
+
+
+def poll(api, handler, state, **kw):
+    with ThreadPoolExecutor(max_workers=4) as ex:
+        return follow_once(api, handler, state, ex, session=None, **kw)
+
+
+def make_handler(tmp_path):
+    return HNHandler(create_engine(f"sqlite:///{tmp_path / 'hn.db'}"), batch_size=10)
+
+
+def test_follow_picks_up_late_items_and_edits(tmp_path):
+    api = FakeHNAPI()
+    handler = make_handler(tmp_path)
+    state = {"last_id": 100, "retry": {}}
+
+    # maxitem вырос до 103; 103 уже выделен, но API пока отдаёт null
+    api.items = {101: story(101, "Show HN: first"), 102: comment(102, 101, "nice")}
+    api.max_id = 103
+    stats = poll(api, handler, state)
+    assert stats["new"] == 3 and stats["missing"] == 1
+    assert state == {"last_id": 103, "retry": {"103": 1}}
+
+    # 103 появился, maxitem вырос ещё; updates.json сообщает о правке 101
+    api.items[103] = comment(103, 101, "late")
+    api.items[101] = story(101, "Show HN: first (edited)", score=42)
+    api.items[104] = story(104, "second")
+    api.max_id = 104
+    api.updates = [101]
+    api.requests.clear()
+    stats = poll(api, handler, state)
+    assert sorted(api.requests) == [101, 103, 104]
+    assert stats["updated"] == 1 and stats["retry"] == 0
+    assert state == {"last_id": 104, "retry": {}}
+
+    with Session(handler.engine) as s:
+        assert s.scalars(select(Comment.id).order_by(Comment.id)).all() == [102, 103]
+        edited = s.get(Story, 101)
+        assert (edited.title, edited.score) == ("Show HN: first (edited)", 42)
+        assert s.get(Story, 104) is not None
+
+
+def test_follow_drops_ids_after_max_attempts(tmp_path):
+    api = FakeHNAPI()
+    handler = make_handler(tmp_path)
+    state = {"last_id": 10, "retry": {}}
+    api.max_id = 11
+
+    for attempt in (1, 2):
+        poll(api, handler, state, max_attempts=3)
+        assert state["retry"] == {"11": attempt}
+    stats = poll(api, handler, state, max_attempts=3)
+    assert stats["dropped"] == 1 and state["retry"] == {}
+
+    # удалённый item из updates.json (null) в очередь повторов не попадает
+    api.updates = [5]
+    stats = poll(api, handler, state, max_attempts=3)
+    assert stats["missing"] == 1 and state["retry"] == {}
+
+
+def test_load_state_converts_old_retry_list(tmp_path):
+    path = tmp_path / "state.json"
+    save_state(path, {"last_id": 7, "retry": [3, 5]})
+    assert load_state(path) == {"last_id": 7, "retry": {"3": 0, "5": 0}}
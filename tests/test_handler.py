@@ -0,0 +1,83 @@
+import gzip
+import json
+import random
+
+import pytest
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.orm import Session
+
+from db.models import Comment
+from hackernews_handler import HNHandler
+
+
+def story(item_id):
+    return {"id": item_id, "type": "story", "by": "pg", "time": 1700000000, "title": f"t{item_id}"}
+
+
+def comment(item_id, parent):
+    return {"id": item_id, "type": "comment", "by": "dang", "time": 1700000000, "parent": parent, "text": f"c{item_id}"}
+
+
+def make_handler(tmp_path, **kw):
+    return HNHandler(create_engine(f"sqlite:///{tmp_path / 'hn.db'}"), **kw)
+
+
+def count_commits(engine) -> list:
+    commits = []
+    event.listen(engine, "commit", lambda conn: commits.append(1))
+    return commits
+
+
+def test_commit_every_counts_batches(tmp_path):
+    handler = make_handler(tmp_path, batch_size=4, commit_every=2)
+    commits = count_commits(handler.engine)
+    # 4 пакета, в каждом и истории, и комментарии
+    items = [it for s in range(1, 9, 2) for it in (story(100 + s), story(101 + s), comment(200 + s, 100 + s),
+                                                    comment(201 + s, 101 + s))]
+    counts = handler.ingest_items(items)
+    assert counts == {"stories": 8, "comments": 8}
+    # по транзакции на 2 пакета; прежде каждый INSERT историй и комментариев считался отдельно (4)
+    assert len(commits) == 2
+
+
+def thread_items(stories=30, comments=300, seed=7):
+    """Истории 1..stories и комментарии после них; родитель — случайный более ранний item."""
+    rng = random.Random(seed)
+    items = [story(i) for i in range(1, stories + 1)]
+    for cid in range(stories + 1, stories + comments + 1):
+        items.append(comment(cid, rng.randint(1, cid - 1)))
+    expected = {}
+    for it in items:
+        if it["type"] == "story":
+            expected[it["id"]] = (it["id"], 0)
+        else:
+            root, depth = expected[it["parent"]]
+            expected[it["id"]] = (root, depth + 1)
+    return items, {i: v for i, v in expected.items() if i > stories}
+
+
+def stored_roots(engine) -> dict:
+    with Session(engine) as s:
+        return {i: (r, d) for i, r, d in s.execute(select(Comment.id, Comment.root_story_id, Comment.depth))}
+
+
+@pytest.mark.parametrize("order", ["ascending", "descending"])
+def test_roots_resolved_in_any_order(tmp_path, order):
+    items, expected = thread_items()
+    if order == "descending":
+        # порядок scripts.retrieve по умолчанию: от maxitem вниз, ответы раньше историй
+        items = items[::-1]
+    handler = make_handler(tmp_path, batch_size=20)
+    handler.ingest_items(items)
+    assert stored_roots(handler.engine) == expected
+
+
+def test_roots_resolved_across_files_in_descending_order(tmp_path):
+    items, expected = thread_items()
+    path = tmp_path / "items.jsonl.gz"
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        for it in reversed(items):
+            f.write(json.dumps(it) + "\n")
+    handler = make_handler(tmp_path, batch_size=20)
+    handler.ingest_paths([path], workers=1)
+    assert stored_roots(handler.engine) == expected
@@ -0,0 +1,76 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Tuple
+
+# сколько первых байт входа хэшируется, чтобы узнать перезаписанный файл
+HEAD_BYTES = 64 * 1024
+
+
+def delta_state_path(out_path: str | Path) -> Path:
+    """artifacts/sentences/context_lem.txt -> artifacts/sentences/context_lem.txt.delta.json"""
+    p = Path(out_path)
+    return p.with_name(p.name + ".delta.json")
+
+
+def input_identity(in_path: str | Path, offset: int) -> dict:
+    """
+    Признаки того, что вход — тот же файл, который дописывается, а не выгруженный заново:
+    inode, хэш первых min(offset, HEAD_BYTES) байт и, если рядом лежит манифест
+    экспорта (<in>.manifest.json, см. db/incremental.py), время первого запуска в его runs.
+    Полная выгрузка начинает runs заново, поэтому это время меняется при каждой полной
+    выгрузке, даже если файл остался того же размера или вырос.
+    """
+    p = Path(in_path)
+    with p.open("rb") as f:
+        head = f.read(min(offset, HEAD_BYTES))
+    ident = {"inode": p.stat().st_ino, "head": hashlib.sha1(head).hexdigest()}
+    manifest = p.with_name(p.name + ".manifest.json")
+    if manifest.exists():
+        with manifest.open("r", encoding="utf-8") as f:
+            runs = json.load(f).get("runs") or []
+        if runs:
+            ident["export"] = runs[0].get("at")
+    return ident
+
+
+def open_delta(in_path: str | Path, out_path: str | Path, incremental: bool) -> Tuple[int, bool]:
+    """
+    (смещение во входном файле, дописывать ли выход) для пошаговой обработки
+    файла, который растёт дозаписью (экспорт с --incremental).
+
+    Состояние <out>.delta.json хранит, до какого байта вход уже обработан,
+    какого размера был выход и признаки входа (input_identity). Если вход стал
+    короче, сменился (другой inode, начало файла или полная выгрузка по манифесту
+    экспорта) или выхода нет, обработка начинается сначала; хвост выхода после
+    упавшего запуска обрезается до записанного размера.
+    """
+    state_path = delta_state_path(out_path)
+    in_path, out_path = Path(in_path), Path(out_path)
+    if not incremental or not state_path.exists() or not out_path.exists():
+        return 0, False
+    with state_path.open("r", encoding="utf-8") as f:
+        state = json.load(f)
+    offset = state.get("offset", 0)
+    if state.get("input") != in_path.name or in_path.stat().st_size < offset:
+        return 0, False
+    if state.get("identity") != input_identity(in_path, offset):
+        return 0, False
+    if out_path.stat().st_size > state["size"]:
+        os.truncate(out_path, state["size"])
+    return offset, True
+
+
+def save_delta(in_path: str | Path, out_path: str | Path, offset: int) -> None:
+    state = {
+        "input": Path(in_path).name,
+        "offset": offset,
+        "size": Path(out_path).stat().st_size,
+        "identity": input_identity(in_path, offset),
+    }
+    state_path = delta_state_path(out_path)
+    tmp = state_path.with_name(state_path.name + ".tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp, state_path)
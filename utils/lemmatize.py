@@ -1,6 +1,9 @@
 import re
+import sqlite3
+from collections import OrderedDict
+from itertools import islice
 from pathlib import Path
-from typing import List, Iterator, Set
+from typing import Callable, Dict, List, Iterator, Set
 
 _en_nlp = None 
 
@@ -49,32 +52,148 @@ def load_preserve_words(path: Path | None) -> Set[str]:
     
     return words
 
-def _lemmatize_en_batch(tokens: List[str], preserve_words: Set[str] | None = None) -> List[str]:
+class LemmaCache:
+    """
+    Общий на процесс LRU-кэш token -> lemma для spaCy.
+
+    Лемма считается по одиночному токену (без контекста предложения), поэтому
+    её можно переиспользовать между строками и файлами. В памяти держится до
+    maxsize токенов; с path кэш дополнительно хранится в SQLite-файле и переживает
+    перезапуски. Файл привязан к имени и версии модели: при смене модели он очищается.
+    """
+
+    def __init__(self, maxsize: int = 1_000_000, path: str | Path | None = None):
+        self.maxsize = maxsize
+        self._mem: OrderedDict[str, str] = OrderedDict()
+        self._db: sqlite3.Connection | None = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if path:
+            self._open(Path(path))
+
+    def _open(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path))
+        self._db.execute("CREATE TABLE IF NOT EXISTS lemma (token TEXT PRIMARY KEY, lemma TEXT NOT NULL)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        model = _model_id()
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'model'").fetchone()
+        if row is None or row[0] != model:
+            self._db.execute("DELETE FROM lemma")
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES ('model', ?)", (model,))
+        self._db.commit()
+
+    def _remember(self, token: str, lemma: str) -> None:
+        self._mem[token] = lemma
+        if len(self._mem) > self.maxsize:
+            self._mem.popitem(last=False)
+
+    def lemmas(self, tokens: List[str], compute: Callable[[List[str]], List[str]]) -> Dict[str, str]:
+        """
+        {token: lemma} для всех токенов: из памяти, затем с диска, а оставшиеся
+        уникальные токены — одним вызовом compute(список) (spaCy) с записью в кэш.
+        """
+        out: Dict[str, str] = {}
+        missing = []
+        for t in dict.fromkeys(tokens):
+            lemma = self._mem.get(t)
+            if lemma is None:
+                missing.append(t)
+            else:
+                self._mem.move_to_end(t)
+                out[t] = lemma
+        if missing and self._db is not None:
+            found: Dict[str, str] = {}
+            for i in range(0, len(missing), 500):
+                chunk = missing[i:i + 500]
+                found.update(self._db.execute(
+                    f"SELECT token, lemma FROM lemma WHERE token IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall())
+            for t, lemma in found.items():
+                self._remember(t, lemma)
+            out.update(found)
+            self.disk_hits += len(found)
+            missing = [t for t in missing if t not in found]
+        if missing:
+            pairs = list(zip(missing, compute(missing)))
+            for t, lemma in pairs:
+                self._remember(t, lemma)
+            if self._db is not None:
+                self._db.executemany("INSERT OR REPLACE INTO lemma VALUES (?, ?)", pairs)
+                self._db.commit()
+            out.update(pairs)
+        self.misses += len(missing)
+        self.hits += len(tokens) - len(missing)
+        return out
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "lookups": total,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._mem),
+        }
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+def _model_id() -> str:
     if _en_nlp is None:
-        return tokens
-    
+        return ""
+    meta = getattr(_en_nlp, "meta", {}) or {}
+    return f"{meta.get('lang', '')}_{meta.get('name', '')}-{meta.get('version', '')}"
+
+
+_cache = LemmaCache()
+
+
+def configure_lemma_cache(maxsize: int = 1_000_000, path: str | Path | None = None) -> LemmaCache:
+    """Заменяет общий кэш лемм процесса (например, на дисковый) и возвращает его."""
+    global _cache
+    _cache.close()
+    _cache = LemmaCache(maxsize=maxsize, path=path)
+    return _cache
+
+
+def lemma_cache_stats() -> dict:
+    return _cache.stats()
+
+
+def format_lemma_cache_stats() -> str:
+    if _en_nlp is None:
+        return "Lemma cache: spaCy unavailable, lemmatization skipped"
+    st = lemma_cache_stats()
+    return (f"Lemma cache: {st['lookups']} lookups, hit rate {st['hit_rate']:.1%}, "
+            f"spaCy calls {st['misses']}, from disk {st['disk_hits']}, cached {st['size']}")
+
+
+def _lemmatize_en_lines(lines: List[List[str]], preserve_words: Set[str] | None = None) -> List[List[str]]:
+    """
+    Лемматизирует токены сразу многих строк: токены, которых нет в кэше,
+    собираются со всех строк и проходят через spaCy одним nlp.pipe.
+    """
+    if _en_nlp is None:
+        return lines
     if preserve_words is None:
         preserve_words = set()
-    
-    cache: dict[str, str] = {}
-    uniq, seen = [], set()
-    
-    for t in tokens:
-        if t not in seen:
-            uniq.append(t)
-            seen.add(t)
-    
-    if _en_nlp is not None:
-        for doc, t in zip(_en_nlp.pipe(uniq, batch_size=1000), uniq):
-            if t.lower() in preserve_words:
-                cache[t] = t
-            else:
-                cache[t] = (doc[0].lemma_ if len(doc) else t)
-    else:
-        for t in uniq:
-            cache[t] = t
-    
-    return [cache[t] for t in tokens]
+
+    def spacy_lemmas(tokens: List[str]) -> List[str]:
+        return [doc[0].lemma_ if len(doc) else t for doc, t in zip(_en_nlp.pipe(tokens, batch_size=1000), tokens)]
+
+    lemmas = _cache.lemmas([t for tokens in lines for t in tokens], spacy_lemmas)
+    return [[t if t.lower() in preserve_words else lemmas[t] for t in tokens] for tokens in lines]
+
+
+def _lemmatize_en_batch(tokens: List[str], preserve_words: Set[str] | None = None) -> List[str]:
+    return _lemmatize_en_lines([tokens], preserve_words)[0]
+
 
 def tokenize_and_lemmatize(
     text: str,
@@ -110,19 +229,33 @@ def iter_tokenized_lines(
     lemmatize_en: bool = True,
     preserve_empty: bool = False,
     preserve_words: Set[str] | None = None,
+    offset: int = 0,
+    line_batch: int = 10_000,
 ) -> Iterator[List[str]]:
+    """
+    offset — байтовая позиция начала строки, с которой читать (для обработки только дописанной части).
+    Строки лемматизируются пакетами по line_batch: новые для кэша токены всего пакета
+    уходят в spaCy одним вызовом nlp.pipe.
+    """
+    pattern = TOKEN_PATTERN if keep_punct else WORD_PATTERN
     with Path(path).open("r", encoding="utf-8") as f:
-        for raw in f:
-            line = raw.rstrip("\n")
-            if not line.strip():
-                if preserve_empty:
-                    yield []
-                continue
-            yield tokenize_and_lemmatize(
-                line,
-                keep_punct=keep_punct,
-                num_token=num_token,
-                lower=lower,
-                lemmatize_en=lemmatize_en,
-                preserve_words=preserve_words,
-            )
\ No newline at end of file
+        if offset:
+            f.seek(offset)
+        while True:
+            raw_lines = list(islice(f, line_batch))
+            if not raw_lines:
+                return
+            batch = []
+            for raw in raw_lines:
+                line = raw.rstrip("\n")
+                if not line.strip():
+                    if preserve_empty:
+                        batch.append([])
+                    continue
+                if lower:
+                    line = line.lower()
+                batch.append([(num_token if num_token is not None and t.isdigit() else t)
+                              for t in pattern.findall(line)])
+            if lemmatize_en:
+                batch = _lemmatize_en_lines(batch, preserve_words)
+            yield from batch
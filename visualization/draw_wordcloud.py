@@ -3,6 +3,7 @@ import argparse
 from wordcloud import WordCloud
 import matplotlib.pyplot as plt
 from utils.clean_text import clean_text
+from db.columnar import snapshot_tech_comments
 from collections import Counter
 
 EN_STOP = {
@@ -75,7 +76,9 @@ def parse_args():
         prog="export_titles",
         description="Отрисовка облака слов для технологии"
     )
-    p.add_argument("-i", "--input", required=True, help="Путь к входному файлу")
+    p.add_argument("-i", "--input", default=None, help="Путь к входному файлу")
+    p.add_argument("--snapshot", default=None, help="Папка снимка db.scripts.snapshot вместо --input")
+    p.add_argument("--tech", default=None, help="С --snapshot: технология, по комментариям которой строится облако")
     p.add_argument("-o", "--output", required=True, help="Путь к выходному файлу")
     p.add_argument("--extra", help="Дополнительные слова, которые не нужно учитывать")
     return p.parse_args()
@@ -97,9 +100,16 @@ def main() -> int:
     args = parse_args()
     try:
         words = []
-        with open(args.input, 'r') as f:
-            for line in f:
-                words.append(line.strip())
+        if args.snapshot:
+            if not args.tech:
+                raise ValueError("для --snapshot нужен --tech")
+            words = snapshot_tech_comments(args.snapshot, [args.tech]).get(args.tech, [])
+        elif args.input:
+            with open(args.input, 'r') as f:
+                for line in f:
+                    words.append(line.strip())
+        else:
+            raise ValueError("укажите --input или --snapshot")
         extra_stop = {args.extra}
         freqs = build_frequencies(words, extra_stop=extra_stop)
         wordcloud = WordCloud(